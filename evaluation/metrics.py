@@ -43,17 +43,49 @@ class QualityMetricsCalculator():
         strings contains the calculated recommendations for the corresponding actual user action.
         @return:
         """
-        self.results = results_as_dataframe(actual_actions, recommendations)
+        #map all action names to integer ids once, all counting is then done on integer arrays
+        cutoffs = max([len(r) for r in recommendations] or [0])
+        recommended = [action for r in recommendations for action in r]
+        self.actions = pandas.Index(sorted(set(actual_actions) | set(recommended)))
+        self.actual = self.actions.get_indexer(numpy.asarray(actual_actions, dtype=object))
+
+        #one row for each actual action and one column for each cutoff, -1 where fewer recommendations were given
+        self.recommendations = numpy.empty((len(recommendations), cutoffs), dtype=int)
+        self.recommendations.fill(-1)
+        rows = numpy.repeat(numpy.arange(len(recommendations)), [len(r) for r in recommendations])
+        columns = numpy.concatenate([numpy.arange(len(r)) for r in recommendations] or [numpy.zeros(0, dtype=int)])
+        self.recommendations[rows, columns] = self.actions.get_indexer(numpy.asarray(recommended, dtype=object))
+
+        #count for each action and cutoff how often the action was recommended at exactly this position, in total and
+        #when the action was the actual action (i.e. correctly)
+        self.cutoffs = pandas.Index(range(1, cutoffs + 1), name="cutoff")
+        self.occurrences = numpy.bincount(self.actual, minlength=len(self.actions))
+        self.recommended_counts = self.__count_by_action_and_cutoff__(self.recommendations >= 0)
+        self.correct_counts = self.__count_by_action_and_cutoff__(self.recommendations == self.actual[:, None])
+
+    def __count_by_action_and_cutoff__(self, is_counted):
+        """
+        Count the recommendations in all positions where `is_counted` is true, per recommended action and cutoff.
+        """
+        rows, columns = numpy.nonzero(is_counted)
+        cells = self.recommendations[rows, columns] * len(self.cutoffs) + columns
+        counts = numpy.bincount(cells, minlength=len(self.actions) * len(self.cutoffs))
+        return counts.reshape((len(self.actions), len(self.cutoffs)))
 
     def __unique_actions__(self):
         """
         It can happen that one potential user action never happened, but that the corresponding service was recommended.
         To be able to count these false positives, we must calculate the list of all potential actions.
         """
-        occurring_actions = set(self.results.index.values)
-        occurring_services = pandas.melt(self.results).dropna()["value"]
-        occurring_services = set(occurring_services.unique())
-        return sorted(occurring_actions | occurring_services)
+        return list(self.actions)
+
+    def __counts_for_action__(self, counts, action):
+        """
+        Look up the counts of the given action, zero counts if the action never occurred and was never recommended.
+        """
+        if not action in self.actions:
+            return numpy.zeros(len(self.cutoffs), dtype=int)
+        return counts[self.actions.get_loc(action)]
 
     def true_positives(self, action):
 
@@ -63,24 +95,10 @@ class QualityMetricsCalculator():
         @return: A pandas dataset with column TP and several rows, first row lists #TP at cutoff "1", the second row at
         cutoff "2", etc.
         """
-        #get all rows where the actual action corresponds to the given action
-        r = self.results[self.results.index == action]
-
-        if len(r) == 0:
-            #if there are no such rows, then we have zero true positives, fill result dataframe with zeroes
-           true_positives = pandas.Series(0.0, index=self.results.columns)
-        else:
-            #if recommendation matches the action, set column to "1" (true positive), else set to "0" (false negative)
-            r = r.applymap(lambda col: 1 if col == action else 0).fillna(0)
-            #count how many true positives there are in each column
-            r = r.sum()
-            #if have a true positive for n-th recommendation, then also have true positive for n+1, n+2 etc
-            #-> calculate cumulative sum
-            true_positives = r.cumsum(axis=0).apply(float)
-
-        true_positives = pandas.DataFrame(true_positives, columns=["TP"])
-        true_positives.index.name = "cutoff"
-        return true_positives
+        #if have a true positive for n-th recommendation, then also have true positive for n+1, n+2 etc
+        #-> calculate cumulative sum
+        true_positives = self.__counts_for_action__(self.correct_counts, action).cumsum().astype(float)
+        return pandas.DataFrame({"TP": true_positives}, index=self.cutoffs)
 
     def true_positives_for_all(self):
         """
@@ -88,10 +106,8 @@ class QualityMetricsCalculator():
         @return: A pandas with one column for each action, first row lists #TP at cutoff "1", the second row at
         cutoff "2", etc.
         """
-        tp = [self.true_positives(action) for action in self.__unique_actions__()]
-        tp = pandas.concat(tp, axis=1)
-        tp.columns = self.__unique_actions__()
-        return tp
+        true_positives = self.correct_counts.cumsum(axis=1).astype(float)
+        return pandas.DataFrame(true_positives.T, index=self.cutoffs, columns=self.__unique_actions__())
 
     def false_negatives(self, action):
         """
@@ -102,14 +118,9 @@ class QualityMetricsCalculator():
         """
         #the amount of false negatives corresponds to the difference between the total number of occurrences of the
         #action and the number of false positives
-        true_positives = self.true_positives(action)
-        total_occurrences = len(self.results[self.results.index == action])
-        total_occurrences = pandas.Series(total_occurrences, index=true_positives.index)
-        false_negatives = total_occurrences - true_positives["TP"]
-
-        false_negatives = pandas.DataFrame(false_negatives, columns=["FN"])
-        false_negatives.index.name = "cutoff"
-        return false_negatives
+        true_positives = self.true_positives(action)["TP"].values
+        total_occurrences = self.occurrences[self.actions.get_loc(action)] if action in self.actions else 0
+        return pandas.DataFrame({"FN": total_occurrences - true_positives}, index=self.cutoffs)
 
     def false_positives(self, action):
         """
@@ -118,23 +129,10 @@ class QualityMetricsCalculator():
         @return: A pandas dataset with column FP and several rows, first row lists #FP at cutoff "1", the second row at
         cutoff "2", etc.
         """
-        #get all rows where the actual service does NOT correspond to the given action
-        r = self.results[self.results.index != action]
-        if len(r) == 0:
-            #if there are no such rows, then we have zero false positives, fill result dataframe with zeroes
-            false_positives = pandas.Series(0.0, index=self.results.columns)
-        else:
-            #if recommendation matches the action, set column to "1" (false positive), else set to "0" (true negative)
-            r = r.applymap(lambda col: 1 if col == action else 0)
-            #count how many false positives there are in each column
-            r = r.sum()
-            #if have a false positive for n-th recommendation, then also have false positive for n+1, n+2 etc
-            #-> calculate cumulative sum
-            false_positives = r.cumsum(axis=0).apply(float)
-
-        false_positives = pandas.DataFrame(false_positives, columns=["FP"])
-        false_positives.index.name = "cutoff"
-        return false_positives
+        #all recommendations of the action that were not correct are false positives
+        false_positives = self.__counts_for_action__(self.recommended_counts - self.correct_counts, action)
+        false_positives = false_positives.cumsum().astype(float)
+        return pandas.DataFrame({"FP": false_positives}, index=self.cutoffs)
 
     @staticmethod
     def precision(counts):
@@ -180,10 +178,8 @@ class QualityMetricsCalculator():
         @return: A pandas dataframe with one column "# of recommendations". The first row lists the # at cutoff "1", the
         second row at cutoff "2", etc.
         """
-        n = (self.results.count(axis=0)/float(len(self.results))).cumsum()
-        n = pandas.DataFrame({"# of recommendations": n})
-        n.index.name = "cutoff"
-        return n
+        n = (self.recommended_counts.sum(axis=0)/float(len(self.actual))).cumsum()
+        return pandas.DataFrame({"# of recommendations": n}, index=self.cutoffs)
 
     def calculate_for_action(self, action):
         """
@@ -217,21 +213,25 @@ class QualityMetricsCalculator():
         @return: A pandas dataframe containing one column for each of the four quality metrics. The first row lists
         calculated metrics at cutoff "1", the second row at cutoff "2"
         """
-        #make one big matrix with the metrics for all actions
-        actions = self.__unique_actions__()
-        metrics = pandas.concat([self.calculate_for_action(action) for action in actions])
-
-        #count for each action how often the corresponding action actually occurred
-        occurrences = pandas.TimeSeries(self.results.index.values).value_counts()
-        occurrences = occurrences.reindex(actions).fillna(0)
+        #count true positives, false positives and false negatives for all actions and cutoffs at once, one row for
+        #each action and one column for each cutoff
+        true_positives = self.correct_counts.cumsum(axis=1).astype(float)
+        false_positives = (self.recommended_counts - self.correct_counts).cumsum(axis=1).astype(float)
+        false_negatives = self.occurrences[:, None] - true_positives
+
+        #calculate the metrics for all actions, if not defined (division by zero) the metrics are 0
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            precision = numpy.nan_to_num(true_positives / (true_positives + false_positives))
+            recall = numpy.nan_to_num(true_positives / (true_positives + false_negatives))
+            f1 = numpy.nan_to_num((2.0 * precision * recall) / (precision + recall))
 
         #calculate the weighted average for each of the metrics (i.e. actions that occur more often have a higher
         #influence on the overall results for "Precision", "Recall and "F1")
-        actions_as_index = lambda group: group.set_index("action").reindex(actions).fillna(0.0)
-        weighted_average_for_column = lambda col: numpy.average(col.values, weights=occurrences.values)
-        weighted_average = lambda group: actions_as_index(group).apply(weighted_average_for_column)
-        metrics = metrics.groupby(level="cutoff").aggregate(weighted_average)
-        del(metrics["action"])  #get rid of now unnecessary "action" column
+        weighted_average = lambda metric: numpy.average(metric, axis=0, weights=self.occurrences)
+        metrics = pandas.DataFrame({"Precision": weighted_average(precision),
+                                    "Recall": weighted_average(recall),
+                                    "F1": weighted_average(f1)},
+                                   index=self.cutoffs, columns=["Precision", "Recall", "F1"])
 
         #do not need weighted average for # of recommendations, simply add counts as fourth column
         metrics["# of recommendations"] = self.number_of_recommendations()
@@ -245,20 +245,13 @@ class QualityMetricsCalculator():
         """
         cutoff = 1   #only makes sense for cutoff=1
 
-        def confusions_for_action(action):
-            r = self.results[self.results.index == action][cutoff]
-            return r.groupby(r).count()
-
         actions = self.__unique_actions__()
-        matrix = [confusions_for_action(action) for action in actions]
-        matrix = pandas.concat(matrix, axis=1).reindex(actions).transpose()
-        matrix.index = actions
-        matrix = matrix.reindex(actions).fillna(0)
+        recommended = self.recommendations[:, cutoff - 1] if len(self.cutoffs) >= cutoff \
+                      else numpy.zeros(len(self.actual), dtype=int) - 1
+        has_recommendation = recommended >= 0
+        cells = self.actual[has_recommendation] * len(actions) + recommended[has_recommendation]
+        matrix = numpy.bincount(cells, minlength=len(actions) ** 2).reshape((len(actions), len(actions)))
+        matrix = pandas.DataFrame(matrix.astype(float), index=actions, columns=actions)
         matrix.index.name = "Actual action"
 
         return matrix
-
-
-
-
-               
@@ -22,7 +22,7 @@ def houseA():
     recommendation results will be be statistically insignificant for these values. For this reason, when printing or
     plotting results, cut the recommendation results at 14 services.
     """
-    data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config")
+    data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config", cache_dir=config.dataset_cache_directory)
     cutoff_results_at = 14
     return data, cutoff_results_at
     
@@ -31,7 +31,7 @@ def houseB():
     This dataset is partially dominated by one of the sensors, which makes the evaluation results less statistically
     sound, e.g. it leads to large confidence intervals when running 10-fold cross-validation.  
     """
-    data = load_dataset("../datasets/houseB.csv", "../datasets/houseB.config")
+    data = load_dataset("../datasets/houseB.csv", "../datasets/houseB.config", cache_dir=config.dataset_cache_directory)
     cutoff_results_at = 15    
     return data, cutoff_results_at
 
@@ -13,9 +13,10 @@ from evaluation.experiment import Experiment
 from recsys.classifiers.temporal import TemporalEvidencesClassifier
 from recsys.classifiers.binning import initialize_bins
 from recsys.dataset import load_dataset
+import config
 
 #configuration
-data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config")
+data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config", cache_dir=config.dataset_cache_directory)
 intervals_to_test = [#test various settings for delta t_max
                      ("Delta t_max=1200s", initialize_bins(start=0, end=60, width=10) +
                                            initialize_bins(start=60, end=1200, width=30)),
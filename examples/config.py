@@ -2,4 +2,5 @@
 
 plot_directory = "plots/"
 img_type = "pdf"        
+dataset_cache_directory = "cache/"
 
@@ -18,7 +18,7 @@ import config
 
 
 #configuration
-data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config")
+data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config", cache_dir=config.dataset_cache_directory)
 
 #run the classifier on the whole dataset
 cls = TemporalEvidencesClassifier(data.features, data.target_names)
@@ -10,12 +10,13 @@ import pandas
 
 from recsys.classifiers.temporal import TemporalEvidencesClassifier
 from recsys.dataset import load_dataset
+import config
 from evaluation.metrics import QualityMetricsCalculator
 
 
 #configuration
-data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config")
-#data = load_dataset("../datasets/houseB.csv", "../datasets/houseB.config")
+data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config", cache_dir=config.dataset_cache_directory)
+#data = load_dataset("../datasets/houseB.csv", "../datasets/houseB.config", cache_dir=config.dataset_cache_directory)
 
 #run the classifier on the whole dataset and calculate confusion matrix
 cls = TemporalEvidencesClassifier(data.features, data.target_names)
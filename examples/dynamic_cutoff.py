@@ -13,10 +13,11 @@ from evaluation.experiment import Experiment
 from evaluation.metrics import quality_metrics
 from recsys.classifiers.temporal import TemporalEvidencesClassifier, configure_dynamic_cutoff
 from recsys.dataset import load_dataset
+import config
 
 
 #configuration
-data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config")
+data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config", cache_dir=config.dataset_cache_directory)
 methods_to_test = [("Fixed cutoff", None),
                    ("dynamic cutoff=4", configure_dynamic_cutoff(1.0, 0.4, 4)),
                    ("dynamic cutoff=2", configure_dynamic_cutoff(1.0, 0.4, 2))]
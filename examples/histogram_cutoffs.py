@@ -18,7 +18,7 @@ import config
 
 
 #configuration
-data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config")
+data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config", cache_dir=config.dataset_cache_directory)
 to_compare = [1, 2, 3, 4]
 
 #run classifier and count true positives
@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+"""
+Simulate a home that is connected to the recommendation service: train the classifier on the first half of a dataset,
+start the service, warm it up with the events of the first half and replay the events of the second half over a local
+socket with a simulated event publisher.
+Prints how often the actual next action was the first recommendation, and the throughput and latency statistics of the
+service.
+"""
+
+import sys
+sys.path.append("..")
+
+import numpy
+import pandas
+
+from recsys.classifiers.temporal import TemporalEvidencesClassifier
+from recsys.dataset import load_dataset, read_config
+from recsys.service import RecommendationService, ServiceThread, EventPublisher
+import config
+
+
+#configuration
+path_to_csv, path_to_config = "../datasets/houseA.csv", "../datasets/houseA.config"
+#path_to_csv, path_to_config = "../datasets/houseB.csv", "../datasets/houseB.config"
+data = load_dataset(path_to_csv, path_to_config, cache_dir=config.dataset_cache_directory)
+events = pandas.read_csv(path_to_csv)
+name, excluded_sensors, excluded_actions = read_config(path_to_csv, path_to_config)
+
+#train on the first half of the dataset
+train = len(data.target) / 2
+cls = TemporalEvidencesClassifier(data.features, data.target_names, cache_size=10000)
+cls = cls.fit(data.data[:train], data.target[:train])
+
+#send the events of the training period without requesting recommendations, so that the service knows the value and
+#the time of the last change of each sensor, then replay the events that happened after the last training instance;
+#the events of sensors that are excluded by the config are answered with errors
+service = ServiceThread(RecommendationService(cls))
+publisher = EventPublisher(service.address)
+try:
+    is_training = (pandas.to_datetime(events["timestamp"]) <= data.times[train - 1]).values
+    publisher.publish(events[is_training], recommend=False)
+    replayed = events[numpy.invert(is_training)]
+    answers = publisher.publish(replayed)
+
+    #only count the events that are user actions in the dataset, i.e. skip excluded sensors and actions
+    actions = replayed["sensor"].astype(str) + "=" + replayed["value"].astype(str)
+    counted = numpy.invert(replayed["sensor"].isin(excluded_sensors) | actions.isin(excluded_actions)).values
+    hits = [len(answer["recommendations"]) > 0 and answer["recommendations"][0] == action
+            for answer, action, count in zip(answers, actions, counted) if count]
+    print "first recommendation was the next action for %d of %d events" % (sum(hits), len(hits))
+
+    statistics = publisher.send({"type": "statistics"})
+    for name in sorted(statistics.keys()):
+        print "%-28s %s" % (name, statistics[name])
+finally:
+    publisher.close()
+    service.stop()
@@ -6,6 +6,7 @@ in the paper in Section 6.7 and in the dissertation in Section 5.5.9,
 """
 
 import timeit
+import time
 
 #setup necessary to run timeit function
 setup = '''
@@ -30,3 +31,34 @@ test_time = seconds_to_milliseconds(min(timer.repeat(repeat=3, number=1)))
 test_time_per_instance = test_time / num_instances
 #print "Total testing time %.4f [ms]" %test_time
 print "Testing time per instance %.4f [ms]" % test_time_per_instance
+
+
+def compare_layouts(num_train_instances=20000):
+    """
+    Compare the dense and the sparse layout of the observations (see `Observations` in classifiers/temporal.py) for the
+    same number of sensors. In contrast to the experiment above, the classifiers are trained on a synthetic dataset:
+    randomly filled observations have no sparse structure.
+    @param num_train_instances: The number of training instances.
+    @return: None
+    """
+    from synthetic import generate_synthetic_dataset
+    from recsys.classifiers.temporal import TemporalEvidencesClassifier
+
+    data = generate_synthetic_dataset(num_sensors, nominal_values_per_sensor, num_train_instances + num_instances)
+    train_data, train_target = data.data[:num_train_instances], data.target[:num_train_instances]
+    test_data = data.data[num_train_instances:]
+    for layout in ["dense", "sparse"]:
+        cls = TemporalEvidencesClassifier(data.features, data.target_names, layout=layout)
+        start = time.time()
+        cls = cls.fit(train_data, train_target)
+        train_time = seconds_to_milliseconds(time.time() - start)
+        start = time.time()
+        cls.predict(test_data)
+        test_time_per_instance = seconds_to_milliseconds(time.time() - start) / num_instances
+        model_size = sum(array.nbytes for array in cls.model.as_arrays().values()) / 2.0 ** 20
+        print "Layout %-6s training time %.1f [ms], testing time per instance %.4f [ms], model size %.1f [MB]" \
+              % (layout, train_time, test_time_per_instance, model_size)
+
+
+if __name__ == "__main__":
+    compare_layouts()
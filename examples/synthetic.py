@@ -11,7 +11,7 @@ import pandas
 import numpy
 
 from recsys.dataset import events_to_dataset, dataset_to_sklearn
-from recsys.classifiers.temporal import TemporalEvidencesClassifier, Source
+from recsys.classifiers.temporal import TemporalEvidencesClassifier, Observations
 
 def generate_random_events(sensors, num_events, at_least_one_per_setting=False):
     """
@@ -81,24 +81,15 @@ def generate_trained_classifier(num_sensors, nominal_values_per_sensor, num_test
     """
 
     def generate_classifier(sensors):
-        #create a source for the setting sensor=value, fill it with random observations
-        def create_source(sensor, value, num_bins):
-            random_observations = lambda: pandas.Series(numpy.random.randint(0, 100, len(targets)), index=targets)
-            temporal = pandas.concat([random_observations() for b in range(num_bins)], axis=1)
-            total = random_observations()
-            return Source(sensor, value, total, temporal)
-
         #initialize the classifier
         all_settings = [(sensor, value) for sensor in sensors.keys() for value in sensors[sensor]]
         features = sorted(all_settings) + ["%s_timedelta" % sensor for sensor in sorted(sensors.keys())]
         targets = ["%s=%s" % (sensor, value) for sensor, value in sorted(all_settings)]
         cls = TemporalEvidencesClassifier(features, targets)
 
-        #create a random sources for each possible setting
-        cls.sources = {(sensor, value): create_source(sensor, value, len(cls.bins))
-                       for sensor, value in all_settings}
-        cls.max_total = max(source.total_counts.sum() for source in cls.sources.values())
-        cls.max_temporal = max(source.max_temporal() for source in cls.sources.values())
+        #fill the classifier with random observations for each possible setting, in each bin and in total
+        counts = numpy.random.randint(0, 100, (len(cls.settings_columns), len(cls.bins) + 1, len(cls.target_names)))
+        cls.model = Observations(cls.settings_columns, cls.target_names, counts)
 
         return cls
 
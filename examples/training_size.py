@@ -18,7 +18,7 @@ import config
 
 
 #configuration
-data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config")
+data = load_dataset("../datasets/houseA.csv", "../datasets/houseA.config", cache_dir=config.dataset_cache_directory)
 
 #some util methods
 elapsed_time = lambda end: end - data.times[0]
@@ -50,3 +50,30 @@ def combine_dempsters_rule(masses):
     combined_conflict = max(combined_conflict, 0.0)  #rounding errors sometimes lead to conflict -0.0000000001
 
     return combined_masses, combined_conflict, combined_theta
+
+
+def combine_dempsters_rule_batch(masses):
+    """
+    Vectorized version of `combine_dempsters_rule` that combines the masses for many situations at once.
+    @param masses: A numpy array with shape (situations, sources, options), for each situation the mass distributions
+    of all sources. Situations with fewer sources are padded with sources that have zero masses, these sources have a
+    theta of 1 and do not change the result of the combination.
+    @return: The combined masses as a numpy array with shape (situations, options), the conflict and the theta for each
+    situation as numpy arrays.
+    """
+    #convert each mass-vector into a q-vector and calculate theta for each mass vector
+    thetas = 1.0 - masses.sum(axis=2)
+    masses_as_q = masses + thetas[:, :, numpy.newaxis]
+
+    #combine masses and thetas by multiplying over all sources
+    combined_masses_as_q = masses_as_q.prod(axis=1)
+    combined_theta = thetas.prod(axis=1)
+
+    #convert masses back from q-form to mass-form
+    combined_masses = combined_masses_as_q - combined_theta[:, numpy.newaxis]
+
+    #any remaining mass not assigned to specific target or to theta forms the combined conflict
+    combined_conflict = 1.0 - combined_masses.sum(axis=1) - combined_theta
+    combined_conflict = numpy.maximum(combined_conflict, 0.0)  #rounding errors sometimes lead to conflict -0.0000000001
+
+    return combined_masses, combined_conflict, combined_theta
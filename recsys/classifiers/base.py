@@ -4,18 +4,195 @@ This module contains functions and classes that are used by all implemented clas
 """
 
 
+from collections import deque, OrderedDict
+from multiprocessing import Pool, cpu_count
+import random
+
 from sklearn.base import BaseEstimator
+from scipy import sparse
 import numpy
 
+from recsys.dataset import SplitMatrix, Vocabulary
+
+
+def times_in_seconds(times):
+    """
+    Convert the timestamps of a dataset (see the `times` attribute of `dataset.dataset_to_sklearn`) into seconds.
+    @param times: A numpy array of datetime64 timestamps or of seconds.
+    @return: A numpy float array with the seconds since the epoch.
+    """
+    times = numpy.asarray(times)
+    if times.dtype.kind == "M":
+        return times.astype("datetime64[ns]").astype(numpy.int64) / 1e9
+    return times.astype(float)
+
+
+#the classifier, the test data and the arguments of the currently running `BaseClassifier.predict_in_parallel`, the
+#forked worker processes inherit them instead of receiving them with every task
+parallel_predict_arguments = None
+
+
+def predict_rows(rows):
+    """
+    Calculate the recommendations for some of the rows of the test data in a worker process of
+    `BaseClassifier.predict_in_parallel`.
+    @param rows: A tuple (start, end) with the range of rows.
+    @return: The recommendations for the rows.
+    """
+    classifier, test_data, kwargs = parallel_predict_arguments
+    start, end = rows
+    return classifier.predict(test_data[start:end], **kwargs)
+
+
+class ObservationHistory():
+    """
+    Keeps track of when observations were made, for classifiers that should count recent observations more than old
+    ones because the habits of the user drift. Observations are identified by integer keys chosen by the classifier
+    (e.g. one key for each combination of setting and target), the classifier keeps one count for each key. Two modes
+    are supported:
+       half_life - exponential decay, the weight of an observation halves every `half_life` seconds
+       window - sliding window, only observations from the last `window` seconds are counted
+    If both are None, all observations have weight 1. Memory and update costs do not depend on the length of the
+    history: with exponential decay, new observations get exponentially growing weights instead of decaying all old
+    counts ("forward decay"), with a sliding window only the observations inside the window are kept.
+    """
+
+    #move the reference time of the forward decay before the weights get too large for floats
+    max_log_weight = 500.0
+
+    def __init__(self, half_life=None, window=None):
+        """
+        @param half_life: The half-life of the exponential decay in seconds, or None.
+        @param window: The length of the sliding window in seconds, or None.
+        """
+        if half_life is not None and window is not None:
+            raise ValueError("Use either a half-life or a sliding window, not both")
+        self.half_life = half_life
+        self.window = window
+        self.reference_time = None
+        self.current_time = None
+        #for the sliding window, the keys and times of the observations inside the window, in chunks as added
+        self.chunks = deque()
+
+    def is_active(self):
+        """
+        @return: True if old observations are forgotten, i.e. if the classifier needs the times of the observations.
+        """
+        return self.half_life is not None or self.window is not None
+
+    def add(self, keys, times):
+        """
+        Register new observations, the times of the observations should not be earlier than the times of previously
+        added observations.
+        @param keys: A numpy array with the keys of the new observations.
+        @param times: A numpy array with the time of each observation in seconds, or None if the history is not active.
+        @return: A tuple (keys, weights, rescale). The counts of the classifier must first be multiplied by `rescale`,
+        then the weights must be added to the counts for the keys. For a sliding window, the returned keys include the
+        observations that left the window with weight -1.
+        """
+        weights = numpy.ones(len(keys))
+        if not self.is_active():
+            return keys, weights, 1.0
+        if times is None:
+            raise ValueError("The times of the observations are needed for a half-life or a sliding window")
+        times = times_in_seconds(times)
+        if len(times) == 0:
+            return keys, weights, 1.0
+        self.current_time = max(self.current_time, times.max()) if self.current_time is not None else times.max()
+
+        if self.half_life is not None:
+            return self.__add_decayed__(keys, times)
+
+        #forget all observations that are older than the window
+        self.chunks.append((keys, times))
+        start = self.current_time - self.window
+        expired = []
+        while len(self.chunks) > 0 and self.chunks[0][1].min() < start:
+            chunk_keys, chunk_times = self.chunks.popleft()
+            is_expired = chunk_times < start
+            expired.append(chunk_keys[is_expired])
+            if not is_expired.all():
+                self.chunks.appendleft((chunk_keys[~is_expired], chunk_times[~is_expired]))
+                break
+        expired = numpy.concatenate(expired) if len(expired) > 0 else numpy.empty(0, dtype=keys.dtype)
+        return numpy.r_[keys, expired], numpy.r_[weights, -numpy.ones(len(expired))], 1.0
+
+    def __add_decayed__(self, keys, times):
+        """
+        Calculate forward decay weights for new observations, see `add`.
+        """
+        decay_rate = numpy.log(2) / self.half_life
+        if self.reference_time is None:
+            self.reference_time = times.min()
+
+        #if the weights get too large, move the reference time to now and shrink all existing counts accordingly
+        rescale = 1.0
+        if decay_rate * (self.current_time - self.reference_time) > self.max_log_weight:
+            rescale = numpy.exp(-decay_rate * (self.current_time - self.reference_time))
+            self.reference_time = self.current_time
+
+        return keys, numpy.exp(decay_rate * (times - self.reference_time)), rescale
+
+    def scale(self):
+        """
+        With exponential decay, the counts of the classifier are relative to the reference time. The counts must be
+        multiplied with this factor to obtain the decayed counts at the time of the latest observation.
+        @return: The factor, 1.0 if there is no exponential decay.
+        """
+        if self.half_life is None or self.reference_time is None:
+            return 1.0
+        return numpy.exp(-numpy.log(2) / self.half_life * (self.current_time - self.reference_time))
 
-def apply_mask(values, mask):
+
+class LRUCache():
     """
-    Convenience method to filter out values from a list according to some binary masking array.
-    @param values: The list that should be filtered.
-    @param mask: The masking array, must have the same length as the `values` array.
-    @return: A list that contains only the selected values.
+    A bounded cache that evicts the least recently used entry when it is full. Used by classifiers to remember the
+    recommendations for situations that recur often, e.g. while no sensor changes its value.
     """
-    return [value for value, is_set in zip(values, mask) if is_set == 1]
+
+    def __init__(self, max_size):
+        """
+        @param max_size: The maximal number of entries in the cache.
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        #how often a looked up key was found in the cache and how often it was not found
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Look up the value for a key and mark the key as the most recently used one.
+        @param key: A hashable key.
+        @return: The cached value, or None if the key is not in the cache.
+        """
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """
+        Store the value for a key, evicting the least recently used entry if the cache is full.
+        @param key: A hashable key.
+        @param value: The value, must not be None.
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all entries, e.g. because the classifier has been trained again. The hit and miss counters are kept.
+        """
+        self.entries.clear()
 
 
 class BaseClassifier(BaseEstimator):
@@ -38,32 +215,85 @@ class BaseClassifier(BaseEstimator):
 
         #identify which columns are settings columns and which columns are timedelta columns
         self.settings_columns = [col for col in features if isinstance(col, tuple)]
-        self.timedelta_columns = [col for col in features if not col in self.settings_columns]
+        self.timedelta_columns = [col for col in features if not isinstance(col, tuple)]
+        self.settings_positions = [i for i, col in enumerate(features) if isinstance(col, tuple)]
+        self.timedelta_positions = [i for i, col in enumerate(features) if not isinstance(col, tuple)]
 
         self.target_names = sorted(target_names)
-        self.targets_as_tuples = [tuple(target.split("=")) for target in self.target_names]
 
-    def currently_set(self, instance):
+        #integer ids for settings and targets, used internally instead of the names
+        self.vocabulary = Vocabulary(features, target_names)
+
+    def split_data(self, data):
         """
-        Identify which of the possible settings are currently active. For example, if self.settings_columns =
-        [(door, open), (door, closed), (window, open), (window, closed) and instance=[1, 0, NaN, NaN], then this
-        method returns [(door, open)],
-        @param instance: An array of binary values (plus NaN) that represent current settings. This array must have
-        the same length as self.settings_columns and binary entries correspond to the entries in self.settings_columns.
-        @return: A list of tuples, listing all currently active settings.
+        Split a data matrix into the part with the current settings and the part with the timedeltas.
+        @param data: A matrix with len(self.features) columns and one row for each instance, either a numpy array or a
+        `SplitMatrix` (see `dataset.dataset_to_sklearn`).
+        @return: A tuple of two matrices. The first matrix has one column for each entry in self.settings_columns and
+        is either a numpy array or a scipy sparse matrix. The second matrix is a numpy array with one column for each
+        entry in self.timedelta_columns, it contains the timedeltas in seconds (NaN if not known).
         """
-        return apply_mask(self.settings_columns, instance)
+        if isinstance(data, SplitMatrix):
+            return data.settings, data.timedeltas_in_seconds()
+        data = numpy.asarray(data)
+        return data[:, self.settings_positions], data[:, self.timedelta_positions]
 
-    def possible_targets_mask(self, current_settings):
+    def predict_in_parallel(self, test_data, n_jobs, **kwargs):
         """
-        Calculate which of all available targets (i.e. user actions) are possible in the current situation. An action is
-        only possible under some given sensor settings, e.g. a window can only be opened if it is currently closed.
-        @param current_settings: A list of tuples, listing all currently active settings.
-        @return: A list of tuples, listing all possible targets.
+        Calculate the recommendations for the test data in a pool of worker processes. The rows of the test data are
+        split into contiguous ranges, each worker calls `predict` for one range at a time and the results are
+        reassembled in the order of the rows. The worker processes are forked after the classifier and the test data
+        have been stored in a global variable, so they share the memory of the model and of the test data (or the
+        memory-mapped files, see `dataset.load_dataset_npy` and `temporal.load_classifier`) with the current process;
+        only the ranges and the recommendations are transferred. Changes that the workers make to the classifier, e.g.
+        to a cache, are not visible in the current process.
+        @param test_data: The test data, see `predict`.
+        @param n_jobs: The number of worker processes, None for the number of cpus.
+        @param kwargs: Further arguments for `predict`.
+        @return: The recommendations for each instance in the test data, the same as returned by `predict`.
         """
-        is_possible_target = lambda target: 0 if target in current_settings else 1
-        mask = numpy.array([is_possible_target(target) for target in self.targets_as_tuples])
-        return mask
+        global parallel_predict_arguments
+
+        n_jobs = n_jobs or cpu_count()
+        num_rows = len(test_data)
+        #several ranges per worker, so that the workers finish at about the same time
+        borders = numpy.linspace(0, num_rows, min(4 * n_jobs, num_rows) + 1).astype(int)
 
+        parallel_predict_arguments = (self, test_data, dict(kwargs, n_jobs=1))
+        try:
+            #reseed the random number generator in each worker, otherwise all workers continue with the same sequence
+            pool = Pool(n_jobs, initializer=random.seed)
+            try:
+                results = pool.map(predict_rows, zip(borders[:-1], borders[1:]), chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            parallel_predict_arguments = None
 
+        return [recommendation for rows in results for recommendation in rows]
 
+    def active_settings(self, settings):
+        """
+        Identify for each instance which of the possible settings are currently active.
+        @param settings: The settings part of a data matrix as returned by `split_data`.
+        @return: A list with one numpy array for each instance. Each array contains the indexes of the currently active
+        settings in self.settings_columns, in ascending order.
+        """
+        if settings.shape[0] == 0:
+            return []
+        rows, columns = self.active_settings_coordinates(settings)
+        return numpy.split(columns, numpy.searchsorted(rows, numpy.arange(1, settings.shape[0])))
+
+    def active_settings_coordinates(self, settings):
+        """
+        Identify all currently active settings of all instances at once.
+        @param settings: The settings part of a data matrix as returned by `split_data`.
+        @return: Two numpy arrays of the same length: the instances and the ids of the active settings, sorted by
+        instance and then by setting.
+        """
+        if sparse.issparse(settings):
+            settings = sparse.csr_matrix(settings)
+            settings.sort_indices()
+            return settings.nonzero()
+        return numpy.nonzero(settings == 1)
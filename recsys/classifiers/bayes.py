@@ -1,9 +1,8 @@
 # -*- coding: UTF-8 -*-
 
-import pandas
 import numpy
 
-from base import BaseClassifier
+from base import BaseClassifier, ObservationHistory
 
 
 class NaiveBayesClassifier(BaseClassifier):
@@ -13,10 +12,20 @@ class NaiveBayesClassifier(BaseClassifier):
 
     name = "NaiveBayes"
 
-    def __init__(self, features, target_names):
+    def __init__(self, features, target_names, half_life=None, window=None):
+        """
+        Initialize the classifier.
+        @param features: see `BaseClassifier.__init__()`.
+        @param target_names: see `BaseClassifier.__init__()`.
+        @param half_life: If not None, older observations count less: the weight of an observation halves every
+        `half_life` seconds. See `ObservationHistory`.
+        @param window: If not None, only observations from the last `window` seconds are counted.
+        """
         BaseClassifier.__init__(self, features, target_names)
+        self.half_life = half_life
+        self.window = window
 
-    def fit(self, train_data,train_target):
+    def fit(self, train_data, train_target, train_times=None):
         """
         Train the classifier.
         @param train_data: A matrix with len(self.features) columns and one row for each instance in the dataset. Each
@@ -25,86 +34,93 @@ class NaiveBayesClassifier(BaseClassifier):
         @param train_target: An array of targets (length of the array corresponds to the number of rows in train_data).
         Each target represents the action that user performed in the situation described by the corresponding row
         in train_data.
+        @param train_times: An array with the timestamp of each target, only needed if the classifier uses a half-life
+        or a sliding window.
+        @return: self-reference for this classifier
+        """
+        #raw counts: how often each target was seen in each setting (key setting * targets + target), followed by
+        #how often each target was seen overall (key settings * targets + target)
+        self.history = ObservationHistory(self.half_life, self.window)
+        self.observations = numpy.zeros((len(self.settings_columns) + 1) * len(self.target_names))
+        self.__add_observations__(train_data, train_target, train_times)
+
+        return self
+
+    def partial_fit(self, new_data, new_target, new_times=None):
+        """
+        Update the trained classifier with new training data, the result is the same as calling `fit` with all
+        training data.
+        @param new_data: A matrix with the new training instances, see `fit`.
+        @param new_target: An array of targets for the new training instances, see `fit`.
+        @param new_times: An array with the timestamps of the new targets, see `fit`.
         @return: self-reference for this classifier
         """
-        def calculate_priors(data):
-            """
-            Count how often each target (user action) was seen overall. Performs additive smoothing and normalizes
-            the counts.
-            @param data:
-            @return:
-            """
-            #count how often each target was seen, set to 0 if target has never been seen
-            counts_per_target = data.index.to_series().value_counts(sort=False)
-            counts_per_target = counts_per_target.reindex(self.target_names).fillna(0)
-            #additive smoothing (add one to every count), necessary so that NaiveBayes does not degrade for zero-counts
-            counts_per_target += 1
-            #normalize
-            normalized_counts = counts_per_target.div(counts_per_target.sum())
-            return normalized_counts.values
-
-        def calculate_counts_per_setting(data):
-            """
-            Count how often each target was seen in each setting.  Performs additive smoothing and normalizes
-            the counts.
-            @param data:
-            @return:
-            """
-            #count how often each target was seen in each settings, set to 0 if target has never been seen in a setting
-            counts_per_setting = data.groupby(data.index, sort=False).sum()
-            counts_per_setting = counts_per_setting.reindex(self.target_names).fillna(0)
-            #additive smoothing (add one to every count), necessary so that NaiveBayes does not degrade for zero-counts
-            counts_per_setting += 1
-            #normalize the counts per sensor
-            normalize = lambda counts_per_sensor: counts_per_sensor.div(counts_per_sensor.sum(axis=1), axis=0)
-            normalized_counts = counts_per_setting.groupby(lambda (sensor, value): sensor, axis=1).transform(normalize)
-
-            #convert to dictionary of numpy arrays for faster calculations later on
-            normalized_counts = {setting: normalized_counts[setting].values for setting in normalized_counts.columns}
-            return normalized_counts
-
-        #load training data and targets into pandas dataframe
-        train_data = pandas.DataFrame(train_data)
-        train_data.columns = self.features
-        train_data.index = train_target
-
-        #keep only the columns with current sensor settings, since Naive Bayes does not use timedeltas
-        train_data = train_data[self.settings_columns]
-
-        #calculate how often each target was seen and how often it was seen in specific settings
-        self.priors = calculate_priors(train_data)
-        self.counts = calculate_counts_per_setting(train_data)
+        if not hasattr(self, "observations"):
+            return self.fit(new_data, new_target, new_times)
+        self.__add_observations__(new_data, new_target, new_times)
 
         return self
 
-    def predict(self, test_data):
+    def __add_observations__(self, data, target, times):
+        """
+        Count the observations in the training data and recalculate priors and counts.
+        """
+        num_settings, num_targets = len(self.settings_columns), len(self.target_names)
+
+        #keep only the columns with current sensor settings, since Naive Bayes does not use timedeltas; targets that
+        #are not known to the classifier are not counted
+        target = self.vocabulary.target_ids(target)
+        instances, settings = self.active_settings_coordinates(self.split_data(data)[0])
+        is_known = target[instances] >= 0
+        instances, settings = instances[is_known], settings[is_known]
+        targets = numpy.flatnonzero(target >= 0)
+
+        #count how often each target was seen in each setting and how often each target was seen overall
+        keys = numpy.r_[settings * num_targets + target[instances], num_settings * num_targets + target[targets]]
+        times = None if times is None else numpy.asarray(times)[numpy.r_[instances, targets]]
+        keys, weights, rescale = self.history.add(keys, times)
+        self.observations *= rescale
+        if len(keys) > 0:
+            self.observations += numpy.bincount(keys, weights=weights, minlength=len(self.observations))
+
+        #with exponential decay, the raw counts are relative to a reference time
+        counts = self.observations * self.history.scale()
+
+        #additive smoothing (add one to every count), necessary so that NaiveBayes does not degrade for zero-counts,
+        #then normalize the counts overall and per sensor
+        priors = counts[num_settings * num_targets:] + 1
+        self.priors = priors / priors.sum()
+        counts_per_setting = counts[:num_settings * num_targets].reshape((num_settings, num_targets)) + 1
+        settings_of_sensor = numpy.equal.outer(numpy.arange(len(self.vocabulary.sensors)),
+                                               self.vocabulary.setting_sensor).astype(float)
+        counts_per_sensor = numpy.dot(settings_of_sensor, counts_per_setting)
+        self.counts = counts_per_setting / counts_per_sensor[self.vocabulary.setting_sensor]
+
+    def predict(self, test_data, n_jobs=1):
         """
         Calculate recommendations for the test_data
         @param test_data: A matrix with len(self.features) columns and one row for each instance in the dataset. Each
         row describes a user situation with current sensor settings and information on how long these settings have
         not changed.
+        @param n_jobs: The number of processes that calculate the recommendations, None for the number of cpus. See
+        `BaseClassifier.predict_in_parallel`.
         @return: Resulting recommendations for each instance in the dataset (a list of list of strings).
         """
+        if n_jobs != 1:
+            return self.predict_in_parallel(test_data, n_jobs)
 
-        #load test data into pandas dataframe
-        test_data = pandas.DataFrame(test_data)
-        test_data.columns = self.features
-
-        #keep only the columns with current sensor settings, since Naive Bayes does not use timedeltas
-        test_data = test_data[self.settings_columns].values
+        #keep only the currently active settings, since Naive Bayes does not use timedeltas
+        test_data = self.active_settings(self.split_data(test_data)[0])
 
         #calculate sorted recommendations for one instance
         def predict_for_instance(instance):
 
-            #find which sensor values are currently set
-            currently_set = self.currently_set(instance)
-
             #calculate which targets (user actions) are currently possible (possible targets are represented by 1,
             #not currently possible targets are represented by 0)
-            possible_targets_mask = self.possible_targets_mask(currently_set)
+            possible_targets_mask = self.vocabulary.possible_targets_mask(instance)
 
             #lookup observations for the current settings
-            counts = [self.counts[setting] for setting in currently_set]
+            counts = list(self.counts[instance])
 
             #calculate posteriors, set posteriors for not currently possible targets to zero and normalize
             posteriors = reduce(numpy.multiply, counts) * self.priors
@@ -130,9 +146,10 @@ class NaiveBayesClassifier(BaseClassifier):
         @return:
         """
         line_to_string = lambda target, count: "%s %.2f" % (target, count)
-        print "\n".join([line_to_string(target, count) for target, count in self.priors.iteritems()])
+        print "\n".join([line_to_string(target, count) for target, count in zip(self.target_names, self.priors)])
 
         format_line = lambda target, (sensor, value), count: "%s %s %s %.2f" % (target, sensor, value, count)
-        output_for_target = lambda target: "\n".join([format_line(target, setting, count)
-                                                      for setting, count in sorted(self.counts.loc[target].iteritems())])
-        print "\n".join([output_for_target(target) for target in sorted(self.counts.index)])
+        sorted_settings = sorted(enumerate(self.settings_columns), key=lambda (s, setting): setting)
+        output_for_target = lambda t, target: "\n".join([format_line(target, setting, self.counts[s, t])
+                                                         for s, setting in sorted_settings])
+        print "\n".join([output_for_target(t, target) for t, target in enumerate(self.target_names)])
@@ -44,3 +44,74 @@ def smooth(x, window_len=9, window='hanning'):
     y = numpy.convolve(w/w.sum(), s, mode='same')
     return y[window_len:-window_len+1]
 
+
+def create_lookup_table(bins, max_size=100000):
+    """
+    If all interval borders are whole seconds (as for the intervals generated by `initialize_bins`), the bin index of a
+    timedelta only depends on the whole seconds of the timedelta. In this case the bin indexes for all whole seconds
+    between the first and the last interval border can be calculated in advance, see `digitize`.
+    @param bins: A list of interval borders.
+    @param max_size: Do not create lookup tables with more than `max_size` entries.
+    @return: A numpy array with the bin index for each whole second from bins[0] - 1 to bins[-1], or None if the
+    interval borders are not whole seconds or the table would be too large.
+    """
+    borders = numpy.asarray(bins, dtype=float)
+    if len(borders) == 0 or numpy.any(borders != numpy.floor(borders)) or borders[-1] - borders[0] > max_size:
+        return None
+    seconds = numpy.arange(borders[0], borders[-1])
+    #first entry for all timedeltas before the first border, last entry for all timedeltas after the last border
+    return numpy.concatenate([[0], numpy.searchsorted(borders, seconds, side="right"), [-1]])
+
+
+def digitize(values, bins, lookup_table=None):
+    """
+    Map timedeltas to the index of the interval they fall into, the result is the same as for `numpy.digitize`, but
+    the values can have any shape. Timedeltas that can not be placed in a regular bin (i.e. timedeltas larger than the
+    last interval border) and missing timedeltas (NaN) are mapped to -1.
+    @param values: A numpy array of timedeltas in seconds.
+    @param bins: A list of interval borders.
+    @param lookup_table: Optionally a lookup table as created by `create_lookup_table` for these interval borders,
+    replaces the binary search for each timedelta by a single lookup.
+    @return: A numpy array of bin indexes with the same shape as `values`.
+    """
+    values = numpy.asarray(values, dtype=float)
+    if lookup_table is None:
+        digitized = numpy.digitize(values.ravel(), bins).reshape(values.shape)
+        digitized[(digitized == len(bins)) | numpy.isnan(values)] = -1
+    else:
+        #position in the lookup table, truncating to whole seconds; clip all timedeltas before the first or after the
+        #last border to the first or last entry of the table
+        positions = values - (bins[0] - 1)
+        numpy.clip(positions, 0, len(lookup_table) - 1, out=positions)
+        positions[numpy.isnan(positions)] = len(lookup_table) - 1
+        digitized = lookup_table.take(positions.astype(int))
+    return digitized
+
+
+def smooth_rows(x, window_len=9, window='hanning'):
+    """
+    Perform the same smoothing as `smooth` for each row of a matrix. All rows are padded in the same way as in `smooth`
+    and are then smoothed with a single convolution; each smoothed value only depends on values in its own padded row,
+    so the results are the same as when smoothing each row separately.
+    @param x: A two-dimensional numpy array, each row is smoothed.
+    @param window_len: The size of the window.
+    @param window:  The type of window from 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'
+    @return: A numpy array with the same shape as x that contains the smoothed rows.
+    """
+    window_len = min(window_len, x.shape[1]-1)
+    if x.ndim != 2:
+        raise ValueError("smooth_rows only accepts 2 dimension arrays.")
+    if x.shape[1] < window_len:
+        raise ValueError("Input vectors need to be bigger than window size.")
+    if window_len < 3 or len(x) == 0:
+        return x
+    if not window in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
+        raise ValueError("Window is one of 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'")
+
+    s = numpy.hstack([2*x[:, :1]-x[:, window_len-1::-1], x, 2*x[:, -1:]-x[:, -1:-window_len:-1]])
+    if window == 'flat':
+        w = numpy.ones(window_len,'d')
+    else:
+        w = eval('numpy.'+window+'(window_len)')
+    y = numpy.convolve(w/w.sum(), s.ravel(), mode='same').reshape(s.shape)
+    return y[:, window_len:-window_len+1]
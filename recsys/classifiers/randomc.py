@@ -2,8 +2,6 @@
 
 import random
 
-import pandas
-
 from base import BaseClassifier
 
 
@@ -19,17 +17,16 @@ class RandomClassifier(BaseClassifier):
     def fit(self, train_data,train_target):
         return self
 
-    def predict(self, test_data):
+    def predict(self, test_data, n_jobs=1):
+        if n_jobs != 1:
+            return self.predict_in_parallel(test_data, n_jobs)
 
-        #load test data into pandas dataframe and keep only the columns with current sensor settings
-        test_data = pandas.DataFrame(test_data)
-        test_data.columns = self.features
-        test_data = test_data[self.settings_columns].values
+        #keep only the currently active settings
+        test_data = self.active_settings(self.split_data(test_data)[0])
 
         #to predict for instance: randomly order the possible targets
         def predict_for_instance(instance):
-            currently_set = self.currently_set(instance)
-            possible_targets_mask = self.possible_targets_mask(currently_set)
+            possible_targets_mask = self.vocabulary.possible_targets_mask(instance)
             possible_targets = [target for target, is_possible
                                 in zip(self.target_names, possible_targets_mask) if is_possible]
             random.shuffle(possible_targets)
@@ -6,15 +6,18 @@ binning.py).
 """
 
 import textwrap
+import json
+import os
 
 import pandas
 import numpy
+from scipy import sparse
 
 from profilehooks import profile
 
-from base import BaseClassifier
-from binning import smooth, initialize_bins
-from DS import combine_dempsters_rule
+from base import BaseClassifier, ObservationHistory, LRUCache
+from binning import smooth_rows, initialize_bins, create_lookup_table, digitize
+from DS import combine_dempsters_rule_batch
 
 
 u"""
@@ -22,6 +25,9 @@ As default, the classifier uses bins of width 10 seconds for timedelta ∆t ∈
 """
 default_bins = initialize_bins(0, 60, 10) + initialize_bins(60, 300, 30)
 
+#version of the format in which `TemporalEvidencesClassifier.save` stores trained classifiers
+model_storage_version = 2
+
 #numpy.seterr(all="warn")
 
 class Source():
@@ -97,24 +103,16 @@ class Source():
         that the source attributes to the corresponding target.
         """
 
-        #for all targets look up how many observations this source has in the current bin
-        counts = self.counts(bin)
-
-        #keep only observations for currently possible targets
-        counts *= possible_targets_mask
-
-        #calculate the current weight of this source
-        counts_sum = counts.sum()
+        #the weight of the source is the sum of the counts for the possible targets divided by max_temporal (or
+        #discounted and divided by max_total), distributing this weight over the possible targets in proportion to their
+        #counts simplifies to normalizing the counts directly; without any observations all masses are zero
         if self.__has_temporal_knowledge__(bin):
-            weight = counts_sum/max_temporal
+            normalization = 1.0 / max_temporal if max_temporal > 0 else 0.0
+            counts = self.temporal_counts[bin]
         else:
-            weight = counts_sum/max_total * self.__no_temporal_knowledge_discount__
-
-        #calculate the mass distribution for the possible targets
-        if counts_sum == 0:
-            masses = counts
-        else:
-            masses = counts * (weight/counts_sum)
+            normalization = self.__no_temporal_knowledge_discount__ / max_total if max_total > 0 else 0.0
+            counts = self.total_counts
+        masses = counts * (possible_targets_mask * normalization)
 
         return masses
 
@@ -141,6 +139,362 @@ class Source():
         print textwrap.fill(" ".join(out_list), initial_indent="    ", subsequent_indent="    ", width=200)
 
 
+class Observations():
+    """
+    Stores the observations of all sources in one contiguous array, this is the model that the classifier learns in
+    `fit` and uses in `predict`. Settings and targets are identified by their ids, i.e. by their positions in the lists
+    of settings and targets. For installations with many sensors most settings are only followed by a few user actions
+    in each bin, in this case the counts for the regular bins can be stored as a sparse matrix (layout "sparse"). The
+    total counts are stored as a dense array in both layouts: while a setting is active, almost every user action is
+    observed sooner or later, and most active settings of a situation have no temporal knowledge (bin -1).
+    """
+
+    def __init__(self, settings, targets, counts, total_counts=None, counts_sum=None, masses=None, total_masses=None):
+        """
+        @param settings: A list of all settings (sensor, value), the position of a setting in the list is its id.
+        @param targets: A list of all target names, the position of a target in the list is its id.
+        @param counts: A numpy array with shape (settings, bins + 1, targets). For each setting and bin it contains
+        how often each target was observed in this setting and bin; the last entry in the bin dimension (i.e. bin -1)
+        contains how often each target was observed in this setting in total. Alternatively a scipy sparse matrix
+        with shape (settings * bins, targets) where row setting * bins + bin contains the counts for the regular bins,
+        the total counts are then given by `total_counts`.
+        @param total_counts: For the sparse layout, a numpy array with shape (settings, targets) with the total counts.
+        @param counts_sum: The number of observations for each setting and bin, calculated from the counts if None.
+        @param masses: The masses in the same layout as the counts, calculated from the counts if None. Passing
+        `counts_sum` and `masses` (e.g. from a stored model, see `as_arrays`) avoids touching all counts.
+        @param total_masses: For the sparse layout, the masses in the same layout as the total counts.
+        """
+        self.settings = list(settings)
+        self.targets = pandas.Index(targets)
+        self.setting_ids = {setting: id for id, setting in enumerate(self.settings)}
+
+        if sparse.issparse(counts):
+            self.layout = "sparse"
+            self.counts = sparse.csr_matrix(counts, dtype=float)
+            self.counts.sort_indices()
+            self.total_counts = numpy.ascontiguousarray(total_counts, dtype=float)
+            self.num_bins = self.counts.shape[0] / len(self.settings)
+        else:
+            self.layout = "dense"
+            self.counts = numpy.ascontiguousarray(counts, dtype=float)
+            self.total_counts = self.counts[:, -1]
+            self.num_bins = self.counts.shape[1] - 1
+
+        #number of observations for each setting in each bin (and in total), needed for max_total and max_temporal
+        if counts_sum is None:
+            self.counts_sum = numpy.empty((len(self.settings), self.num_bins + 1))
+            self.__update_counts_sum__(numpy.arange(len(self.settings)))
+        else:
+            self.counts_sum = counts_sum
+        self.__normalize__(masses, total_masses)
+
+    def update(self, settings, targets, temporal_counts, total_counts):
+        """
+        Replace the counts for some combinations of setting and target, e.g. after new observations have been made. The
+        counts are replaced in place and only the masses of these combinations are recalculated, unless max_total or
+        max_temporal change or the combinations add new entries to the sparse layout.
+        @param settings: A numpy array of setting ids.
+        @param targets: A numpy array of target ids, same length as `settings`.
+        @param temporal_counts: A numpy array with one row for each combination of setting and target and one column
+        for each bin.
+        @param total_counts: A numpy array with the total counts for each combination of setting and target.
+        """
+        is_restructured = False
+        if self.layout == "sparse":
+            rows = (settings * self.num_bins)[:, numpy.newaxis] + numpy.arange(self.num_bins)
+            columns = numpy.repeat(targets[:, numpy.newaxis], self.num_bins, axis=1)
+            counts = update_csr(self.counts, rows.ravel(), columns.ravel(), temporal_counts.ravel())
+            is_restructured = counts is not self.counts
+            self.counts = counts
+        else:
+            self.counts[settings, :-1, targets] = temporal_counts
+        self.total_counts[settings, targets] = total_counts
+
+        maxima = (self.max_total, self.max_temporal)
+        self.__update_counts_sum__(numpy.unique(settings))
+        self.__update_maxima__()
+        if is_restructured or (self.max_total, self.max_temporal) != maxima:
+            self.__normalize__()
+        else:
+            self.__normalize_combinations__(settings, targets)
+
+    def __update_counts_sum__(self, settings):
+        """
+        Recalculate the number of observations for the given setting ids.
+        """
+        if self.layout == "sparse":
+            rows = (settings[:, numpy.newaxis] * self.num_bins + numpy.arange(self.num_bins)).ravel()
+            counts_sum = numpy.empty((len(settings), self.num_bins + 1))
+            entry_rows, entries = csr_row_entries(self.counts, rows)
+            counts_sum[:, :-1] = numpy.bincount(entry_rows, weights=self.counts.data.take(entries),
+                                                minlength=len(rows)).reshape((len(settings), self.num_bins))
+            counts_sum[:, -1] = self.total_counts[settings].sum(axis=1)
+        else:
+            counts_sum = self.counts.take(settings, axis=0).sum(axis=2)
+        self.counts_sum[settings] = counts_sum
+
+    def __update_maxima__(self):
+        """
+        Calculate max_total, the maximum number of total observations for any setting, and max_temporal, the maximum
+        number of observations in any bin for any setting.
+        """
+        self.max_total = float(self.counts_sum[:, -1].max())
+        self.max_temporal = float(self.counts_sum[:, :-1].max())
+
+    def __temporal_masses__(self, counts):
+        """
+        Normalize counts in the regular bins into masses, see `Source.calculate_masses`.
+        """
+        return counts / self.max_temporal if self.max_temporal > 0 else counts * 0.0
+
+    def __total_masses__(self, counts):
+        """
+        Normalize total counts into masses, see `Source.calculate_masses`.
+        """
+        discount = Source.__no_temporal_knowledge_discount__
+        return counts * (discount / self.max_total) if self.max_total > 0 else counts * 0.0
+
+    def __normalize__(self, masses=None, total_masses=None):
+        """
+        Calculate max_total, max_temporal and the masses from the counts, unless the masses are already known.
+        """
+        self.__update_maxima__()
+        if masses is not None:
+            self.masses = masses
+            self.total_masses = total_masses if self.layout == "sparse" else self.masses[:, -1]
+            return
+
+        #normalize the counts into masses (see `Source.calculate_masses`), in predict only the masses for targets that
+        #are not possible in the current situation have to be removed
+        if self.layout == "sparse":
+            self.masses = sparse.csr_matrix((self.__temporal_masses__(self.counts.data), self.counts.indices,
+                                             self.counts.indptr), shape=self.counts.shape)
+            self.total_masses = self.__total_masses__(self.total_counts)
+        else:
+            self.masses = numpy.empty_like(self.counts)
+            self.masses[:, :-1] = self.__temporal_masses__(self.counts[:, :-1])
+            self.masses[:, -1] = self.__total_masses__(self.counts[:, -1])
+            self.total_masses = self.masses[:, -1]
+
+    def __normalize_combinations__(self, settings, targets):
+        """
+        Recalculate the masses for some combinations of setting and target in place, max_total and max_temporal must
+        not have changed since the masses were calculated.
+        """
+        if self.layout == "sparse":
+            rows = (settings * self.num_bins)[:, numpy.newaxis] + numpy.arange(self.num_bins)
+            columns = numpy.repeat(targets[:, numpy.newaxis], self.num_bins, axis=1)
+            positions, is_stored = csr_search(self.counts, rows.ravel(), columns.ravel())
+            positions = positions[is_stored]
+            self.masses.data[positions] = self.__temporal_masses__(self.counts.data[positions])
+        else:
+            self.masses[settings, :-1, targets] = self.__temporal_masses__(self.counts[settings, :-1, targets])
+        self.total_masses[settings, targets] = self.__total_masses__(self.total_counts[settings, targets])
+
+    def masses_for_sources(self, settings, bins, out=None):
+        """
+        Look up the masses of the sources for the given settings in the given bins.
+        @param settings: A numpy array of setting ids.
+        @param bins: A numpy array of bin indexes with the same length as `settings`, -1 selects the total counts.
+        @param out: An optional numpy array with one row for each setting and one column for each target, into which
+        the masses are written.
+        @return: A numpy array with one row for each setting and one column for each target.
+        """
+        if out is None:
+            out = numpy.empty((len(settings), len(self.targets)))
+        if self.layout == "dense":
+            rows = settings * (self.num_bins + 1) + bins % (self.num_bins + 1)
+            return numpy.take(self.masses.reshape((-1, len(self.targets))), rows, axis=0, out=out)
+
+        #look up the dense total masses for all settings, then replace them with the entries of the rows of the sparse
+        #matrix for the settings that are in a regular bin
+        numpy.take(self.total_masses, settings, axis=0, out=out)
+        temporal = numpy.flatnonzero(bins >= 0)
+        out[temporal] = 0.0
+        entry_rows, entries = csr_row_entries(self.masses, settings[temporal] * self.num_bins + bins[temporal])
+        out[temporal.take(entry_rows), self.masses.indices.take(entries)] = self.masses.data.take(entries)
+        return out
+
+    def source(self, setting):
+        """
+        @param setting: A setting (sensor, value).
+        @return: A `Source` with the observations for this setting.
+        """
+        setting_id = self.setting_ids[setting]
+        if self.layout == "sparse":
+            counts = numpy.vstack([self.counts[setting_id * self.num_bins:(setting_id + 1) * self.num_bins].toarray(),
+                                   self.total_counts[[setting_id]]])
+        else:
+            counts = self.counts[setting_id]
+        total_counts = pandas.Series(counts[-1], index=self.targets)
+        temporal_counts = pandas.DataFrame(counts[:-1].T, index=self.targets)
+        sensor, value = setting
+        return Source(sensor, value, total_counts, temporal_counts)
+
+    def sources(self):
+        """
+        @return: A dict with one `Source` for each setting, indexed by the setting (sensor, value).
+        """
+        return {setting: self.source(setting) for setting in self.settings}
+
+    def as_arrays(self):
+        """
+        @return: A dictionary with the numpy arrays that describe the model, see `observations_from_arrays`. Sparse
+        matrices are split into the arrays of the csr format.
+        """
+        arrays = {"counts_sum": self.counts_sum}
+        if self.layout == "sparse":
+            arrays.update({"total_counts": self.total_counts, "total_masses": self.total_masses})
+        for name in ["counts", "masses"]:
+            arrays.update(matrix_as_arrays(name, getattr(self, name)))
+        return arrays
+
+
+def observations_from_arrays(settings, targets, arrays):
+    """
+    Assemble the model from the arrays created by `Observations.as_arrays`.
+    @param settings: A list of all settings, see `Observations.__init__`.
+    @param targets: A list of all target names, see `Observations.__init__`.
+    @param arrays: A dictionary of numpy arrays, the arrays are used as they are (e.g. without copying memory-mapped
+    arrays into memory).
+    @return: The model as `Observations`.
+    """
+    return Observations(settings, targets, matrix_from_arrays("counts", arrays),
+                        total_counts=arrays.get("total_counts"), counts_sum=arrays["counts_sum"],
+                        masses=matrix_from_arrays("masses", arrays), total_masses=arrays.get("total_masses"))
+
+
+def csr_row_entries(matrix, rows):
+    """
+    Find the stored entries of some rows of a csr matrix.
+    @param matrix: A scipy sparse matrix in csr format.
+    @param rows: A numpy array of row indexes.
+    @return: Two numpy arrays with one item for each stored entry of the rows: the position of its row in `rows` and
+    its position in `matrix.data` and `matrix.indices`.
+    """
+    starts = matrix.indptr[rows]
+    lengths = matrix.indptr[rows + 1] - starts
+    ends = numpy.cumsum(lengths)
+    entries = numpy.arange(ends[-1] if len(ends) > 0 else 0) + numpy.repeat(starts - (ends - lengths), lengths)
+    return numpy.repeat(numpy.arange(len(rows)), lengths), entries
+
+
+def csr_rows_as_array(matrix, rows):
+    """
+    @param matrix: A scipy sparse matrix in csr format.
+    @param rows: A numpy array of row indexes.
+    @return: The rows of the matrix as dense numpy array.
+    """
+    entry_rows, entries = csr_row_entries(matrix, rows)
+    result = numpy.zeros((len(rows), matrix.shape[1]))
+    result[entry_rows, matrix.indices.take(entries)] = matrix.data.take(entries)
+    return result
+
+
+def csr_search(matrix, rows, columns):
+    """
+    Find where some entries are (or would be) stored in a csr matrix with sorted indices. The sorted column indices of
+    each row are searched with a binary search, for all entries at once.
+    @param matrix: A scipy sparse matrix in csr format with sorted indices.
+    @param rows: A numpy array with the rows of the entries.
+    @param columns: A numpy array with the columns of the entries, same length as `rows`.
+    @return: A tuple of two numpy arrays: the position of each entry in `matrix.data` and `matrix.indices` (or the
+    position where it would have to be inserted), and whether the entry is stored in the matrix.
+    """
+    low, end = matrix.indptr[rows].astype(int), matrix.indptr[rows + 1].astype(int)
+    if matrix.nnz == 0:
+        return low, numpy.zeros(len(rows), dtype=bool)
+
+    #find the first stored column of the row that is not smaller than the column of the entry
+    high = end.copy()
+    searching = numpy.flatnonzero(low < high)
+    while len(searching) > 0:
+        middle = (low[searching] + high[searching]) // 2
+        is_smaller = matrix.indices.take(middle) < columns[searching]
+        low[searching[is_smaller]] = middle[is_smaller] + 1
+        high[searching[~is_smaller]] = middle[~is_smaller]
+        searching = searching[low[searching] < high[searching]]
+
+    is_stored = (low < end) & (matrix.indices.take(numpy.minimum(low, matrix.nnz - 1)) == columns)
+    return low, is_stored
+
+
+def update_csr(matrix, rows, columns, values, add=False):
+    """
+    Replace (or add to) the values of some entries of a csr matrix. The values of entries that are already stored in
+    the matrix are changed in place, only if non-zero values have to be stored for entries that are not stored yet, a
+    new matrix with these entries inserted is created.
+    @param matrix: A scipy sparse matrix in csr format.
+    @param rows: A numpy array with the rows of the entries, every entry may only occur once.
+    @param columns: A numpy array with the columns of the entries, same length as `rows`.
+    @param values: A numpy array with the new values of the entries.
+    @param add: If True, the values are added to the entries instead of replacing them.
+    @return: The updated matrix, this is the passed matrix itself unless entries had to be inserted.
+    """
+    #only sorts if the indices are not known to be sorted yet, e.g. for a matrix that has just been loaded
+    matrix.sort_indices()
+    positions, is_stored = csr_search(matrix, rows, columns)
+    if add:
+        matrix.data[positions[is_stored]] += values[is_stored]
+    else:
+        matrix.data[positions[is_stored]] = values[is_stored]
+
+    is_new = ~is_stored & (values != 0)
+    if not is_new.any():
+        return matrix
+
+    #insert the new entries in the order of rows and columns, so that the indices of each row stay sorted
+    new = numpy.flatnonzero(is_new)
+    new = new[numpy.lexsort((columns[new], rows[new]))]
+    data = numpy.insert(matrix.data, positions[new], values[new])
+    indices = numpy.insert(matrix.indices, positions[new], columns[new])
+    indptr = matrix.indptr + numpy.searchsorted(rows[new], numpy.arange(matrix.shape[0] + 1))
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=matrix.shape)
+    matrix.has_sorted_indices = True
+    return matrix
+
+
+def matrix_as_arrays(name, matrix):
+    """
+    @param name: The name of the matrix.
+    @param matrix: A numpy array or a scipy sparse matrix.
+    @return: A dictionary with the matrix itself (if it is a numpy array) or with the arrays of its csr format
+    ("<name>_data", "<name>_indices", "<name>_indptr" and "<name>_shape").
+    """
+    if not sparse.issparse(matrix):
+        return {name: matrix}
+    matrix = sparse.csr_matrix(matrix)
+    return {name + "_data": matrix.data, name + "_indices": matrix.indices, name + "_indptr": matrix.indptr,
+            name + "_shape": numpy.array(matrix.shape)}
+
+
+def matrix_from_arrays(name, arrays):
+    """
+    Inverse of `matrix_as_arrays`.
+    """
+    if name in arrays:
+        return arrays[name]
+    return sparse.csr_matrix((arrays[name + "_data"], arrays[name + "_indices"], arrays[name + "_indptr"]),
+                             shape=tuple(arrays[name + "_shape"]))
+
+
+def sparse_counts_entries(settings, targets, temporal_counts):
+    """
+    Convert the counts in the regular bins for some combinations of setting and target into the entries of the sparse
+    layout of `Observations`.
+    @param settings: A numpy array of setting ids.
+    @param targets: A numpy array of target ids, same length as `settings`.
+    @param temporal_counts: A numpy array with one row for each combination of setting and target and one column for
+    each bin.
+    @return: Three numpy arrays with the rows, columns and values of all non-zero entries.
+    """
+    num_bins = temporal_counts.shape[1]
+    rows = (settings * num_bins)[:, numpy.newaxis] + numpy.arange(num_bins)
+    columns = numpy.repeat(targets[:, numpy.newaxis], num_bins, axis=1)
+    is_set = temporal_counts != 0
+    return rows[is_set], columns[is_set], temporal_counts[is_set]
+
+
 class TemporalEvidencesClassifier(BaseClassifier):
 
     """
@@ -148,7 +502,12 @@ class TemporalEvidencesClassifier(BaseClassifier):
     """
     name = "TemporalEvidences"
 
-    def __init__(self, features, target_names, bins=default_bins, postprocess=None):
+    #how many masses are combined at once in `predict`, the instances of a batch share one (instances x active settings
+    #x targets) array of masses, so this limits the memory needed for predicting
+    batch_elements = 2 ** 20
+
+    def __init__(self, features, target_names, bins=default_bins, postprocess=None, layout="dense", half_life=None,
+                 window=None, cache_size=None):
         """
         Initialize the classifier.
         @param features: see `BaseClassifier.__init__()`.
@@ -156,28 +515,38 @@ class TemporalEvidencesClassifier(BaseClassifier):
         @param bins: A list of interval borders as generated by `initialize_bins`.
         @param postprocess: A function that can be called to postprocess the generated recommendations in some manner.
         At the moment, static cutoff and dynamic cutoff are defined as postprocessing methods.
+        @param layout: How the learned observations are stored, "dense" or "sparse" (see `Observations`). The sparse
+        layout needs memory proportional to settings x targets plus the number of observed combinations of setting,
+        target and regular bin instead of settings x bins x targets, which pays off for installations with many
+        sensors.
+        @param half_life: If not None, older observations count less: the weight of an observation halves every
+        `half_life` seconds. See `ObservationHistory`.
+        @param window: If not None, only observations from the last `window` seconds are counted.
+        @param cache_size: If not None, `predict` remembers the recommendations for up to `cache_size` situations
+        (active settings and timedelta bins of their sensors) and reuses them when the same situation occurs again.
+        The cache is cleared whenever the classifier is trained.
         @return:
         """
         BaseClassifier.__init__(self, features, target_names)
         self.bins = bins
+        self.bins_lookup_table = create_lookup_table(bins)
         self.postprocess = postprocess
-
-        #make an index that allows fast lookup of index of the correct timedelta column for each sensor
-        self.timedelta_column_for_sensor = {sensor: self.timedelta_columns.index("%s_timedelta" % sensor)
-                                            for sensor, value in self.settings_columns}
+        self.layout = layout
+        self.half_life = half_life
+        self.window = window
+        self.cache_size = cache_size
+        self.cache = LRUCache(cache_size) if cache_size is not None else None
 
     def digitize_timedeltas(self, values):
         """
         Map each timedelta between two user actions/sensor changes to the respective bin index for this timedelta.
-        @param values: A numpy array of timedeltas.
-        @return: A numpy array of bin indexes.
+        @param values: A numpy array of timedeltas, e.g. the complete timedelta part of a data matrix.
+        @return: A numpy array of bin indexes with the same shape as `values`, -1 for timedeltas that can not be placed
+        in a regular bin. See `binning.digitize`.
         """
-        digitized = numpy.digitize(values.values, self.bins)
-        #the last bin contains all values that can not be placed in a regular bin
-        digitized[digitized == len(self.bins)] = -1
-        return digitized
+        return digitize(values, self.bins, self.bins_lookup_table)
 
-    def fit(self, train_data, train_target):
+    def fit(self, train_data, train_target, train_times=None):
         """
         Train the classifier.
         @param train_data: A matrix with len(self.features) columns and one row for each instance in the dataset. Each
@@ -186,154 +555,472 @@ class TemporalEvidencesClassifier(BaseClassifier):
         @param train_target: An array of targets (length of the array corresponds to the number of rows in train_data).
         Each target represents the action that user performed in the situation described by the corresponding row
         in train_data. See `dataset.dataset_to_sklearn` for more details.
+        @param train_times: An array with the timestamp of each target, only needed if the classifier uses a half-life
+        or a sliding window.
         @return: self-reference for this classifier
         """
 
-        #load training data and targets into pandas dataframe
-        train_data = pandas.DataFrame(train_data)
-        train_data.columns = self.features
-        train_data.index = train_target
+        #count the observations for each setting (sensor=value) that occurs in the dataset, keep the raw counts for
+        #`partial_fit`
+        self.history = ObservationHistory(self.half_life, self.window)
+        keys, weights, rescale = self.history.add(*self.__observation_keys__(train_data, train_target, train_times))
+        self.observations = self.__count_observations__(keys, weights)
+        self.model = self.__create_model__(self.observations)
+        if self.cache is not None:
+            self.cache.clear()
+
+        return self
+
+    def partial_fit(self, new_data, new_target, new_times=None):
+        """
+        Update the trained classifier with new training data, e.g. with the user actions observed since the last
+        training. Only the raw counts and the histograms of the combinations of setting and target that have new
+        observations are updated, in place, so the costs depend on the new training data and not on the size of the
+        model. The result is the same as calling `fit` with all training data.
+        @param new_data: A matrix with the new training instances, see `fit`.
+        @param new_target: An array of targets for the new training instances, see `fit`.
+        @param new_times: An array with the timestamps of the new targets, see `fit`.
+        @return: self-reference for this classifier
+        """
+        if not hasattr(self, "observations"):
+            return self.fit(new_data, new_target, new_times)
+        if self.cache is not None:
+            self.cache.clear()
 
-        #discretize the timedeltas into the given bins
-        train_data[self.timedelta_columns] = train_data[self.timedelta_columns].apply(self.digitize_timedeltas)
+        #identify the new observations in the same way as in fit (with a sliding window, this includes the
+        #observations that left the window) and sum up their weights for each key
+        keys, weights, rescale = self.history.add(*self.__observation_keys__(new_data, new_target, new_times))
+        keys, key_ids = numpy.unique(keys, return_inverse=True)
+        weights = numpy.bincount(key_ids, weights=weights) if len(keys) > 0 else numpy.zeros(0)
 
-        #create one source for each setting (sensor=value) that occurs in the dataset
-        self.sources = {(sensor, value): self.__create_source_for_setting__(sensor, value, train_data)
-                        for sensor, value in self.settings_columns}
+        #the exponential decay is applied lazily by giving new observations larger weights, only when these weights get
+        #too large (after hundreds of half-lives) the existing counts are rescaled and the whole model changes
+        num_targets, num_bins = len(self.target_names), len(self.bins) + 1
+        if rescale != 1.0:
+            self.observations.data *= rescale
+        self.observations = update_csr(self.observations, keys // num_bins, keys % num_bins, weights, add=True)
+        if rescale != 1.0:
+            self.model = self.__create_model__(self.observations)
+            return self
+        if len(keys) == 0:
+            return self
 
-        #maximum number of total observations for any setting
-        self.max_total = float(max(source.total_counts.sum() for source in self.sources.values()))
-        #maximum number of observations in any bin for any setting
-        self.max_temporal = float(max(source.max_temporal() for source in self.sources.values()))
+        #smooth the histograms of the changed combinations of setting and target again and update the model
+        changed = numpy.unique(keys // num_bins)
+        temporal, total = self.__smooth_observations__(csr_rows_as_array(self.observations, changed))
+        self.model.update(changed // num_targets, changed % num_targets, temporal, total)
 
         return self
 
-    def __create_source_for_setting__(self, sensor, value, train_data):
+    def __observation_keys__(self, data, target, times):
         """
-        Create a Source that knows how often each target has been observed when sensor=value
+        Identify the observations in the training data: each active setting of each instance is one observation of
+        the target of the instance in the bin of the timedelta of the sensor.
+        @param data: The training data, see `fit`.
+        @param target: The targets of the training data.
+        @param times: The timestamps of the targets, or None.
+        @return: A tuple of the keys of the observations (setting, target and bin encoded as
+        (setting * targets + target) * (bins + 1) + bin, where bin -1 becomes the last bin) and their times (or None).
         """
+        num_targets, num_bins = len(self.target_names), len(self.bins) + 1
 
-        def smooth_temporal_counts(bins_for_target):
-            #if the bin index is -1, the timedelta could not be placed in a regular bin -> remove these observations
-            cleaned_bins_for_target = bins_for_target.values
-            cleaned_bins_for_target = cleaned_bins_for_target[cleaned_bins_for_target >= 0]
-            #count how often current target was seen in each bin (bincount is much faster than pandas value_counts)
-            counts = numpy.bincount(cleaned_bins_for_target, minlength=len(self.bins))
-            #counts[-1] = 0        #if this line is uncommented it reproduces a bug in the original program
-            #perform smoothing; sometimes smoothed contains negative values near 0, round those up to 0
-            smoothed = smooth(counts).clip(0.0)
-            return pandas.Series(smoothed, name=bins_for_target.name)
+        #split the data into current settings and current timedeltas, map targets to their ids and discretize the
+        #timedeltas into the given bins
+        settings, timedeltas = self.split_data(data)
+        target = self.vocabulary.target_ids(target)
+        bins = self.digitize_timedeltas(timedeltas)
 
-        def calculate_total_counts(bins_grouped_by_target):
-            if len(bins_grouped_by_target) > 0:
-               total_counts = bins_grouped_by_target.count()
-               #some targets may have never been observed in this setting, fill counts for these with 0.0
-               total_counts = total_counts.reindex(self.target_names).fillna(0.0)
-            else:
-               #have no observations at all for this setting
-               total_counts = pandas.Series(0.0, index=self.target_names)
-            return total_counts
-
-        def calculate_temporal_counts(bins_grouped_by_target):
-            if len(bins_grouped_by_target) > 0:
-               temporal_counts = bins_grouped_by_target.apply(smooth_temporal_counts).unstack()
-               #some targets may have never been observed in this setting, fill counts for these with 0.0
-               temporal_counts = temporal_counts.reindex(self.target_names).fillna(0.0)
-            else:
-               #have no observations at all for this setting
-               temporal_counts = pandas.DataFrame(0.0, index=self.target_names, columns=range(0, len(self.bins)))
-            return temporal_counts
+        #retrieve all active settings and the bins of the corresponding timedelta columns for the sensors
+        instances, settings = self.active_settings_coordinates(settings)
+        bins_for_settings = bins[instances, self.vocabulary.setting_timedelta[settings]]
+        target = target[instances]
 
+        #targets that are not known to the classifier are not counted
+        is_known = target >= 0
+        instances, settings, target = instances[is_known], settings[is_known], target[is_known]
+        keys = (settings * num_targets + target) * num_bins + bins_for_settings[is_known] % num_bins
 
-        #retrieve from train_data exactly those rows where the given sensor is set to the given value and select the
-        #corresponding timedelta column for this sensor
-        observations_for_setting = train_data[[(sensor, value), "%s_timedelta" % sensor]]
-        observations_for_setting.columns = ["is_set", "bins"]
-        observations_for_setting = observations_for_setting[observations_for_setting["is_set"] == 1]["bins"]
+        return keys, (None if times is None else numpy.asarray(times)[instances])
 
-        #group the observations by the targets
-        bins_grouped_by_target = observations_for_setting.groupby(observations_for_setting.index, sort=False)
+    def __count_observations__(self, keys, weights):
+        """
+        Count how often each target has been observed in each bin of each setting (sensor=value), in one pass over
+        the keys of the observations (see `self.__observation_keys__`).
+        @param keys: A numpy array with the keys of the observations.
+        @param weights: A numpy array with the weight of each observation.
+        @return: A scipy sparse matrix with one row for each combination of setting and target (row setting * targets +
+        target) and one column for each bin, the last column contains the (weighted) number of observations that could
+        not be placed in a regular bin.
+        """
+        num_settings, num_targets, num_bins = len(self.settings_columns), len(self.target_names), len(self.bins) + 1
 
-        #count how often each target was seen overall and how often each target was seen in each bin
-        total_counts = calculate_total_counts(bins_grouped_by_target)
-        temporal_counts = calculate_temporal_counts(bins_grouped_by_target)
+        #duplicate entries are summed up when converting to csr
+        observations = sparse.coo_matrix((weights, (keys // num_bins, keys % num_bins)),
+                                         shape=(num_settings * num_targets, num_bins))
+        return observations.tocsr()
 
-        return Source(sensor, value, total_counts, temporal_counts)
+    def __create_model__(self, observations):
+        """
+        Calculate the counts for the `Observations` model from the raw observations.
+        @param observations: The raw observations as counted by `self.__count_observations__`.
+        @return: The model as `Observations`, in the dense or sparse layout depending on `self.layout`.
+        """
+        num_settings, num_targets, num_bins = len(self.settings_columns), len(self.target_names), len(self.bins) + 1
+
+        if self.layout == "sparse":
+            #only combinations of setting and target that have been observed at least once need to be smoothed
+            observed = numpy.flatnonzero(numpy.diff(observations.indptr))
+            temporal, total = self.__smooth_observations__(observations[observed].toarray())
+            settings, targets = observed // num_targets, observed % num_targets
+            rows, columns, values = sparse_counts_entries(settings, targets, temporal)
+            counts = sparse.coo_matrix((values, (rows, columns)), shape=(num_settings * (num_bins - 1), num_targets))
+            total_counts = numpy.zeros((num_settings, num_targets))
+            total_counts[settings, targets] = total
+            return Observations(self.settings_columns, self.target_names, counts, total_counts)
+
+        temporal, total = self.__smooth_observations__(observations.toarray())
+        counts = numpy.empty((num_settings, num_bins, num_targets))
+        counts[:, :-1] = temporal.reshape((num_settings, num_targets, num_bins - 1)).transpose((0, 2, 1))
+        counts[:, -1] = total.reshape((num_settings, num_targets))
+        return Observations(self.settings_columns, self.target_names, counts)
+
+    def __smooth_observations__(self, observations):
+        """
+        Calculate the smoothed temporal counts and the total counts from raw observations.
+        @param observations: A numpy array with raw observations for some combinations of setting and target, see
+        `self.__count_observations__`.
+        @return: A tuple of the smoothed counts (one column for each bin) and the total counts.
+        """
+        #perform smoothing for all rows at once, observations that could not be placed in a regular bin are removed;
+        #sometimes smoothed contains negative values near 0, round those up to 0
+        temporal = observations[:, :-1]
+        #temporal[:, -1] = 0        #if this line is uncommented it reproduces a bug in the original program
+        temporal = smooth_rows(temporal).clip(0.0)
+        #count how often each target was seen overall
+        total = observations.sum(axis=1)
+        return temporal, total
+
+    @property
+    def sources(self):
+        """
+        Create one `Source` for each setting (sensor=value), the sources describe the same observations as
+        `self.model`. The sources are not used for calculating recommendations, but are convenient for inspecting and
+        visualizing what the classifier has learned.
+        @return: A dict with one source for each setting, indexed by the setting (sensor, value).
+        """
+        return self.model.sources()
 
     #@profile
-    def predict(self, test_data, include_conflict_theta=False):
+    def save(self, directory):
+        """
+        Store the trained classifier as a directory with one npy file for each array of the model and a json file with
+        the metadata (version of the format, features, targets, bins and the parameters of the classifier). In contrast
+        to pickling the classifier, no pandas objects are stored and the arrays can be memory-mapped when the classifier
+        is loaded again, see `load_classifier`. The postprocessing function is not stored.
+        @param directory: The directory to which the classifier should be written, is created if it does not exist yet.
+        @return: None
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        #the model, the raw observations for `partial_fit` and, for a sliding window, the observations in the window
+        arrays = self.model.as_arrays()
+        arrays.update(matrix_as_arrays("observations", self.observations))
+        if len(self.history.chunks) > 0:
+            arrays["window_keys"] = numpy.concatenate([keys for keys, times in self.history.chunks])
+            arrays["window_times"] = numpy.concatenate([times for keys, times in self.history.chunks])
+        for name, array in arrays.items():
+            numpy.save(os.path.join(directory, name + ".npy"), array)
+
+        metadata = {"version": model_storage_version,
+                    "arrays": sorted(arrays.keys()),
+                    "features": [list(col) if isinstance(col, tuple) else col for col in self.features],
+                    "target_names": list(self.target_names),
+                    "bins": list(self.bins),
+                    "layout": self.layout,
+                    "half_life": self.half_life,
+                    "window": self.window,
+                    "cache_size": self.cache_size,
+                    "reference_time": self.history.reference_time,
+                    "current_time": self.history.current_time}
+        #write the metadata last, a directory without metadata is not a complete classifier
+        with open(os.path.join(directory, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+
+    def predict(self, test_data, include_conflict_theta=False, n_jobs=1):
         """
-        Calculate service recommendations for each instance in the test dataset.
+        Calculate service recommendations for each instance in the test dataset. The instances are processed in batches
+        of at most `self.batch_elements` masses, see `self.__predict_in_batches__`. The recommendations are calculated only once for
+        each distinct situation in the test data and, if the classifier has a cache, only for situations that are not
+        cached yet.
         @param test_data: A matrix with len(self.features) columns and one row for each instance in the dataset. Each
         row describes a user situation with current sensor settings and information on how long these settings have
-        not changed. More details on the setup of each row can be found in `self.__predict_for_instance__`.
+        not changed.
         @param include_conflict_theta: If this parameter is false, the function returns only the service recommendations.
         If this parameter is true, it returns also information on recommendation conflict and uncertainty (theta).
+        @param n_jobs: The number of processes that calculate the recommendations, None for the number of cpus. See
+        `BaseClassifier.predict_in_parallel`.
         @return: Service recommendations for each instance in the test dataset, optionally also returns recommendation
         conflict and uncertainty for each instance.
         """
-
-        #load test data into pandas dataframe
-        test_data = pandas.DataFrame(test_data)
-        test_data.columns = self.features
+        if n_jobs != 1:
+            return self.predict_in_parallel(test_data, n_jobs, include_conflict_theta=include_conflict_theta)
 
         #divide test data into current settings and current timedeltas
-        test_data_settings = test_data[self.settings_columns].values
-        test_data_timedeltas = test_data[self.timedelta_columns]
+        test_data_settings, test_data_timedeltas = self.split_data(test_data)
+        if len(test_data_timedeltas) == 0:
+            return []
+        instances, settings = self.active_settings_coordinates(test_data_settings)
+
+        #replace timedeltas with the respective bin index and find the bins for the sensors of the active settings
+        test_data_bins = self.digitize_timedeltas(test_data_timedeltas)
+        bins = test_data_bins[instances, self.vocabulary.setting_timedelta[settings]]
+
+        return self.__predict_situations__(instances, settings, bins, len(test_data_bins), include_conflict_theta)
 
-        #replace timedeltas with the respective bin index
-        test_data_bins = test_data_timedeltas.apply(self.digitize_timedeltas, axis=1)
-        #test_data_bins = test_data_bins.replace({len(self.bins): -1}, axis=1)  #if this line is uncommented it reproduces a bug in the original program
-        test_data_bins = test_data_bins.values
+    def predict_situation(self, settings, bins, include_conflict_theta=False):
+        """
+        Calculate service recommendations for one situation that is already given by its active settings and the bins
+        of their timedeltas, e.g. by a `service.SituationTracker`. In contrast to `predict`, no data matrix has to be
+        built and split, and only the timedeltas of the active settings have to be digitized.
+        @param settings: A numpy array with the ids of the active settings, in ascending order.
+        @param bins: A numpy array with the bin index of the timedelta of the sensor of each active setting, see
+        `digitize_timedeltas`.
+        @param include_conflict_theta: See `predict`.
+        @return: The service recommendations for the situation, optionally with conflict and uncertainty, i.e. one
+        entry of the list returned by `predict`.
+        """
+        instances = numpy.zeros(len(settings), dtype=int)
+        return self.__predict_situations__(instances, settings, bins, 1, include_conflict_theta)[0]
+
+    def __predict_situations__(self, instances, settings, bins, num_instances, include_conflict_theta):
+        """
+        Calculate recommendations for all instances, given by the ids of their active settings and the bins of these
+        settings (see `predict`).
+        """
+        #many instances are in the same situation (same active settings and same bins), calculate the recommendations
+        #only once for each distinct situation
+        codes = settings * (len(self.bins) + 1) + bins % (len(self.bins) + 1)
+        distinct, situations = self.__distinct_situations__(instances, codes, num_instances)
+        selected, instances = self.__select_instances__(instances, distinct, num_instances)
+        settings, bins, codes = settings[selected], bins[selected], codes[selected]
+        if self.cache is not None:
+            results = self.__predict_cached__(instances, settings, bins, codes, len(distinct))
+        else:
+            results = self.__predict_in_batches__(instances, settings, bins, len(distinct), True)
+
+        #copy the lists of recommendations for each instance, so that the results for different instances (and the
+        #cached results) are independent of each other
+        if include_conflict_theta:
+            return [(list(results[situation][0]), results[situation][1], results[situation][2])
+                    for situation in situations]
+        return [list(results[situation][0]) for situation in situations]
+
+    def __distinct_situations__(self, instances, codes, num_instances):
+        """
+        Find the instances that are in the same situation, i.e. that have the same active settings and the same bins
+        for the sensors of these settings. The codes of the active settings of each instance are written into one row
+        of a matrix (padded with -1) and the rows are sorted lexicographically, so that equal rows are next to each
+        other.
+        @param instances: A numpy array with the instance of each active setting, sorted, see
+        `BaseClassifier.active_settings_coordinates`.
+        @param codes: A numpy array with a code for each active setting, that identifies the setting and its bin.
+        @param num_instances: The number of instances.
+        @return: A tuple (distinct, situations). `distinct` contains one instance for each distinct situation, in
+        ascending order, `situations` contains the index of the situation in `distinct` for each instance.
+        """
+        settings_per_instance = numpy.bincount(instances, minlength=num_instances) if len(instances) > 0 \
+            else numpy.zeros(num_instances, dtype=int)
+        first_of_instance = numpy.cumsum(settings_per_instance) - settings_per_instance
+        position_in_instance = numpy.arange(len(instances)) - numpy.repeat(first_of_instance, settings_per_instance)
+        rows = -numpy.ones((num_instances, max(settings_per_instance.max(), 1)), dtype=numpy.int64)
+        rows[instances, position_in_instance] = codes
+
+        #sort the rows (stable, equal rows are ordered by instance) and find where a new situation starts
+        order = numpy.lexsort(rows.T[::-1])
+        sorted_rows = rows[order]
+        is_new = numpy.r_[True, (sorted_rows[1:] != sorted_rows[:-1]).any(axis=1)]
+        distinct = numpy.sort(order[is_new])
+        situations = numpy.empty(num_instances, dtype=int)
+        situations[order] = numpy.searchsorted(distinct, order[is_new])[numpy.cumsum(is_new) - 1]
+
+        return distinct, situations
+
+    def __select_instances__(self, instances, selected_instances, num_instances):
+        """
+        Select the active settings of some of the instances.
+        @param instances: A numpy array with the instance of each active setting, sorted.
+        @param selected_instances: A numpy array with the selected instances, in ascending order.
+        @param num_instances: The number of instances.
+        @return: A boolean numpy array that selects the active settings of the selected instances and a numpy array with
+        the instance of each selected active setting, numbered by the position of the instance in `selected_instances`.
+        """
+        is_selected = numpy.zeros(num_instances, dtype=bool)
+        is_selected[selected_instances] = True
+        position = numpy.cumsum(is_selected) - 1
+        selected = is_selected[instances]
+
+        return selected, position[instances[selected]]
+
+    def __predict_in_batches__(self, instances, settings, bins, num_instances, include_conflict_theta):
+        """
+        Calculate recommendations for all instances, batch by batch, see `__predict_batch__`. All batches have the same
+        number of instances, chosen so that the masses of a batch have at most `self.batch_elements` entries for the
+        instance with the most active settings.
+        """
+        max_settings = numpy.bincount(instances).max() if len(instances) > 0 else 1
+        batch_size = max(1, self.batch_elements // (max_settings * len(self.target_names)))
+
+        results = []
+        for start in range(0, num_instances, batch_size):
+            end = min(start + batch_size, num_instances)
+            in_batch = slice(*numpy.searchsorted(instances, [start, end]))
+            results += self.__predict_batch__(instances[in_batch] - start, settings[in_batch], bins[in_batch],
+                                              end - start, include_conflict_theta)
 
-        #calculate recommendations for each instance in the dataset
-        results = [self.__predict_for_instance__(test_data_settings[i], test_data_bins[i], include_conflict_theta)
-                   for i in range(len(test_data_bins))]
+        return results
+
+    def __predict_cached__(self, instances, settings, bins, codes, num_instances):
+        """
+        Look up the recommendations for each instance in the cache and calculate only the recommendations for the
+        instances whose situation is not cached yet. The situation of an instance is encoded as the string of bytes of
+        the codes of its active settings (see `__distinct_situations__`).
+        @return: The recommendations including conflict and theta for each instance.
+        """
+        boundaries = numpy.searchsorted(instances, numpy.arange(num_instances + 1))
+        codes = codes.astype(numpy.int64)
+        keys = [codes[start:end].tostring() for start, end in zip(boundaries[:-1], boundaries[1:])]
+        results = [self.cache.get(key) for key in keys]
+
+        #calculate the recommendations for all instances that were not found in the cache at once and cache them
+        missing = [instance for instance, result in enumerate(results) if result is None]
+        if len(missing) > 0:
+            selected, missing_instances = self.__select_instances__(instances, missing, num_instances)
+            calculated = self.__predict_in_batches__(missing_instances, settings[selected], bins[selected],
+                                                     len(missing), True)
+            for instance, result in zip(missing, calculated):
+                self.cache.put(keys[instance], result)
+                results[instance] = result
 
         return results
 
-    def __predict_for_instance__(self, instance, instance_bin, include_conflict_theta):
+    def __predict_batch__(self, instances, settings, bins, num_instances, include_conflict_theta):
         """
-        @param instance: A numpy array with possible values [0, 1 and NaN] with the same length as self.settings_columns.
-        Each entry in the array describes whether the corresponding setting is currently active (1), is not active (0)
-        or the status of the sensor is not known (NaN).
-        @param instance_bin: A numpy array of bin indexes with the same length as self.timedelta_columns. Each entry
-        in the array describes how long the corresponding sensor has had the current value.
+        Calculate service recommendations for a batch of instances. The masses of all active settings of all instances
+        are calculated at once (in the same way as in `Source.calculate_masses`) and are then combined with
+        `combine_dempsters_rule_batch`, for both layouts of the model.
+        @param instances: A numpy array with the positions of the instances in the batch for all active settings, see
+        `BaseClassifier.active_settings_coordinates`.
+        @param settings: A numpy array with the ids of the active settings, same length as `instances`.
+        @param bins: A numpy array with the bin index of the timedelta of the sensor of each active setting, same length
+        as `instances`. Each entry describes how long the corresponding sensor has had the current value.
+        @param num_instances: The number of instances in the batch.
         @param include_conflict_theta: If this parameter is false, the function returns only the service recommendations.
         If this parameter is true, it returns also information on recommendation conflict and uncertainty (theta).
-        @return: Service recommendations for this instance, optionally including conflict and uncertainty.
+        @return: Service recommendations for each instance in the batch, optionally including conflict and uncertainty.
         """
+        num_targets = len(self.target_names)
 
-        #find which sensor values are currently set and the timedelta bins for these sensors
-        currently_set = self.currently_set(instance)
-        current_bin_for_sensor = lambda sensor: int(instance_bin[self.timedelta_column_for_sensor[sensor]])
-        bins_for_current_settings = [current_bin_for_sensor(sensor) for sensor, value in currently_set]
+        #calculate which targets (user actions) are currently not possible, i.e. the actions that lead to an active
+        #setting, and mark the possible targets of each instance with True
+        impossible_targets = self.vocabulary.setting_target[settings]
+        is_target = impossible_targets >= 0
+        impossible = (instances[is_target], impossible_targets[is_target])
+        possible_targets_masks = numpy.ones((num_instances, num_targets), dtype=bool)
+        possible_targets_masks[impossible] = False
 
-        #calculate which targets (user actions) are currently possible (possible targets are represented by 1,
-        #not currently possible targets are represented by 0)
-        possible_targets_mask = self.possible_targets_mask(currently_set)
+        #for all active settings look up the masses of the source for the current bin, keep only the masses for
+        #currently possible targets and combine the masses using Dempster's combination rule
+        combined_masses, conflicts, thetas = self.__combine__(settings, bins, instances, num_instances, impossible)
 
-        #calculate the mass distributions for all current settings
-        masses = [self.sources[setting].calculate_masses(bin, possible_targets_mask, self.max_total, self.max_temporal)
-                  for setting, bin in zip(currently_set, bins_for_current_settings)]
+        #map resulting masses to the possible targets, apply postprocessing and sort recommendations (iterating over
+        #python lists is much faster than iterating over the rows of the numpy arrays)
+        results = []
+        for combined, possible_targets_mask, conflict, theta \
+                in zip(combined_masses.tolist(), possible_targets_masks.tolist(), conflicts, thetas):
+            recommendations = {target: target_mass for target, target_mass, target_is_possible
+                               in zip(self.target_names, combined, possible_targets_mask)
+                               if target_is_possible}
+            if not self.postprocess is None:
+                recommendations = self.postprocess(recommendations, conflict, theta)
+            sorted_recommendations = sorted(recommendations, key=recommendations.get, reverse=True)
 
-        #combine the masses using Dempster's combination rule
-        combined_masses, conflict, theta = combine_dempsters_rule(masses)
+            if include_conflict_theta:
+                results.append((sorted_recommendations, conflict, theta))
+            else:
+                results.append(sorted_recommendations)
 
-        #map resulting masses to the possible targets, apply postprocessing and sort recommendations
-        recommendations = {target: target_mass for target, target_mass, target_is_possible
-                           in zip(self.target_names, combined_masses, possible_targets_mask)
-                           if target_is_possible}
-        if not self.postprocess is None:
-            recommendations = self.postprocess(recommendations, conflict, theta)
-        sorted_recommendations = sorted(recommendations, key=recommendations.get, reverse=True)
+        return results
+
+    def __combine__(self, settings, bins, instances, num_instances, impossible):
+        """
+        Combine the masses of the active settings of each instance, see `combine_dempsters_rule_batch`.
+        @param impossible: A tuple of two numpy arrays, the instances and the targets that are not possible for them.
+        """
+        #arrange the masses by instance, instances with fewer active settings are padded with zero masses; the masses
+        #are looked up directly into their slots in the arranged array
+        num_targets = len(self.target_names)
+        settings_per_instance = numpy.bincount(instances, minlength=num_instances)
+        max_settings = settings_per_instance.max()
+        first_of_instance = numpy.cumsum(settings_per_instance) - settings_per_instance
+        slots = instances * max_settings + numpy.arange(len(instances)) - first_of_instance[instances]
+        slot_settings, slot_bins = numpy.zeros(num_instances * max_settings, dtype=int), \
+                                   numpy.zeros(num_instances * max_settings, dtype=int)
+        slot_settings[slots], slot_bins[slots] = settings, bins
+        masses = self.model.masses_for_sources(slot_settings, slot_bins,
+                                               out=numpy.empty((num_instances * max_settings, num_targets)))
+        is_padding = numpy.ones(num_instances * max_settings, dtype=bool)
+        is_padding[slots] = False
+        masses[is_padding] = 0.0
+        masses = masses.reshape((num_instances, max_settings, num_targets))
+
+        #remove the masses of all sources of an instance for the targets that are not possible for this instance
+        impossible_instances, impossible_targets = impossible
+        masses[impossible_instances, :, impossible_targets] = 0.0
+
+        return combine_dempsters_rule_batch(masses)
+
+
+def load_classifier(directory, postprocess=None, mmap_mode="c"):
+    """
+    Read a classifier that was stored with `TemporalEvidencesClassifier.save`. By default the arrays of the model are
+    memory-mapped, so loading the classifier takes about the same time independent of the size of the model and only
+    the parts of the model that are needed for the recommendations are read from disk.
+    @param directory: The directory that contains the classifier.
+    @param postprocess: The postprocessing function for the recommendations, see `TemporalEvidencesClassifier`.
+    @param mmap_mode: How to memory-map the arrays, see `numpy.load`. The default "c" (copy-on-write) allows to train
+    the loaded classifier further without changing the stored files. Use None to read the whole model into memory.
+    @return: The trained classifier.
+    """
+    path_to_metadata = os.path.join(directory, "metadata.json")
+    if not os.path.exists(path_to_metadata):
+        raise ValueError("Could not find a stored classifier at %s" % os.path.abspath(directory))
+    with open(path_to_metadata) as f:
+        metadata = json.load(f)
+    if metadata["version"] != model_storage_version:
+        raise ValueError("Classifier %s was stored in version %s of the format, expected version %d"
+                         % (directory, metadata["version"], model_storage_version))
+    arrays = {name: numpy.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+              for name in metadata["arrays"]}
+
+    features = [tuple(col) if isinstance(col, list) else col for col in metadata["features"]]
+    cls = TemporalEvidencesClassifier(pandas.Index(features), metadata["target_names"], bins=metadata["bins"],
+                                      postprocess=postprocess, layout=metadata["layout"],
+                                      half_life=metadata["half_life"], window=metadata["window"],
+                                      cache_size=metadata["cache_size"])
+    cls.model = observations_from_arrays(cls.settings_columns, cls.target_names, arrays)
+    cls.observations = matrix_from_arrays("observations", arrays)
+
+    #restore the state of the history, so that the classifier can be trained further with `partial_fit`
+    cls.history = ObservationHistory(cls.half_life, cls.window)
+    cls.history.reference_time = metadata["reference_time"]
+    cls.history.current_time = metadata["current_time"]
+    if "window_keys" in arrays:
+        cls.history.chunks.append((arrays["window_keys"], arrays["window_times"]))
+
+    return cls
 
-        if include_conflict_theta:
-            return sorted_recommendations, conflict, theta
-        else:
-            return sorted_recommendations
 
-             
 def configure_static_cutoff(cutoff):
     """
     Configure a function that shortens the recommendations list to contain only the best `cutoff` recommendations
@@ -4,14 +4,27 @@ This module contains functions for reading datasets and converting them to the s
 """
 
 import os.path
+import hashlib
+import json
+from multiprocessing import Pool
 from ConfigParser import SafeConfigParser
 
 from sklearn.datasets.base import Bunch
+from scipy import sparse
 import numpy
 import pandas
+from pandas.tslib import iNaT
 
 
-def load_dataset(path_to_csv, path_to_config=None):
+#possible layouts of the data matrix of datasets in scikit-learn format, see `dataset_to_sklearn`
+layouts = ["dense", "compact", "sparse"]
+
+#version of the stored dataset format, must be increased whenever the conversion or the format change, so that
+#datasets that were cached by earlier versions are converted again
+storage_version = 1
+
+
+def load_dataset(path_to_csv, path_to_config=None, layout="dense", cache_dir=None):
     """
     This function reads an event-list dataset and returns a dataset according to the scikit-learn dataset format. This
     dataset be used to train and test the recommendation classifiers.
@@ -19,20 +32,94 @@ def load_dataset(path_to_csv, path_to_config=None):
     "timestamp", "sensor", "value". The timestamp must be in a format that is readable by pandas.
     @param path_to_config: Path where an optional config file can be found. Please look at the file "houseA.config" for
     how to structure this file.
+    @param layout: The layout of the data matrix, see `dataset_to_sklearn`.
+    @param cache_dir: Optional directory for caching converted datasets. If given, the converted dataset is stored in
+    this directory and any later call for the same csv contents, config and layout reads the stored dataset instead of
+    converting the csv file again. Changing the csv file or the config automatically leads to a new conversion.
     @return: The resulting dataset, see `dataset_to_sklearn`.
     """
-    data = load_dataset_raw(path_to_csv, path_to_config)
-    return dataset_to_sklearn(data)
+    if cache_dir is None:
+        data = load_dataset_raw(path_to_csv, path_to_config)
+        return dataset_to_sklearn(data, layout=layout)
+
+    path_to_npz = cached_dataset_path(path_to_csv, path_to_config, layout, cache_dir)
+    if os.path.exists(path_to_npz):
+        return load_dataset_npz(path_to_npz)
+
+    data = dataset_to_sklearn(load_dataset_raw(path_to_csv, path_to_config), layout=layout)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    write_dataset_as_npz(data, path_to_npz)
+    return data
 
-def load_dataset_raw(path_to_csv, path_to_config=None):
+
+def load_datasets(houses, layout="dense", cache_dir=None, processes=None):
     """
-    This function reads an event-list dataset and returns a dataset that lists for all event timestamps the current
-    settings of all available sensors. Please see `events_to_dataset` for more information on the resulting dataset.
-    @param path_to_csv: The csv file that contains the dataset. The data must be formatted in three columns:
-    "timestamp", "sensor", "value". The timestamp must be in a format that is readable by pandas.
+    Load the datasets of several houses at once. The houses are converted in parallel in a pool of worker processes,
+    each worker converts one house at a time with `load_dataset`.
+    @param houses: A list of (path_to_csv, path_to_config) pairs, one pair for each house; path_to_config can be None.
+    @param layout: The layout of the data matrices, see `dataset_to_sklearn`.
+    @param cache_dir: Optional directory for caching converted datasets, see `load_dataset`.
+    @param processes: The number of worker processes, per default the number of cpus. With 1 process, all houses are
+    converted one after another in the current process.
+    @return: A tuple of two lists with one entry for each house, in the order of `houses`. The first list contains the
+    datasets in scikit-learn format, the second list contains the error message for each house whose dataset could
+    not be loaded (in this case the dataset is None) or None if the dataset was loaded successfully.
+    """
+    arguments = [(path_to_csv, path_to_config, layout, cache_dir) for path_to_csv, path_to_config in houses]
+    if processes == 1:
+        results = map(load_dataset_for_house, arguments)
+    else:
+        pool = Pool(processes)
+        try:
+            results = pool.map(load_dataset_for_house, arguments, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    datasets = [data for data, error in results]
+    errors = [error for data, error in results]
+    return datasets, errors
+
+
+def load_dataset_for_house(arguments):
+    """
+    Load the dataset of one house for `load_datasets`, catching any errors so that the other houses are not affected.
+    @param arguments: A tuple (path_to_csv, path_to_config, layout, cache_dir), see `load_dataset`.
+    @return: A tuple of the dataset (or None) and an error message (or None).
+    """
+    path_to_csv, path_to_config, layout, cache_dir = arguments
+    try:
+        return load_dataset(path_to_csv, path_to_config, layout, cache_dir), None
+    except Exception as e:
+        return None, "Could not load dataset %s: %s: %s" % (path_to_csv, e.__class__.__name__, e)
+
+
+def cached_dataset_path(path_to_csv, path_to_config, layout, cache_dir):
+    """
+    Find the file in which the converted dataset is cached. The file name contains a hash over the contents of the csv
+    file, the parsed config and the layout of the data matrix.
+    @param path_to_csv: The csv file that contains the dataset, see `load_dataset`.
+    @param path_to_config: Path where an optional config file can be found, see `load_dataset`.
+    @param layout: The layout of the data matrix, see `dataset_to_sklearn`.
+    @param cache_dir: The directory for caching converted datasets.
+    @return: The path of the cache file for this dataset.
+    """
+    config = read_config(path_to_csv, path_to_config)
+    key = hashlib.sha1(json.dumps([storage_version, layout, config]))
+    with open(path_to_csv, "rb") as csv:
+        for block in iter(lambda: csv.read(1024*1024), ""):
+            key.update(block)
+    return os.path.join(cache_dir, "%s-%s.npz" % (config[0], key.hexdigest()))
+
+
+def read_config(path_to_csv, path_to_config=None):
+    """
+    Read the configuration for an event-list dataset.
+    @param path_to_csv: The csv file that contains the dataset, used to derive a default name for the dataset.
     @param path_to_config: Path where an optional config file can be found. Please look at the file "houseA.config" for
     how to structure this file.
-    @return: The resulting dataset.
+    @return: A tuple of the name of the dataset, the list of excluded sensors and the list of excluded actions.
     """
 
     def default_config():
@@ -51,27 +138,138 @@ def load_dataset_raw(path_to_csv, path_to_config=None):
 
         return default_conf
 
-    def read_config():
-        #read config if exists or use defaults
-        config = default_config()
-        if not path_to_config is None:
-            if not os.path.exists(path_to_config):
-                raise ValueError("Could not find config file at %s " % os.path.abspath(path_to_config))
-            config.read(path_to_config)
+    #read config if exists or use defaults
+    config = default_config()
+    if not path_to_config is None:
+        if not os.path.exists(path_to_config):
+            raise ValueError("Could not find config file at %s " % os.path.abspath(path_to_config))
+        config.read(path_to_config)
+
+    #excluded sensors and services are given as a comma-separated string, convert to python list
+    excluded_list = lambda exclude: [e.strip().replace("\"", "") for e in exclude.split(",") if len(e.strip()) > 0]
 
-        #excluded sensors and services are given as a comma-separated string, convert to python list
-        excluded_list = lambda exclude: [e.strip().replace("\"", "") for e in exclude.split(",") if len(e.strip()) > 0]
+    return config.get("basic", "name"), \
+           excluded_list(config.get("excludes", "excluded_sensors")), \
+           excluded_list(config.get("excludes", "excluded_actions"))
 
-        return config.get("basic", "name"), \
-               excluded_list(config.get("excludes", "excluded_sensors")), \
-               excluded_list(config.get("excludes", "excluded_actions"))
 
-    name, excluded_sensors, excluded_services = read_config()
+def load_dataset_raw(path_to_csv, path_to_config=None):
+    """
+    This function reads an event-list dataset and returns a dataset that lists for all event timestamps the current
+    settings of all available sensors. Please see `events_to_dataset` for more information on the resulting dataset.
+    @param path_to_csv: The csv file that contains the dataset. The data must be formatted in three columns:
+    "timestamp", "sensor", "value". The timestamp must be in a format that is readable by pandas.
+    @param path_to_config: Path where an optional config file can be found. Please look at the file "houseA.config" for
+    how to structure this file.
+    @return: The resulting dataset.
+    """
+    name, excluded_sensors, excluded_services = read_config(path_to_csv, path_to_config)
     events = pandas.read_csv(path_to_csv, parse_dates=["timestamp"])
     data = events_to_dataset(events, name, excluded_sensors, excluded_services)
     return data
-    
-def events_to_dataset(events, name, excluded_sensors, excluded_actions):
+
+
+def load_dataset_with_state(path_to_csv, path_to_config=None, layout="dense"):
+    """
+    Read and convert an event-list dataset like `load_dataset`, and additionally return the state of all sensors after
+    the last event. The state allows to append new events to the dataset later on, see `append_events`.
+    @param path_to_csv: The csv file that contains the dataset, see `load_dataset`.
+    @param path_to_config: Path where an optional config file can be found, see `load_dataset`.
+    @param layout: The layout of the data matrix, see `dataset_to_sklearn`.
+    @return: A tuple of the dataset in scikit-learn format and the `SensorState` after the last event.
+    """
+    name, excluded_sensors, excluded_actions = read_config(path_to_csv, path_to_config)
+    events = pandas.read_csv(path_to_csv, parse_dates=["timestamp"])
+    state = SensorState(events["sensor"][numpy.invert(events["sensor"].isin(excluded_sensors))].unique())
+    data = events_to_dataset(events, name, excluded_sensors, excluded_actions, state)
+    return dataset_to_sklearn(data, layout=layout), state
+
+
+def append_events(data, state, events, excluded_sensors, excluded_actions):
+    """
+    Append new events to an already converted dataset. Only the new events are converted: the values and last-change
+    timestamps of all sensors are taken from the state, so the first new rows are forward-filled and get their
+    timedeltas exactly as if the whole event-list had been converted at once.
+    @param data: The dataset in scikit-learn format, see `dataset_to_sklearn`.
+    @param state: The `SensorState` after the last event of the dataset, e.g. as returned by `load_dataset_with_state`
+    or by a previous call of this function. The state is advanced to the end of the new events.
+    @param events: The new events, with the columns "timestamp", "sensor" and "value". The events must come from sensors
+    that are already known to the state. The new rows keep the features and target names of the dataset, values that
+    are not among the features are not represented in the new rows.
+    @param excluded_sensors: A list of sensors whose events should be ignored, see `events_to_dataset`.
+    @param excluded_actions: A list of non-valid actions that should not be included, see `events_to_dataset`.
+    @return: The dataset with the rows for the new events appended.
+    """
+    new_data = events_to_dataset(events, data.name, excluded_sensors, excluded_actions, state)
+    new_data = dataset_to_sklearn(new_data, data.features, data.target_names, dataset_layout(data))
+    return concatenate_datasets([data, new_data])
+
+
+def iter_dataset_raw(path_to_csv, path_to_config=None, chunksize=100000):
+    """
+    Streaming version of `load_dataset_raw`. The event-list is read in chunks of `chunksize` events and the dataset
+    is returned piece by piece, so that the memory needed for the conversion is bounded by the size of the chunks rather
+    than by the size of the file. The values and last-change timestamps of all sensors are carried over from one chunk
+    to the next, concatenating all returned pieces gives the same dataset as `load_dataset_raw`.
+    @param path_to_csv: The csv file that contains the dataset, see `load_dataset_raw`.
+    @param path_to_config: Path where an optional config file can be found, see `load_dataset_raw`.
+    @param chunksize: How many events to read from the csv file at once.
+    @return: A generator of consecutive parts of the dataset; each part has the format described in `events_to_dataset`
+    and contains at most `chunksize` rows.
+    """
+    name, excluded_sensors, excluded_actions = read_config(path_to_csv, path_to_config)
+
+    #the dataset has two columns for each sensor, all sensors must therefore be known before converting the first chunk
+    sensors = set()
+    for events in pandas.read_csv(path_to_csv, usecols=["sensor"], chunksize=chunksize):
+        sensors.update(events["sensor"].unique())
+    state = SensorState(sensors.difference(excluded_sensors))
+
+    converted = 0
+    for events in pandas.read_csv(path_to_csv, parse_dates=["timestamp"], chunksize=chunksize):
+        #number the events consecutively over all chunks (as if the whole file had been read at once)
+        events.index = numpy.arange(converted, converted + len(events))
+        converted += len(events)
+
+        events = events[numpy.invert(events["sensor"].isin(excluded_sensors))]
+        data = state.update(events)
+        data = data[numpy.invert(data["action"].isin(excluded_actions))]
+        if len(data) > 0:
+            data.name = name
+            yield data
+
+
+def iter_dataset(path_to_csv, path_to_config=None, chunksize=100000, layout="dense"):
+    """
+    Streaming version of `load_dataset`, converts the pieces returned by `iter_dataset_raw` into the scikit-learn
+    format. To make the pieces compatible with each other, all of them use the same features and target names: the
+    features list all settings (sensor=value) and sensors that occur in the event-list, the target names list all
+    settings that are not excluded actions.
+    @param path_to_csv: The csv file that contains the dataset, see `load_dataset`.
+    @param path_to_config: Path where an optional config file can be found, see `load_dataset`.
+    @param chunksize: How many events to read from the csv file at once.
+    @param layout: The layout of the data matrix, see `dataset_to_sklearn`.
+    @return: A generator of consecutive parts of the dataset, each part in the format described in `dataset_to_sklearn`.
+    """
+    excluded_sensors, excluded_actions = read_config(path_to_csv, path_to_config)[1:]
+
+    #collect all settings in the order in which they first occur in the event-list
+    settings = pandas.DataFrame(columns=["sensor", "value"])
+    for events in pandas.read_csv(path_to_csv, usecols=["sensor", "value"], chunksize=chunksize):
+        settings = pandas.concat([settings, events[["sensor", "value"]]]).drop_duplicates()
+    settings = settings[numpy.invert(settings["sensor"].isin(excluded_sensors))]
+
+    sensors = sorted(settings["sensor"].unique())
+    features = [(sensor, value) for sensor in sensors
+                                for value in settings[settings["sensor"] == sensor]["value"]]
+    features += ["%s_timedelta" % sensor for sensor in sensors]
+    target_names = sorted(set("%s=%s" % setting for setting in features[:-len(sensors)]) - set(excluded_actions))
+
+    for data in iter_dataset_raw(path_to_csv, path_to_config, chunksize):
+        yield dataset_to_sklearn(data, features, target_names, layout)
+
+
+def events_to_dataset(events, name, excluded_sensors, excluded_actions, state=None):
     """
     Convert an event-list dataset and return a dataset that lists for all event timestamps the next user action, the
     current settings of all available sensors at the time of this next user action and for how long the sensors had their
@@ -114,83 +312,142 @@ def events_to_dataset(events, name, excluded_sensors, excluded_actions):
     @param name: The name of the dataset.
     @param excluded_sensors: A list of sensors that should not be included in the resulting dataset
     @param excluded_actions: A list of non-valid actions that should not be included in the resulting dataset.
+    @param state: Optionally, the `SensorState` from which to continue the conversion, e.g. the state after the last
+    event of an already converted dataset. The state is advanced to the end of the given events.
     @return: The resulting dataset.
     """
 
-    def extract_actions():
-        #create dataframe with two columns, one for the actions and one for the timestamp of the actions occurrence
-        action_name = lambda row: "%s=%s" % (row["sensor"], row["value"])
-        actions_name_column = events.apply(action_name, axis=1)
-        actions_with_timestamps = pandas.concat([actions_name_column, events["timestamp"]], axis=1)
-        actions_with_timestamps.columns = ["action", "timestamp"]
-
-        #the action column is a preview of the one next action given the current sensor values -> shift the
-        #action columns upp one row
-        actions_with_timestamps = actions_with_timestamps.shift(-1)
-
-        return actions_with_timestamps
-
-    def data_for_sensor(sensor, actions):
-        #get all the events for this sensor
-        relevant_events = events[events["sensor"] == sensor]
-
-        #forward fill the sensor data
-        #e.g. if at T=0 sensor=value 1 and at T=10 sensor=value2, then fill all in-between T=(1-9) with value1
-        relevant_events = relevant_events.reindex(events.index)
-        relevant_events.fillna(method="pad", inplace=True)
-
-        #calculate for each user action, how much time has passed since the sensor value changed
-        time_passed = actions["timestamp"] - relevant_events["timestamp"]
-
-        #create a dataframe that contains one row for every user action, one column with the current sensor value at the
-        #the time of the action, one column with the time passed since the sensor value changed
-        sensor_data = pandas.DataFrame({sensor: relevant_events["value"],
-                                        "%s_timedelta" % sensor: time_passed})
-        return sensor_data
-
-
     #remove events coming from any of the excluded sensors
     events_for_excluded = events["sensor"].isin(excluded_sensors)
     events = events[numpy.invert(events_for_excluded)]
 
-    #get a dataframe with the user actions
-    actions = extract_actions()
-
-    #create dataset with one row per use action and two columns for each sensor:
-    #column "sensor" contains sensor values, column "sensor (timedelta)" contains time passed since the sensor value
-    #changed at the time of the action corresponding to the current row
-    sensors = events["sensor"].unique()
-    data = pandas.concat([data_for_sensor(sensor, actions) for sensor in sorted(sensors)], axis=1)
-
-    #add action and action timestamp as final columns
-    data["action"] = actions["action"]
-    data["action_timestamp"] = actions["timestamp"]
+    #convert all events at once, per default starting from a state where the values of all sensors are unknown
+    if state is None:
+        state = SensorState(events["sensor"].unique())
+    data = state.update(events)
 
     #drop data for actions that correspond to excluded actions
     data_for_excluded = data["action"].isin(excluded_actions)
     data = data[numpy.invert(data_for_excluded)]
 
-    #for the last row, there is no next user actions -> remove that row
-    data = data[0:-1]
-
     data.name = name
     return data
 
 
+class SensorState():
+    """
+    The state of all sensors after (a part of) an event-list has been converted: the current value of each sensor and
+    the time of the last change of each sensor. The state is used to convert an event-list piece by piece, each
+    `update` continues the forward fill of the sensor values where the previous update stopped.
+    """
+
+    def __init__(self, sensors):
+        """
+        Initialize the state, the values of all sensors are not known yet.
+        @param sensors: The names of all sensors in the event-list.
+        """
+        self.sensors = pandas.Index(sorted(sensors))
+        self.values = numpy.array([numpy.nan] * len(self.sensors), dtype=object)
+        self.timestamps = numpy.array([iNaT] * len(self.sensors), dtype="i8")
+        #the index of the last converted event, the row for this event is completed by the next user action
+        self.last_event = None
+
+    def update(self, events):
+        """
+        Convert the next part of the event-list and advance the state to the end of this part.
+        @param events: The next events of the event-list, with the columns "timestamp", "sensor" and "value". All events
+        must come from one of the sensors in `self.sensors`.
+        @return: A dataset with one row for each new user action, see `events_to_dataset`. The row for the very first
+        user action of the event-list is omitted, because no sensor settings are known for it.
+        """
+        sensor_codes = self.sensors.get_indexer(events["sensor"])
+        if (sensor_codes < 0).any():
+            raise ValueError("Unknown sensor(s) %s" % ", ".join(map(str, events["sensor"][sensor_codes < 0].unique())))
+        values = events["value"].values
+        timestamps = events["timestamp"].values.view("i8")
+
+        #create a matrix with one row per event and one column per sensor, that contains for every event the position
+        #of the most recent preceding event of each sensor (or -1 if the sensor has not sent any events in this part);
+        #one extra row at the end points to the last events of all sensors
+        #e.g. if at T=0 sensor=value 1 and at T=10 sensor=value2, then all in-between T=(1-9) point to the event at T=0
+        positions = numpy.arange(len(events))
+        last_events = numpy.empty((len(events) + 1, len(self.sensors)), dtype=int, order="F")
+        last_events.fill(-1)
+        last_events[positions + 1, sensor_codes] = positions
+        #forward fill the sensor data in one pass over all sensors
+        numpy.maximum.accumulate(last_events, axis=0, out=last_events)
+
+        def data_for_sensor(code, sensor):
+            last_event = last_events[:-1, code]
+            has_event = last_event >= 0
+
+            #current sensor value at the time of each action, taken from the state if the sensor did not change yet
+            sensor_values = numpy.where(has_event, values.take(last_event), self.values[code])
+
+            #calculate for each user action, how much time has passed since the sensor value changed
+            changed = numpy.where(has_event, timestamps.take(last_event), self.timestamps[code])
+            is_known = (changed != iNaT) & (timestamps != iNaT)
+            time_passed = numpy.where(is_known, timestamps - changed, iNaT)
+
+            return [(sensor, sensor_values.astype(object)), ("%s_timedelta" % sensor, time_passed.view("m8[ns]"))]
+
+        #create dataset with one row per use action and two columns for each sensor:
+        #column "sensor" contains sensor values, column "sensor (timedelta)" contains time passed since the sensor value
+        #changed at the time of the action corresponding to the current row
+        columns = [column for code, sensor in enumerate(self.sensors) for column in data_for_sensor(code, sensor)]
+        columns += [("action", action_names(sensor_codes, self.sensors, events["value"])),
+                    ("action_timestamp", timestamps.view("M8[ns]"))]
+
+        #each row is labelled with the event that precedes the user action
+        if self.last_event is None or len(events) == 0:
+            index, first_row = events.index[0:-1], 1
+        else:
+            index, first_row = pandas.Index([self.last_event]).append(events.index[0:-1]), 0
+        data = pandas.DataFrame(dict((column, column_values[first_row:]) for column, column_values in columns),
+                                index=index, columns=[column for column, column_values in columns])
+
+        #advance the state to the end of this part of the event-list
+        has_event = last_events[-1] >= 0
+        self.values[has_event] = values.take(last_events[-1][has_event])
+        self.timestamps[has_event] = timestamps.take(last_events[-1][has_event])
+        if len(events) > 0:
+            self.last_event = events.index[-1]
+
+        return data
+
+
+def action_names(sensor_codes, sensors, values):
+    """
+    Name each event "sensor=value". Only the distinct (sensor, value) pairs are formatted as strings, the names for all
+    events are then looked up via their integer codes.
+    @param sensor_codes: The integer codes of the sensors of the events, i.e. their positions in `sensors`.
+    @param sensors: The names of the sensors.
+    @param values: The values of the events.
+    @return: A numpy array with the names of the events.
+    """
+    value_codes, values = pandas.factorize(values)
+    values = numpy.append(values.astype(object), numpy.nan)   #code -1 marks a missing value -> look up NaN
+    pair_codes, pairs = pandas.factorize(sensor_codes * len(values) + value_codes % len(values))
+    pair_names = numpy.array(["%s=%s" % (sensors[pair // len(values)], values[pair % len(values)])
+                              for pair in pairs], dtype=object)
+    return pair_names.take(pair_codes)
+
+
 def convert_timedeltas(timedelta_data):
     """
     Convert the numpy timedeltas (which are in nanoseconds) to seconds
     @param original: The original dataset with numpy timedeltas.
     @return: The dataset with timedeltas replaced
     """
-    nanoseconds_to_seconds = lambda ts: int(ts.item()/(1000.0*1000.0*1000.0))
-    is_missing = lambda ts: str(ts) == "NaT"
-    convert_timedelta = lambda ts: numpy.nan if is_missing(ts) else nanoseconds_to_seconds(ts)
+    #whole seconds, rounded towards zero; missing timedeltas (NaT) become NaN
+    nanoseconds = timedelta_data.values.view("i8")
+    seconds = (numpy.sign(nanoseconds) * (numpy.abs(nanoseconds) // 1000000000)).astype(float)
+    seconds[nanoseconds == iNaT] = numpy.nan
 
-    return timedelta_data.applymap(convert_timedelta)
+    return pandas.DataFrame(seconds, index=timedelta_data.index, columns=timedelta_data.columns)
 
 
-def dataset_to_sklearn(data):
+def dataset_to_sklearn(data, features=None, target_names=None, layout="dense"):
     """
     Convert the dataset into one that can be used by the scikit-learn library [http://scikit-learn.org]
 
@@ -222,26 +479,53 @@ def dataset_to_sklearn(data):
        times - the content of the action_timestamp column, as a numpy array
        target_names - a sorted list of all distinct values in the action column
 
+    For datasets with many sensors, most of the binary features are 0 and the dense float matrix wastes a lot of memory.
+    Two alternative layouts store the data as a `SplitMatrix` instead, i.e. in two separate blocks for the binary
+    features and the timedeltas: the "compact" layout stores the binary features as an int8 matrix, the "sparse" layout
+    stores them as a scipy CSR matrix. In both layouts the timedeltas are stored as int32 seconds. All classifiers
+    accept these layouts in the same way as the dense matrix.
+
     @param data: The dataset as produced by `load_dataset`.
+    @param features: Optionally, the features of the resulting dataset, e.g. to convert several parts of a dataset in a
+    compatible way. Per default, the features are the settings found in the dataset plus the sensor timedeltas.
+    @param target_names: Optionally, the target names of the resulting dataset. Per default, the target names are the
+    distinct values in the action column.
+    @param layout: The layout of the data matrix, one of "dense" (default), "compact" or "sparse".
     @return: The dataset in scikit-learn format.
     """
-    #convert a nominal attribute to several binary features, one for each attribute value
+    #convert nominal attributes to several binary features, one for each attribute value
     #e.g."door" [open/close] converts to "door=open" (can be 1 or 0) and "door=closed)" (can be 1 or 0)
-    def attribute_to_binary(attribute_data):
-        attribute_data = attribute_data.dropna()
-        if attribute_data.empty:
-            return None
-
-        def binary_column_for_value(val):
-            return attribute_data.apply(lambda v: 1 if v == val else 0)
-
-        attribute_values = attribute_data.unique()
-        binary_columns = [binary_column_for_value(value) for value in attribute_values]
-        binary_columns = pandas.concat(binary_columns, axis=1)
-        binary_columns.columns = [(attribute_data.name, value) for value in attribute_values]
-
-        return binary_columns
-
+    def settings_to_binary(value_data, settings, codes):
+        #codes[i] contains for each row the position of the current value of sensor i in the settings for this sensor,
+        #or -1 if the current value is not among these settings
+        columns_for_sensor = dict((sensor, []) for sensor in value_data.columns)
+        for column, (sensor, value) in enumerate(settings):
+            columns_for_sensor[sensor].append(column)
+
+        #set the features for the current values of all sensors to 1 in one go
+        rows, columns = [numpy.zeros(0, dtype=int)], [numpy.zeros(0, dtype=int)]
+        for sensor, sensor_codes in zip(value_data.columns, codes):
+            is_setting = sensor_codes >= 0
+            rows.append(numpy.flatnonzero(is_setting))
+            columns.append(numpy.array(columns_for_sensor[sensor], dtype=int).take(sensor_codes[is_setting]))
+        rows, columns = numpy.concatenate(rows), numpy.concatenate(columns)
+
+        shape = (len(value_data), len(settings))
+        if layout == "sparse":
+            return sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int8), (rows, columns)), shape=shape)
+        binarized = numpy.zeros(shape, dtype=numpy.int8 if layout == "compact" else float)
+        binarized[rows, columns] = 1
+
+        #the value of a sensor is not known at the beginning of the dataset -> all its binary features are missing
+        #(the compact layouts can not represent missing values, the features are left at 0)
+        if layout == "dense":
+            sensor_for_setting = [value_data.columns.get_loc(sensor) for sensor, value in settings]
+            binarized[value_data.isnull().values[:, sensor_for_setting]] = numpy.nan
+
+        return binarized
+
+    if not layout in layouts:
+        raise ValueError("Unknown layout %s, must be one of %s" % (layout, ", ".join(layouts)))
     dataset_name = data.name
 
     #save actions and action timestamps in separate variables, then drop these columns from the dataset
@@ -253,72 +537,411 @@ def dataset_to_sklearn(data):
     timedelta_columns = [col for col in data.columns if col.endswith("_timedelta")]
     value_columns = [col for col in data.columns if not col in timedelta_columns]
 
+    #integer-code the values of each sensor
+    if features is None:
+        #one binary feature for each value of a sensor, in the order in which the values first appear
+        codes, values = zip(*[pandas.factorize(data[sensor]) for sensor in value_columns]) or ((), ())
+        settings = [(sensor, value) for sensor, sensor_values in zip(value_columns, values) for value in sensor_values]
+    else:
+        settings = [col for col in features if isinstance(col, tuple)]
+        timedelta_columns = [col for col in features if not col in settings]
+        codes = [pandas.Index([v for s, v in settings if s == sensor]).get_indexer(data[sensor].values)
+                 for sensor in value_columns]
+
     #scikit does not support nominal attributes -> convert each attribute to several binary features, one for each value
-    binarized_data = pandas.concat([attribute_to_binary(data[attribute]) for attribute in value_columns], axis=1)
+    binarized_data = settings_to_binary(data[value_columns], settings, codes)
 
     #convert timedelta data from numpy timedeltas to seconds
-    binarized_data[timedelta_columns] = convert_timedeltas(data[timedelta_columns])
+    timedelta_data = convert_timedeltas(data[timedelta_columns]).values
+
+    if layout == "dense":
+        data = numpy.hstack([binarized_data, timedelta_data])
+    else:
+        timedelta_data[numpy.isnan(timedelta_data)] = SplitMatrix.missing_timedelta
+        data = SplitMatrix(binarized_data, timedelta_data.astype(numpy.int32))
 
     return Bunch(name=dataset_name,
-                 data=binarized_data.values,
+                 data=data,
                  target=targets.values,
-                 features=binarized_data.columns,
+                 features=pandas.Index(settings + timedelta_columns),
                  times=times.values,
-                 target_names=sorted(targets.unique()))
+                 target_names=sorted(targets.unique()) if target_names is None else list(target_names))
+
+
+class SplitMatrix():
+    """
+    Memory-saving alternative to the dense data matrix of a dataset in scikit-learn format, see `dataset_to_sklearn`.
+    The matrix is stored in two blocks:
+       settings - the binary features, one int8 column for each setting (sensor, value); either a numpy array or a
+                  scipy CSR matrix. Sensor values that are not known are stored as 0 (instead of NaN).
+       timedeltas - one int32 column for each sensor timedelta, in seconds. Timedeltas that are not known are stored
+                  as `missing_timedelta` (instead of NaN).
+    Rows are selected like for numpy arrays, e.g. `matrix[train]` with a boolean mask, an index array or a slice.
+    """
+
+    #marks timedeltas that are not known
+    missing_timedelta = -1
+
+    def __init__(self, settings, timedeltas):
+        """
+        @param settings: The block with the binary features.
+        @param timedeltas: The block with the timedeltas.
+        """
+        self.settings = settings
+        self.timedeltas = timedeltas
+        self.shape = (timedeltas.shape[0], settings.shape[1] + timedeltas.shape[1])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        """
+        Select rows of the matrix.
+        @param rows: A boolean mask, an array of row indexes or a slice.
+        @return: A SplitMatrix that contains only the selected rows.
+        """
+        if not isinstance(rows, slice):
+            #scipy sparse matrices do not support boolean masks and empty index arrays
+            rows = numpy.asarray(rows)
+            rows = numpy.flatnonzero(rows) if rows.dtype == bool else rows
+            if len(rows) == 0:
+                rows = slice(0, 0)
+        return SplitMatrix(self.settings[rows], self.timedeltas[rows])
+
+    def timedeltas_in_seconds(self):
+        """
+        @return: The timedeltas as a float matrix, timedeltas that are not known are NaN.
+        """
+        timedeltas = self.timedeltas.astype(float)
+        timedeltas[self.timedeltas == self.missing_timedelta] = numpy.nan
+        return timedeltas
+
+    def toarray(self):
+        """
+        @return: The matrix as dense float matrix.
+        """
+        settings = self.settings.toarray() if sparse.issparse(self.settings) else self.settings
+        return numpy.hstack([settings.astype(float), self.timedeltas_in_seconds()])
+
+
+class Vocabulary():
+    """
+    Dense integer ids for the sensors, settings and targets (user actions) of a dataset in scikit-learn format. The
+    classifiers work with these ids internally instead of comparing and hashing strings and tuples:
+       settings - the id of a setting (sensor, value) is its column in the settings part of the data matrix
+       sensors - the id of a sensor is its position in the sorted list of sensors
+       targets - the id of a target is its position in the sorted list of target names
+    """
+
+    def __init__(self, features, target_names):
+        """
+        @param features: The features of the dataset, see `dataset_to_sklearn`.
+        @param target_names: The possible targets of the dataset.
+        """
+        self.settings = [col for col in features if isinstance(col, tuple)]
+        timedelta_columns = pandas.Index([col for col in features if not isinstance(col, tuple)])
+        self.sensors = pandas.Index(sorted(set(sensor for sensor, value in self.settings)))
+        self.targets = pandas.Index(sorted(target_names))
+
+        #for each setting the id of its sensor and the position of the sensor's timedelta column
+        self.setting_sensor = self.sensors.get_indexer([sensor for sensor, value in self.settings])
+        self.setting_timedelta = timedelta_columns.get_indexer(["%s_timedelta" % sensor
+                                                                for sensor, value in self.settings])
+
+        #targets are named "sensor=value", the user action leads to this setting; for each target the id of the setting
+        #and for each setting the id of the target (-1 if the target is not a known setting or vice versa)
+        setting_ids = dict((setting, i) for i, setting in enumerate(self.settings))
+        self.target_setting = numpy.array([setting_ids.get(tuple(target.split("=")), -1) for target in self.targets],
+                                          dtype=int)
+        self.setting_target = numpy.empty(len(self.settings), dtype=int)
+        self.setting_target.fill(-1)
+        is_setting = self.target_setting >= 0
+        self.setting_target[self.target_setting[is_setting]] = numpy.flatnonzero(is_setting)
+
+    def target_ids(self, targets):
+        """
+        @param targets: A list or array of target names.
+        @return: A numpy array with the ids of the targets, -1 for targets that are not in the vocabulary.
+        """
+        return self.targets.get_indexer(numpy.asarray(targets, dtype=object))
+
+    def possible_targets_mask(self, active_settings):
+        """
+        Calculate which targets are possible in the current situation: an action that would lead to a setting that is
+        already active is not possible, e.g. a window can only be opened if it is currently closed.
+        @param active_settings: A numpy array with the ids of the currently active settings.
+        @return: A numpy array with one entry for each target, 1 if the target is possible and 0 if not.
+        """
+        mask = numpy.ones(len(self.targets), dtype=int)
+        impossible_targets = self.setting_target[active_settings]
+        mask[impossible_targets[impossible_targets >= 0]] = 0
+        return mask
 
 
-def write_dataset_as_arff(data, path_to_arff):
+def write_dataset_as_arff(data, path_to_arff, block_size=10000):
     """
     Convert the dataset into the arff format that is used by the weka machine learning framework. The resulting file
-    can be loaded into dataset and different machine learning algorithms can be tested.
+    can be loaded into dataset and different machine learning algorithms can be tested. The rows are formatted and
+    written in blocks of `block_size` rows, so that the memory needed for writing does not grow with the size of the
+    dataset. Missing values are written as "?".
     @param data: The dataset as produced by `load_dataset_raw`.
     @param path_to_arff: The file to which the resulting arff should be written.
+    @param block_size: How many rows to format and write at once.
     @return: None
     """
 
+    #nominal values with characters that have a special meaning in arff must be quoted
+    def quoted(value):
+        value = value if isinstance(value, basestring) else str(value)
+        if any(c in value for c in " ,{}%'\"\t\\"):
+            return "'%s'" % value.replace("\\", "\\\\").replace("'", "\\'")
+        return value
+
+    is_timedelta = lambda col: col.endswith("_timedelta")
+    is_timestamp = lambda col: data[col].dtype.kind == "M"
+
     def columns_as_arff_attributes():
         """
         The arff header contains information about all attributes (=columns) in the dataset. This method converts column
         metadata into the correct arff format.
         @return: A list of strings with the arff descriptions for all columns in the dataset.
         """
-        value_column_to_attribute = lambda col: "@attribute %s {%s}" % (col, ",".join(data[col].dropna().unique()))
-        timestamp_column_to_attribute = lambda col: "@attribute %s real" % col
-        column_to_attribute = lambda col: timestamp_column_to_attribute(col) if "timedelta" in col \
+        value_column_to_attribute = lambda col: "@attribute %s {%s}" % (col, ",".join(quoted(value) for value
+                                                                                       in data[col].dropna().unique()))
+        timedelta_column_to_attribute = lambda col: "@attribute %s real" % col
+        timestamp_column_to_attribute = lambda col: "@attribute %s date \"yyyy-MM-dd HH:mm:ss\"" % col
+        column_to_attribute = lambda col: timedelta_column_to_attribute(col) if is_timedelta(col) \
+                                          else timestamp_column_to_attribute(col) if is_timestamp(col) \
                                           else value_column_to_attribute(col)
 
         return [column_to_attribute(column) for column in data.columns]
 
+    def seconds_as_arff_strings(seconds):
+        #timedeltas are whole seconds, convert to int first so that they are formatted without decimals
+        is_missing = numpy.isnan(seconds)
+        strings = numpy.where(is_missing, 0, seconds).astype(numpy.int64).astype(str).astype(object)
+        strings[is_missing] = "?"
+        return strings
 
-    def data_as_arff_strings():
+    def timestamps_as_arff_strings(timestamps):
+        #"yyyy-MM-ddTHH:mm:ss" plus possibly a timezone suffix, which is cut off
+        strings = numpy.datetime_as_string(timestamps.astype("M8[s]")).astype("S19")
+        strings = numpy.char.add(numpy.char.add("\"", numpy.char.replace(strings, "T", " ")), "\"").astype(object)
+        strings[timestamps.view("i8") == iNaT] = "?"
+        return strings
+
+    def nominals_as_arff_strings(values):
+        #format each distinct value only once, missing values (code -1) are mapped to the last entry "?"
+        codes, values = pandas.factorize(values)
+        return numpy.array([quoted(value) for value in values] + ["?"], dtype=object).take(codes)
+
+    timedelta_columns = [col for col in data.columns if is_timedelta(col)]
+
+    def block_as_arff_lines(block):
         """
-        Map each row in the dataset to a string in arff format.
-        @return: A list of strings, one for each row in the dataset
+        Map each row in a block of the dataset to a line in arff format, column values are separated by ",".
+        @return: One string with the lines for all rows in the block.
         """
+        seconds = convert_timedeltas(block[timedelta_columns])
+
+        #fill a table that alternates between the formatted values and the separators of one row, the whole block is
+        #then joined into one string in a single call
+        table = numpy.empty((len(block), 2 * len(block.columns)), dtype=object)
+        for i, col in enumerate(block.columns):
+            if is_timedelta(col):
+                table[:, 2 * i] = seconds_as_arff_strings(seconds[col].values)
+            elif is_timestamp(col):
+                table[:, 2 * i] = timestamps_as_arff_strings(block[col].values)
+            else:
+                table[:, 2 * i] = nominals_as_arff_strings(block[col].values)
+        table[:, 1::2] = ","
+        table[:, -1] = "\n"
+        return "".join(table.ravel().tolist())
+
+    with open(path_to_arff, "w") as f:
+        #arff header contains the name of the dataset and one line for each attribute describing the attribute's type
+        f.write("@relation %s\n" % data.name)
+        f.write("\n".join(columns_as_arff_attributes()))
+
+        #arff body has one line for each row in the dataset with the values of this row
+        f.write("\n\n@data\n")
+        for start in range(0, len(data), block_size):
+            block = data.iloc[start:min(start + block_size, len(data))]
+            lines = block_as_arff_lines(block)
+            f.write(lines.encode("utf-8") if isinstance(lines, unicode) else lines)
+
+
+def dataset_layout(data):
+    """
+    Determine the layout of the data matrix of a dataset in scikit-learn format.
+    @param data: The dataset in scikit-learn format, see `dataset_to_sklearn`.
+    @return: One of the `layouts`.
+    """
+    if not isinstance(data.data, SplitMatrix):
+        return "dense"
+    elif sparse.issparse(data.data.settings):
+        return "sparse"
+    return "compact"
 
-        #convert timestamps to format that arff can understand
-        timedelta_columns = filter(lambda col: isinstance(data[col][0], numpy.timedelta64), data.columns)
-        converted_data = convert_timedeltas(data)
 
-        #replace any N/A values with the arff symbol "?" for missing data
-        converted_data = converted_data.fillna("?")
+def concatenate_datasets(parts):
+    """
+    Concatenate several parts of a dataset in scikit-learn format, e.g. the parts returned by `iter_dataset`. All parts
+    must have the same features, target names and layout.
+    @param parts: A list of datasets in scikit-learn format.
+    @return: One dataset that contains the rows of all parts.
+    """
+    layout = dataset_layout(parts[0])
+    if layout == "dense":
+        data = numpy.vstack([part.data for part in parts])
+    else:
+        stack = (lambda matrices: sparse.vstack(matrices, format="csr")) if layout == "sparse" else numpy.vstack
+        data = SplitMatrix(stack([part.data.settings for part in parts]),
+                           numpy.vstack([part.data.timedeltas for part in parts]))
+
+    return Bunch(name=parts[0].name,
+                 data=data,
+                 target=numpy.concatenate([part.target for part in parts]),
+                 features=parts[0].features,
+                 times=numpy.concatenate([part.times for part in parts]),
+                 target_names=parts[0].target_names)
+
+
+def dataset_as_arrays(data):
+    """
+    Split a dataset in scikit-learn format into numpy arrays and metadata, e.g. for storing the dataset on disk.
+    @param data: The dataset in scikit-learn format, see `dataset_to_sklearn`.
+    @return: A dictionary of numpy arrays and a dictionary with metadata (the name, layout, features and target names
+    of the dataset) that can be serialized as json.
+    """
+    arrays = {"target": numpy.array(data.target, dtype=unicode), "times": data.times}
+    layout = dataset_layout(data)
+    if layout == "dense":
+        arrays["data"] = data.data
+    elif layout == "sparse":
+        settings = sparse.csr_matrix(data.data.settings)
+        arrays.update(settings_data=settings.data, settings_indices=settings.indices, settings_indptr=settings.indptr,
+                      timedeltas=data.data.timedeltas)
+    else:
+        arrays.update(settings=data.data.settings, timedeltas=data.data.timedeltas)
+
+    metadata = {"version": storage_version,
+                "name": data.name,
+                "layout": layout,
+                "features": [list(col) if isinstance(col, tuple) else col for col in data.features],
+                "target_names": list(data.target_names)}
+    return arrays, metadata
+
+
+def dataset_from_arrays(arrays, metadata):
+    """
+    Assemble a dataset in scikit-learn format from the numpy arrays and metadata created by `dataset_as_arrays`.
+    @param arrays: A dictionary of numpy arrays, the arrays are used as they are (e.g. without copying memory-mapped
+    arrays into memory).
+    @param metadata: The metadata of the dataset.
+    @return: The dataset in scikit-learn format.
+    """
+    features = [tuple(col) if isinstance(col, list) else col for col in metadata["features"]]
+    if metadata["layout"] == "dense":
+        data = arrays["data"]
+    elif metadata["layout"] == "sparse":
+        settings_shape = (len(arrays["timedeltas"]), len([col for col in features if isinstance(col, tuple)]))
+        settings = sparse.csr_matrix((arrays["settings_data"], arrays["settings_indices"], arrays["settings_indptr"]),
+                                     shape=settings_shape)
+        data = SplitMatrix(settings, arrays["timedeltas"])
+    else:
+        data = SplitMatrix(arrays["settings"], arrays["timedeltas"])
+
+    return Bunch(name=metadata["name"],
+                 data=data,
+                 target=arrays["target"],
+                 features=pandas.Index(features),
+                 times=arrays["times"],
+                 target_names=metadata["target_names"])
+
+
+def write_dataset_as_npz(data, path_to_npz):
+    """
+    Store a dataset in scikit-learn format in the binary npz format of numpy. The file is written under a temporary name
+    first and then renamed, so that other processes never see a partially written file.
+    @param data: The dataset in scikit-learn format, see `dataset_to_sklearn`.
+    @param path_to_npz: The file to which the dataset should be written.
+    @return: None
+    """
+    arrays, metadata = dataset_as_arrays(data)
+    arrays["metadata"] = numpy.array(json.dumps(metadata))
+
+    temporary_path = "%s.%d.tmp" % (path_to_npz, os.getpid())
+    with open(temporary_path, "wb") as f:
+        numpy.savez(f, **arrays)
+    os.rename(temporary_path, path_to_npz)
 
-        #convert each row to one string, column values are separated by ","
-        row_to_string = lambda row: ",".join(row.values)
-        converted_data = converted_data.apply(row_to_string, axis=1)
 
-        return converted_data.values
+def load_dataset_npz(path_to_npz):
+    """
+    Read a dataset that was stored with `write_dataset_as_npz`.
+    @param path_to_npz: The file that contains the dataset.
+    @return: The dataset in scikit-learn format.
+    """
+    with open(path_to_npz, "rb") as f:
+        arrays = numpy.load(f)
+        metadata = json.loads(str(arrays["metadata"]))
+        check_storage_version(path_to_npz, metadata)
+        arrays = dict((name, arrays[name]) for name in arrays.files)
+    arrays["target"] = arrays["target"].astype(object)
+    return dataset_from_arrays(arrays, metadata)
 
-    f = open(path_to_arff, "w")
 
-    #arff header contains the name of the dataset and one line for each attribute describing the attribute's type
-    f.write("@relation %s\n" % data.name)
-    f.write("\n".join(columns_as_arff_attributes()))
+def check_storage_version(path, metadata):
+    """
+    Make sure that a stored dataset was written with the current version of the storage format.
+    @param path: The path of the stored dataset, used in the error message.
+    @param metadata: The metadata of the stored dataset.
+    @return: None
+    """
+    if metadata["version"] != storage_version:
+        raise ValueError("Dataset %s was stored in version %s of the format, expected version %d"
+                         % (path, metadata["version"], storage_version))
 
-    #arff body has one line for each row in the dataset with the values of this row
-    f.write("\n\n@data\n")
-    f.write("\n".join(data_as_arff_strings()))
-    f.close()
 
+def write_dataset_as_npy(data, directory):
+    """
+    Store a dataset in scikit-learn format as a directory with one npy file for each array of the dataset and a json file
+    with the metadata. In contrast to `write_dataset_as_npz`, datasets stored in this format can be opened as
+    memory-mapped arrays, see `load_dataset_npy`.
+    @param data: The dataset in scikit-learn format, see `dataset_to_sklearn`.
+    @param directory: The directory to which the dataset should be written, is created if it does not exist yet.
+    @return: None
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    arrays, metadata = dataset_as_arrays(data)
+    for name, array in arrays.items():
+        numpy.save(os.path.join(directory, name + ".npy"), array)
+    #write the metadata last, a directory without metadata is not a complete dataset
+    with open(os.path.join(directory, "metadata.json"), "w") as f:
+        json.dump(metadata, f)
 
 
+def load_dataset_npy(directory, mmap_mode="r"):
+    """
+    Read a dataset that was stored with `write_dataset_as_npy`. By default all arrays of the dataset are memory-mapped,
+    i.e. only the parts of the arrays that are actually indexed (e.g. the rows of one fold in an experiment) are read
+    from disk, and several processes that open the same dataset share one copy of the data via the OS page cache.
+    @param directory: The directory that contains the dataset.
+    @param mmap_mode: How to memory-map the arrays, see `numpy.load`. Use None to read the whole dataset into memory.
+    @return: The dataset in scikit-learn format. The targets are stored as fixed-width unicode strings, if the arrays
+    are memory-mapped the target array is not converted to an object array.
+    """
+    path_to_metadata = os.path.join(directory, "metadata.json")
+    if not os.path.exists(path_to_metadata):
+        raise ValueError("Could not find a stored dataset at %s" % os.path.abspath(directory))
+    with open(path_to_metadata) as f:
+        metadata = json.load(f)
+    check_storage_version(directory, metadata)
+
+    names = [os.path.splitext(f)[0] for f in os.listdir(directory) if f.endswith(".npy")]
+    arrays = {name: numpy.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode) for name in names}
+    if mmap_mode is None:
+        arrays["target"] = arrays["target"].astype(object)
+    return dataset_from_arrays(arrays, metadata)
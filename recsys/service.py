@@ -0,0 +1,566 @@
+# -*- coding: UTF-8 -*-
+"""
+This module implements a long-running recommendation service around a trained `TemporalEvidencesClassifier`. The
+service keeps the current value of each sensor and the time of its last change, and calculates recommendations for the
+current situation on request. Clients talk to the service over a local TCP or Unix socket with a line-delimited JSON
+protocol: each line sent to the service is one JSON object (a message), and the service answers each message with
+exactly one line, in the order of the messages. Messages:
+
+   {"type": "event", "sensor": "Fridge", "value": "Open", "timestamp": "2013-01-01 00:02:03"}
+        A sensor has sent a new value. The timestamp is optional (default: now) and can be a string that pandas can
+        parse or the seconds since the epoch. Answer: {"type": "ok"}
+   {"type": "recommend", "timestamp": ...}
+        Calculate recommendations for the current situation at the given time (default: now). Answer:
+        {"type": "recommendations", "recommendations": [...], "conflict": 0.1, "theta": 0.2, "latency": 0.001}
+   {"type": "statistics"}
+        Answer: {"type": "statistics", ...} with the throughput and latency counters, see `RecommendationService`.
+   {"type": "subscribe"}
+        Answer: {"type": "subscribed", ...} with the current recommendations. From then on, the service pushes a line
+        {"type": "update", "timestamp": ..., "recommendations": [...], "conflict": ..., "theta": ...} to this
+        connection whenever the recommendations change, see `UpdateScheduler`. Subscribers should use a separate
+        connection for sending messages, since pushed updates are not answers to messages.
+
+Invalid messages are answered with {"type": "error", "message": "..."}. Messages can carry an "id", which is copied
+into the answer. The network part is based on tornado, `EventPublisher` is a simple blocking client that replays an
+event-list to the service, e.g. to simulate a home in tests.
+"""
+
+from collections import deque
+import json
+import socket
+import threading
+import time
+
+import numpy
+import pandas
+from pandas.tslib import iNaT
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.netutil import bind_sockets, bind_unix_socket
+from tornado.tcpserver import TCPServer
+
+
+def parse_timestamp(timestamp):
+    """
+    Convert the timestamp of a message into nanoseconds since the epoch.
+    @param timestamp: A string that pandas can parse, the seconds since the epoch or None for the current time.
+    @return: The timestamp in nanoseconds as integer.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    if isinstance(timestamp, basestring):
+        return pandas.Timestamp(timestamp).value
+    return int(round(timestamp * 1e9))
+
+
+class SituationTracker():
+    """
+    Tracks the current situation of a home event by event: the current setting of each sensor (one-hot, as in the
+    settings part of a data row), the time of the last change of each sensor and the active settings. Each event is
+    processed in constant time, independent of the number of sensors and of the number of past events. The situation at
+    some point in time is available as a data row in the same format as produced by `dataset.dataset_to_sklearn` for
+    the state before a user action (see `as_row`), or directly as active settings and timedelta bins for
+    `TemporalEvidencesClassifier.predict_situation` (see `active_settings` and `bins`).
+    """
+
+    def __init__(self, classifier):
+        """
+        Initialize the tracker, the values of all sensors are not known yet.
+        @param classifier: The trained classifier, defines the features of the rows and the bins of the timedeltas.
+        """
+        self.classifier = classifier
+        vocabulary = classifier.vocabulary
+        self.sensor_ids = {sensor: id for id, sensor in enumerate(vocabulary.sensors)}
+        self.setting_ids = {setting: id for id, setting in enumerate(vocabulary.settings)}
+        #the position of the timedelta column of each sensor in the timedelta part of the data matrix, and the ids of
+        #the settings of each sensor
+        self.sensor_timedelta = pandas.Index(classifier.timedelta_columns).get_indexer(
+            ["%s_timedelta" % sensor for sensor in vocabulary.sensors])
+        self.sensor_settings = [numpy.flatnonzero(vocabulary.setting_sensor == sensor_id)
+                                for sensor_id in range(len(vocabulary.sensors))]
+
+        #for each sensor the id of its current setting (-1 if the value is not among the settings) and the time of the
+        #last event in nanoseconds (iNaT if the sensor has not sent any events yet)
+        self.settings = -numpy.ones(len(vocabulary.sensors), dtype=int)
+        self.timestamps = numpy.array([iNaT] * len(vocabulary.sensors), dtype="i8")
+        #the settings part of the current data row, settings of sensors whose value is not known yet are NaN
+        self.settings_row = numpy.empty(len(vocabulary.settings))
+        self.settings_row.fill(numpy.nan)
+
+    def update(self, sensor, value, timestamp):
+        """
+        Register a new event.
+        @param sensor: The sensor that sent the event.
+        @param value: The new value of the sensor.
+        @param timestamp: The time of the event in nanoseconds since the epoch.
+        @return: None
+        """
+        if not sensor in self.sensor_ids:
+            raise ValueError("Unknown sensor %s" % sensor)
+        sensor_id = self.sensor_ids[sensor]
+        old_setting, new_setting = self.settings[sensor_id], self.setting_ids.get((sensor, value), -1)
+
+        if self.timestamps[sensor_id] == iNaT:
+            self.settings_row[self.sensor_settings[sensor_id]] = 0.0
+        if old_setting >= 0:
+            self.settings_row[old_setting] = 0.0
+        if new_setting >= 0:
+            self.settings_row[new_setting] = 1.0
+        self.settings[sensor_id] = new_setting
+        self.timestamps[sensor_id] = timestamp
+
+    def timedeltas(self, timestamp, sensors=None):
+        """
+        @param timestamp: The current time in nanoseconds since the epoch.
+        @param sensors: The ids of the sensors, per default all sensors.
+        @return: A numpy array with the whole seconds since the last change of each sensor, rounded towards zero (see
+        `dataset.convert_timedeltas`), NaN for sensors that have not sent any events yet.
+        """
+        last_changes = self.timestamps if sensors is None else self.timestamps[sensors]
+        is_known = last_changes != iNaT
+        nanoseconds = timestamp - last_changes[is_known]
+        timedeltas = numpy.empty(len(last_changes))
+        timedeltas.fill(numpy.nan)
+        timedeltas[is_known] = numpy.sign(nanoseconds) * (numpy.abs(nanoseconds) // 1000000000)
+        return timedeltas
+
+    def active_settings(self):
+        """
+        @return: A numpy array with the ids of the currently active settings, in ascending order.
+        """
+        return numpy.sort(self.settings[self.settings >= 0])
+
+    def bins(self, timestamp, settings=None):
+        """
+        @param timestamp: The current time in nanoseconds since the epoch.
+        @param settings: The ids of active settings as returned by `active_settings`, per default all active settings.
+        @return: A numpy array with the current bin index of the sensor of each active setting, see
+        `TemporalEvidencesClassifier.digitize_timedeltas`.
+        """
+        settings = self.active_settings() if settings is None else settings
+        sensors = self.classifier.vocabulary.setting_sensor[settings]
+        return self.classifier.digitize_timedeltas(self.timedeltas(timestamp, sensors))
+
+    def next_bin_change(self, timestamp):
+        """
+        Calculate when the situation changes next without a new event: the timedeltas of the active settings grow in
+        whole seconds, and the bin of a timedelta changes when it reaches the next border of the bins.
+        @param timestamp: The current time in nanoseconds since the epoch.
+        @return: The earliest time after `timestamp` at which the bin of an active setting changes, in nanoseconds since
+        the epoch, or None if the bins do not change anymore (all timedeltas are beyond the last border).
+        """
+        sensors = self.classifier.vocabulary.setting_sensor[self.active_settings()]
+        #whole-second timedeltas reach a border b when they reach ceil(b)
+        borders = numpy.ceil(numpy.asarray(self.classifier.bins, dtype=float))
+        next_borders = numpy.searchsorted(borders, self.timedeltas(timestamp, sensors), side="right")
+        has_next = next_borders < len(borders)
+        if not has_next.any():
+            return None
+        changes = self.timestamps[sensors[has_next]] + borders[next_borders[has_next]].astype(numpy.int64) * 1000000000
+        return int(changes.min())
+
+    def as_row(self, timestamp):
+        """
+        @param timestamp: The current time in nanoseconds since the epoch.
+        @return: A dense data matrix with one row that describes the current situation, see `dataset.dataset_to_sklearn`.
+        The binary features of sensors whose value is not known yet and their timedeltas are NaN.
+        """
+        timedeltas = numpy.empty(len(self.classifier.timedelta_columns))
+        timedeltas.fill(numpy.nan)
+        timedeltas[self.sensor_timedelta] = self.timedeltas(timestamp)
+
+        row = numpy.empty((1, len(self.classifier.features)))
+        row[0, self.classifier.settings_positions] = self.settings_row
+        row[0, self.classifier.timedelta_positions] = timedeltas
+        return row
+
+
+class UpdateScheduler():
+    """
+    Recalculates the recommendations for the situation of a `SituationTracker` only when they can change: when an event
+    changes the situation, or when the timedelta of an active setting crosses a border of the bins (a "tick", see
+    `SituationTracker.next_bin_change`). Between these points in time the recommendations stay the same, so requests for
+    recommendations are answered without recalculating them. Subscribers are notified whenever the recalculated
+    recommendations differ from the last notified ones. Without subscribers the recommendations are only recalculated
+    when they are requested, with subscribers after each event and at each tick.
+    The scheduler works with the timestamps of the events and requests, it is advanced to a point in time by
+    `advance` (or by the other methods); a live service additionally advances it with a timer at the next tick.
+    """
+
+    def __init__(self, classifier, tracker):
+        """
+        @param classifier: The trained classifier.
+        @param tracker: The `SituationTracker` that contains the current situation.
+        """
+        self.classifier = classifier
+        self.tracker = tracker
+        #functions that are called with the update (see `__update__`) whenever the recommendations change
+        self.subscribers = []
+        #the recommendations (with conflict and theta) for the current situation, None if they have to be recalculated,
+        #and the last recommendations that were sent to the subscribers
+        self.current = None
+        self.notified = None
+        #the time of the next tick (None if there is none) and the latest time that the scheduler has been advanced to
+        self.next_tick = None
+        self.time = None
+        self.counters = {"recalculations": 0, "updates": 0}
+
+    def subscribe(self, subscriber, timestamp):
+        """
+        Add a subscriber.
+        @param subscriber: A function that is called with each update.
+        @param timestamp: The current time in nanoseconds since the epoch.
+        @return: The current recommendations as update, the subscriber is only notified about later changes.
+        """
+        #the ticks that have been missed since the scheduler was advanced the last time are outdated, the existing
+        #subscribers only get the recommendations for the current time
+        self.advance(timestamp, notify=False)
+        self.recommendations(timestamp)
+        if len(self.subscribers) == 0:
+            self.notified = self.current
+        self.subscribers.append(subscriber)
+        return self.__update__(timestamp)
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def event(self, sensor, value, timestamp):
+        """
+        Register a new event, see `SituationTracker.update`.
+        """
+        self.advance(timestamp)
+        self.tracker.update(sensor, value, timestamp)
+        self.current = None
+        if len(self.subscribers) > 0:
+            self.__recalculate__(timestamp)
+
+    def recommendations(self, timestamp):
+        """
+        @param timestamp: The current time in nanoseconds since the epoch.
+        @return: The recommendations for the current situation, see `TemporalEvidencesClassifier.predict_situation`.
+        """
+        self.advance(timestamp)
+        if self.current is None:
+            self.__recalculate__(timestamp)
+        return self.current
+
+    def advance(self, timestamp, notify=True):
+        """
+        Process all ticks up to the given time.
+        @param timestamp: The current time in nanoseconds since the epoch.
+        @param notify: If false, the ticks are skipped without recalculating the recommendations and without notifying
+        the subscribers, the recommendations are recalculated when they are requested the next time.
+        @return: None
+        """
+        self.time = timestamp if self.time is None else max(self.time, timestamp)
+        while self.next_tick is not None and self.next_tick <= timestamp:
+            if notify and len(self.subscribers) > 0:
+                self.__recalculate__(self.next_tick)
+            else:
+                self.current, self.next_tick = None, None
+
+    def __recalculate__(self, timestamp):
+        """
+        Recalculate the recommendations at the given time, find the next tick and notify the subscribers if the
+        recommendations have changed.
+        """
+        settings = self.tracker.active_settings()
+        self.current = self.classifier.predict_situation(settings, self.tracker.bins(timestamp, settings),
+                                                         include_conflict_theta=True)
+        self.next_tick = self.tracker.next_bin_change(timestamp)
+        self.counters["recalculations"] += 1
+
+        if len(self.subscribers) > 0 and self.current != self.notified:
+            self.notified = self.current
+            self.counters["updates"] += 1
+            update = self.__update__(timestamp)
+            for subscriber in list(self.subscribers):
+                subscriber(update)
+
+    def __update__(self, timestamp):
+        """
+        @return: The current recommendations as message for the subscribers.
+        """
+        recommendations, conflict, theta = self.current
+        return {"type": "update", "timestamp": timestamp / 1e9, "recommendations": list(recommendations),
+                "conflict": float(conflict), "theta": float(theta)}
+
+
+class RecommendationService():
+    """
+    Answers the messages of the protocol described at the top of this module, independent of how the messages are
+    transferred. Keeps the following counters, which are returned for "statistics" messages:
+       events, recommendations, errors - how many messages of each kind have been handled
+       events_per_second, recommendations_per_second - throughput since the service was started
+       latency_mean, latency_median, latency_99, latency_max - seconds needed to calculate the recommendations for the
+                 last `latency_window` recommend messages
+       over_budget - how many recommendations took longer than the latency budget
+       recalculations, updates, subscribers - how often the recommendations were actually calculated, how many updates
+                 were pushed and how many subscribers there are, see `UpdateScheduler`
+    Recommendations are only recalculated when they can have changed, see `UpdateScheduler`.
+    """
+
+    #how many of the latest recommendation latencies are kept for the statistics
+    latency_window = 10000
+
+    def __init__(self, classifier, latency_budget=0.05):
+        """
+        @param classifier: A trained `TemporalEvidencesClassifier`. A classifier with a cache (see the `cache_size`
+        parameter) answers recurring situations faster.
+        @param latency_budget: The time in seconds that calculating recommendations should take at most. Slower
+        recommendations are still answered, but counted in the statistics.
+        """
+        self.classifier = classifier
+        self.latency_budget = latency_budget
+        self.tracker = SituationTracker(classifier)
+        self.scheduler = UpdateScheduler(classifier, self.tracker)
+        self.started = time.time()
+        self.counters = {"events": 0, "recommendations": 0, "errors": 0, "over_budget": 0}
+        self.latencies = deque(maxlen=self.latency_window)
+
+    def handle_line(self, line, subscriber=None, realtime=True):
+        """
+        Handle one line of the protocol.
+        @param line: The line with a JSON message.
+        @param subscriber: A function that sends updates to the client that sent the line, see `handle`.
+        @param realtime: See `handle`.
+        @return: The line with the JSON answer, including the line break.
+        """
+        try:
+            message = json.loads(line)
+            if not isinstance(message, dict):
+                raise ValueError("A message must be a JSON object")
+            answer = self.handle(message, subscriber, realtime)
+            if "id" in message:
+                answer["id"] = message["id"]
+        except Exception as e:
+            self.counters["errors"] += 1
+            answer = {"type": "error", "message": "%s: %s" % (e.__class__.__name__, e)}
+        return json.dumps(answer) + "\n"
+
+    def handle(self, message, subscriber=None, realtime=True):
+        """
+        Handle one message.
+        @param message: The message as dict.
+        @param subscriber: A function that sends updates (dicts) to the client that sent the message, needed for
+        "subscribe" messages.
+        @param realtime: If true, the timestamps of the messages are wall-clock time and subscriptions start at the
+        current time. If false (e.g. when replaying a recorded event-list), subscriptions start at the latest timestamp
+        that the service has seen.
+        @return: The answer as dict.
+        """
+        message_type = message.get("type")
+        if message_type == "event":
+            self.scheduler.event(message["sensor"], message["value"], parse_timestamp(message.get("timestamp")))
+            self.counters["events"] += 1
+            return {"type": "ok"}
+        if message_type == "recommend":
+            return self.recommend(parse_timestamp(message.get("timestamp")))
+        if message_type == "statistics":
+            return dict(self.statistics(), type="statistics")
+        if message_type == "subscribe":
+            if subscriber is None:
+                raise ValueError("Subscriptions are not supported for this client")
+            timestamp = parse_timestamp(None) if realtime or self.scheduler.time is None else self.scheduler.time
+            return dict(self.scheduler.subscribe(subscriber, timestamp), type="subscribed")
+        raise ValueError("Unknown message type %s" % message_type)
+
+    def recommend(self, timestamp):
+        """
+        Calculate the recommendations for the current situation.
+        @param timestamp: The current time in nanoseconds since the epoch.
+        @return: The answer with the sorted recommendations, conflict and theta.
+        """
+        start = time.time()
+        recommendations, conflict, theta = self.scheduler.recommendations(timestamp)
+        latency = time.time() - start
+
+        self.latencies.append(latency)
+        self.counters["recommendations"] += 1
+        if latency > self.latency_budget:
+            self.counters["over_budget"] += 1
+        return {"type": "recommendations", "recommendations": list(recommendations), "conflict": float(conflict),
+                "theta": float(theta), "latency": latency}
+
+    def statistics(self):
+        """
+        @return: A dict with the counters of the service.
+        """
+        uptime = max(time.time() - self.started, 1e-9)
+        latencies = numpy.array(self.latencies) if len(self.latencies) > 0 else numpy.zeros(1)
+        statistics = dict(self.counters)
+        statistics.update(self.scheduler.counters)
+        statistics.update(uptime=uptime,
+                          subscribers=len(self.scheduler.subscribers),
+                          events_per_second=self.counters["events"] / uptime,
+                          recommendations_per_second=self.counters["recommendations"] / uptime,
+                          latency_budget=self.latency_budget,
+                          latency_mean=float(latencies.mean()),
+                          latency_median=float(numpy.percentile(latencies, 50)),
+                          latency_99=float(numpy.percentile(latencies, 99)),
+                          latency_max=float(latencies.max()))
+        return statistics
+
+
+class RecommendationServer(TCPServer):
+    """
+    Tornado server that passes the lines received on each connection to a `RecommendationService` and writes back the
+    answers. All connections share the same service, i.e. the same sensor state. Connections that subscribe receive the
+    updates of the service.
+    """
+
+    def __init__(self, service, io_loop=None, realtime=True):
+        """
+        @param service: The `RecommendationService`.
+        @param io_loop: The IO loop of the server, see `TCPServer`.
+        @param realtime: If true, the timestamps of the messages are wall-clock time, and the updates at the ticks of
+        the scheduler are sent on time with a timer. If false (e.g. when replaying a recorded event-list), the ticks are
+        only processed when messages with later timestamps arrive.
+        """
+        TCPServer.__init__(self, io_loop=io_loop)
+        self.io_loop = io_loop or IOLoop.current()
+        self.service = service
+        self.realtime = realtime
+        self.timer = None
+
+    def handle_stream(self, stream, address):
+        def subscriber(update):
+            if not stream.closed():
+                stream.write(json.dumps(update) + "\n")
+
+        def read_line():
+            if not stream.closed():
+                stream.read_until("\n", handle_line)
+
+        def handle_line(line):
+            try:
+                stream.write(self.service.handle_line(line, subscriber, self.realtime))
+            except StreamClosedError:
+                return
+            self.schedule_tick()
+            read_line()
+
+        stream.set_close_callback(lambda: self.service.scheduler.unsubscribe(subscriber))
+        read_line()
+
+    def schedule_tick(self):
+        """
+        Set the timer to the next tick of the scheduler, if the server runs in real time and there are subscribers.
+        """
+        scheduler = self.service.scheduler
+        if self.timer is not None:
+            self.io_loop.remove_timeout(self.timer)
+            self.timer = None
+        if self.realtime and len(scheduler.subscribers) > 0 and scheduler.next_tick is not None:
+            self.timer = self.io_loop.add_timeout(scheduler.next_tick / 1e9, self.tick)
+
+    def tick(self):
+        self.timer = None
+        self.service.scheduler.advance(parse_timestamp(None))
+        self.schedule_tick()
+
+
+class ServiceThread():
+    """
+    Runs a `RecommendationServer` with its own IO loop in a background thread, e.g. for tests or for embedding the
+    service into another program. For a standalone service, add the sockets to a server on the main IO loop instead.
+    """
+
+    def __init__(self, service, port=0, unix_socket=None, realtime=True):
+        """
+        Start the server.
+        @param service: The `RecommendationService`.
+        @param port: The TCP port on localhost, 0 for any free port.
+        @param unix_socket: If not None, the path of a Unix socket that is used instead of a TCP port.
+        @param realtime: See `RecommendationServer`.
+        """
+        self.io_loop = IOLoop()
+        self.server = RecommendationServer(service, io_loop=self.io_loop, realtime=realtime)
+        if unix_socket is None:
+            sockets = bind_sockets(port, "127.0.0.1", family=socket.AF_INET)
+            self.address = sockets[0].getsockname()
+        else:
+            sockets = [bind_unix_socket(unix_socket)]
+            self.address = unix_socket
+        self.server.add_sockets(sockets)
+        self.thread = threading.Thread(target=self.io_loop.start)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the server and wait for the IO loop to finish.
+        """
+        def stop_server():
+            self.server.stop()
+            self.io_loop.stop()
+        self.io_loop.add_callback(stop_server)
+        self.thread.join()
+        self.io_loop.close(all_fds=True)
+
+
+class EventPublisher():
+    """
+    Blocking client for the recommendation service, that can replay an event-list to simulate the sensors of a home.
+    """
+
+    def __init__(self, address):
+        """
+        Connect to the service.
+        @param address: A tuple (host, port) for a TCP socket or the path of a Unix socket.
+        """
+        if isinstance(address, basestring):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        else:
+            self.socket = socket.create_connection(address)
+            #send each message right away instead of waiting for more data
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.lines = self.socket.makefile("r")
+
+    def close(self):
+        self.lines.close()
+        self.socket.close()
+
+    def send(self, message):
+        """
+        Send one message and wait for the answer.
+        @param message: The message as dict.
+        @return: The answer as dict.
+        """
+        self.socket.sendall(json.dumps(message) + "\n")
+        return json.loads(self.lines.readline())
+
+    def subscribe(self):
+        """
+        Subscribe to the updates of the service, afterwards the updates can be read with `receive`.
+        @return: The answer with the current recommendations.
+        """
+        return self.send({"type": "subscribe"})
+
+    def receive(self):
+        """
+        Wait for the next line from the service, e.g. for the next update after `subscribe`.
+        @return: The message as dict.
+        """
+        return json.loads(self.lines.readline())
+
+    def publish(self, events, recommend=True):
+        """
+        Send the events of an event-list to the service one after another.
+        @param events: A pandas DataFrame with the columns "timestamp", "sensor" and "value", e.g. read from the csv file
+        of a dataset.
+        @param recommend: If true, request recommendations right before each event, i.e. for the situation in which the
+        user performed the action of the event.
+        @return: The answers to the recommend messages, one for each event.
+        """
+        to_json = lambda value: value.item() if isinstance(value, numpy.generic) else value
+        answers = []
+        for timestamp, sensor, value in zip(events["timestamp"], events["sensor"], events["value"]):
+            timestamp = str(timestamp)
+            if recommend:
+                answers.append(self.send({"type": "recommend", "timestamp": timestamp}))
+            self.send({"type": "event", "sensor": to_json(sensor), "value": to_json(value), "timestamp": timestamp})
+        return answers
@@ -6,7 +6,7 @@ import numpy
 from numpy.testing import assert_almost_equal
 from profilehooks import profile
 
-from recsys.classifiers.DS import combine_dempsters_rule
+from recsys.classifiers.DS import combine_dempsters_rule, combine_dempsters_rule_batch
 
 def test_simple_mass_distribution():
     distributions = [numpy.array([0.3, 0.4, 0.2]), numpy.array([0.1, 0.1, 0.4])]
@@ -19,6 +19,23 @@ def test_simple_mass_distribution():
     assert_almost_equal(conflict, expected_conflict)
     assert_almost_equal(theta, expected_theta)
 
+def test_batch():
+    #three situations: two sources, one source that leaves no theta, no sources at all
+    distributions = [[numpy.array([0.3, 0.4, 0.2, 0.0]), numpy.array([0.1, 0.0, 0.4, 0.0])],
+                     [numpy.array([0.0, 0.5, 0.0, 0.5]), numpy.array([0.2, 0.2, 0.0, 0.1])],
+                     []]
+    expected = [combine_dempsters_rule(masses) for masses in distributions[:2]]
+    expected.append((numpy.zeros(4), 0.0, 1.0))
+
+    batch = numpy.zeros((3, 2, 4))
+    batch[0], batch[1] = distributions[0], distributions[1]
+
+    combined = combine_dempsters_rule_batch(batch)
+    for situation, (expected_combined, expected_conflict, expected_theta) in enumerate(expected):
+        assert_almost_equal(combined[0][situation], expected_combined)
+        assert_almost_equal(combined[1][situation], expected_conflict)
+        assert_almost_equal(combined[2][situation], expected_theta)
+
 #@profile
 def test_runtime():
     def normalized_random_vector(length):
@@ -2,15 +2,19 @@
 This module tests the implementation of the Naive Bayes classifier.
 """
 
-from numpy.testing import assert_almost_equal
+from numpy.testing import assert_almost_equal, assert_array_equal, assert_equal
+import numpy
 
 from evaluation.metrics import *
 from recsys.classifiers.bayes import NaiveBayesClassifier
 from recsys.dataset import load_dataset
+from recsys.classifiers.base import times_in_seconds
 
 
 houseA_csv = "datasets/houseA.csv"
 houseA_config = "datasets/houseA.config"
+#synthetically generated event-list with 5 sensor, 3 nominal values per sensor and 500 events
+test_csv = "test/testdata.csv"
 
 
 def test_houseA():
@@ -50,3 +54,51 @@ def test_houseA():
     assert_almost_equal(metrics["Precision"].values, expected_precision, decimal=3)
     assert_almost_equal(metrics["Recall"].values, expected_recall, decimal=3)
     assert_almost_equal(metrics["F1"].values, expected_f1, decimal=3)
+
+
+def test_partial_fit():
+    """
+    Check that training the Naive Bayes classifier in several steps with `partial_fit` results in the same priors and
+    counts as training it once with all data.
+    """
+    dataset = load_dataset(test_csv)
+    expected = NaiveBayesClassifier(dataset.features, dataset.target_names)
+    expected = expected.fit(dataset.data, dataset.target)
+
+    cls = NaiveBayesClassifier(dataset.features, dataset.target_names)
+    for start, end in [(0, 200), (200, 201), (201, 450), (450, len(dataset.target))]:
+        cls = cls.partial_fit(dataset.data[start:end], dataset.target[start:end])
+
+    assert_almost_equal(cls.priors, expected.priors)
+    assert_almost_equal(cls.counts, expected.counts)
+
+
+def test_sliding_window():
+    """
+    Check that the Naive Bayes classifier with a sliding window only counts the observations inside the window.
+    """
+    dataset = load_dataset(test_csv)
+    seconds = times_in_seconds(dataset.times)
+    window = (seconds[-1] - seconds[0]) / 3.0
+    in_window = numpy.flatnonzero(seconds >= seconds[-1] - window)
+    expected = NaiveBayesClassifier(dataset.features, dataset.target_names)
+    expected = expected.fit(dataset.data[in_window], dataset.target[in_window])
+
+    cls = NaiveBayesClassifier(dataset.features, dataset.target_names, window=window)
+    for start, end in [(0, 200), (200, 450), (450, len(dataset.target))]:
+        cls = cls.partial_fit(dataset.data[start:end], dataset.target[start:end], dataset.times[start:end])
+
+    assert_array_equal(cls.priors, expected.priors)
+    assert_array_equal(cls.counts, expected.counts)
+
+
+def test_predict_parallel():
+    """
+    Check that the Naive Bayes classifier generates the same recommendations in several processes as in the current
+    process.
+    """
+    dataset = load_dataset(test_csv)
+    cls = NaiveBayesClassifier(dataset.features, dataset.target_names)
+    cls = cls.fit(dataset.data, dataset.target)
+
+    assert_equal(cls.predict(dataset.data, n_jobs=2), cls.predict(dataset.data))
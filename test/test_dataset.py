@@ -0,0 +1,294 @@
+"""
+This module tests the conversion of event-lists into datasets (recsys/dataset.py).
+"""
+
+from datetime import datetime
+import os
+import shutil
+import tempfile
+
+from numpy.testing import assert_array_equal, assert_equal
+import numpy
+import pandas
+
+from recsys.dataset import events_to_dataset, dataset_to_sklearn, load_dataset_raw, load_dataset, iter_dataset_raw, \
+    iter_dataset, SplitMatrix, write_dataset_as_npy, load_dataset_npy, load_dataset_with_state, append_events, \
+    concatenate_datasets, write_dataset_as_arff, load_datasets, Vocabulary
+
+
+#synthetically generated event-list with 5 sensor, 3 nominal values per sensor and 500 events
+data_file = "test/testdata.csv"
+
+
+def example_events():
+    """
+    The event-list used as an example in the documentation of `events_to_dataset`.
+    """
+    events = [(datetime(2012, 5, 1, 0, 0, 0), "sensor1", "on"),
+              (datetime(2012, 5, 1, 0, 0, 4), "sensor3", "off"),
+              (datetime(2012, 5, 1, 0, 0, 7), "sensor1", "off"),
+              (datetime(2012, 5, 1, 0, 0, 9), "sensor2", "on"),
+              (datetime(2012, 5, 1, 0, 0, 12), "sensor3", "on")]
+    return pandas.DataFrame(events, columns=["timestamp", "sensor", "value"])
+
+
+def timedelta_seconds(column):
+    return [numpy.nan if pandas.isnull(td) else td / numpy.timedelta64(1, "s") for td in column.values]
+
+
+def assert_datasets_equal(actual, expected):
+    assert_equal(actual.name, expected.name)
+    assert_array_equal(actual.features, expected.features)
+    assert_array_equal(actual.target_names, expected.target_names)
+    assert_array_equal(actual.target, expected.target)
+    assert_array_equal(actual.times, expected.times)
+    if isinstance(expected.data, SplitMatrix):
+        assert_array_equal(actual.data.toarray(), expected.data.toarray())
+    else:
+        assert_array_equal(numpy.isnan(actual.data), numpy.isnan(expected.data))
+        assert_array_equal(numpy.nan_to_num(actual.data), numpy.nan_to_num(expected.data))
+
+
+def test_events_to_dataset():
+    """
+    Test that sensor values are forward-filled and that the timedeltas are calculated from the last change.
+    """
+    data = events_to_dataset(example_events(), "example", [], [])
+
+    assert_equal(data.name, "example")
+    assert_array_equal(data.columns, ["sensor1", "sensor1_timedelta", "sensor2", "sensor2_timedelta",
+                                      "sensor3", "sensor3_timedelta", "action", "action_timestamp"])
+    assert_array_equal(data.index, [0, 1, 2, 3])
+    assert_array_equal(data["sensor1"].values, ["on", "on", "off", "off"])
+    assert_array_equal(timedelta_seconds(data["sensor1_timedelta"]), [4, 7, 2, 5])
+    assert_array_equal(pandas.isnull(data["sensor2"]).values, [True, True, True, False])
+    assert_array_equal(timedelta_seconds(data["sensor2_timedelta"]), [numpy.nan, numpy.nan, numpy.nan, 3])
+    assert_array_equal(data["sensor3"].values[1:], ["off", "off", "off"])
+    assert_array_equal(timedelta_seconds(data["sensor3_timedelta"]), [numpy.nan, 3, 5, 8])
+    assert_array_equal(data["action"].values, ["sensor3=off", "sensor1=off", "sensor2=on", "sensor3=on"])
+
+
+def test_events_to_dataset_excludes():
+    """
+    Test that excluded sensors are removed from the dataset and that rows for excluded actions are dropped.
+    """
+    data = events_to_dataset(example_events(), "example", ["sensor2"], ["sensor1=off"])
+
+    assert_array_equal(data.columns, ["sensor1", "sensor1_timedelta", "sensor3", "sensor3_timedelta",
+                                      "action", "action_timestamp"])
+    assert_array_equal(data["action"].values, ["sensor3=off", "sensor3=on"])
+    assert_array_equal(timedelta_seconds(data["sensor1_timedelta"]), [4, 5])
+
+
+def test_dataset_to_sklearn():
+    """
+    Test that sensor values are converted to binary features in the order in which they appear, that features are
+    missing while a sensor value is not known and that timedeltas are converted to seconds.
+    """
+    nan = numpy.nan
+    expected_features = [("sensor1", "on"), ("sensor1", "off"), ("sensor2", "on"), ("sensor3", "off"),
+                         "sensor1_timedelta", "sensor2_timedelta", "sensor3_timedelta"]
+    expected_data = [[1, 0, nan, nan, 4, nan, nan],
+                     [1, 0, nan, 1, 7, nan, 3],
+                     [0, 1, nan, 1, 2, nan, 5],
+                     [0, 1, 1, 1, 5, 3, 8]]
+
+    data = dataset_to_sklearn(events_to_dataset(example_events(), "example", [], []))
+
+    assert_equal(list(data.features), expected_features)
+    assert_array_equal(data.data, expected_data)
+    assert_array_equal(data.target, ["sensor3=off", "sensor1=off", "sensor2=on", "sensor3=on"])
+    assert_array_equal(data.target_names, ["sensor1=off", "sensor2=on", "sensor3=off", "sensor3=on"])
+
+
+def test_dataset_to_sklearn_layouts():
+    """
+    Test that the compact and sparse layouts contain the same data as the dense layout, with 0 for unknown sensor values
+    and `SplitMatrix.missing_timedelta` for unknown timedeltas.
+    """
+    raw = events_to_dataset(example_events(), "example", [], [])
+    dense = dataset_to_sklearn(raw)
+    for layout in ["compact", "sparse"]:
+        data = dataset_to_sklearn(raw, layout=layout)
+
+        assert_array_equal(data.features, dense.features)
+        assert_equal(data.data.shape, dense.data.shape)
+        assert_equal(data.data.settings.dtype, numpy.int8)
+        assert_array_equal(data.data.timedeltas, [[4, -1, -1], [7, -1, 3], [2, -1, 5], [5, 3, 8]])
+        assert_array_equal(data.data.toarray()[:, :5], numpy.nan_to_num(dense.data[:, :5]))
+        assert_array_equal(data.data[numpy.array([False, True, True, False])].toarray(), data.data.toarray()[1:3])
+
+
+def test_iter_dataset_raw():
+    """
+    Test that the streamed parts of the dataset add up to the dataset that is converted in one go, also if the chunks
+    are so small that sensor values must be carried over several chunks.
+    """
+    expected = load_dataset_raw(data_file)
+    for chunksize in [1, 7, 1000]:
+        actual = pandas.concat(list(iter_dataset_raw(data_file, chunksize=chunksize)))
+
+        assert_array_equal(actual.columns, expected.columns)
+        assert_array_equal(actual.index, expected.index)
+        for column in expected.columns:
+            assert_array_equal(pandas.isnull(actual[column]).values, pandas.isnull(expected[column]).values)
+            assert_array_equal(actual[column].dropna().values, expected[column].dropna().values)
+
+
+def test_iter_dataset():
+    """
+    Test that all streamed parts of the dataset use the same features and that they add up to the complete dataset.
+    """
+    expected = load_dataset(data_file)
+    parts = list(iter_dataset(data_file, chunksize=100))
+
+    assert_equal(len(parts), 5)
+    for part in parts:
+        assert_array_equal(part.features, expected.features)
+        assert_array_equal(part.target_names, expected.target_names)
+    assert_datasets_equal(concatenate_datasets(parts), expected)
+
+
+def test_load_dataset_cached():
+    """
+    Test that cached datasets equal freshly converted ones, that the cache is reused and that changing the csv file or
+    the config leads to a new conversion.
+    """
+    cache_dir = tempfile.mkdtemp()
+    try:
+        csv_file = os.path.join(cache_dir, "testdata.csv")
+        shutil.copy(data_file, csv_file)
+        for layout in ["dense", "compact", "sparse"]:
+            expected = load_dataset(csv_file, layout=layout)
+            for i in range(2):
+                assert_datasets_equal(load_dataset(csv_file, layout=layout, cache_dir=cache_dir), expected)
+        cached_files = [f for f in os.listdir(cache_dir) if f.endswith(".npz")]
+        assert_equal(len(cached_files), 3)
+
+        #exclude a sensor via the config
+        config_file = os.path.join(cache_dir, "testdata.config")
+        with open(config_file, "w") as f:
+            f.write("[excludes]\nexcluded_sensors = %s\n" % expected.features[0][0])
+        actual = load_dataset(csv_file, config_file, cache_dir=cache_dir)
+        assert_array_equal(actual.features, load_dataset(csv_file, config_file).features)
+
+        #drop the last events from the csv file
+        with open(csv_file) as f:
+            lines = f.readlines()
+        with open(csv_file, "w") as f:
+            f.writelines(lines[:-10])
+        actual = load_dataset(csv_file, cache_dir=cache_dir)
+        assert_equal(len(actual.target), len(load_dataset(csv_file).target))
+        assert_equal(len([f for f in os.listdir(cache_dir) if f.endswith(".npz")]), 5)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_load_dataset_npy():
+    """
+    Test that datasets stored as npy files can be read back, both memory-mapped and into memory, and that memory-mapped
+    datasets can be indexed like datasets in memory.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        for layout in ["dense", "compact", "sparse"]:
+            expected = load_dataset(data_file, layout=layout)
+            write_dataset_as_npy(expected, os.path.join(directory, layout))
+
+            actual = load_dataset_npy(os.path.join(directory, layout))
+            assert_datasets_equal(actual, expected)
+            assert_equal(isinstance(actual.target, numpy.memmap), True)
+            rows = numpy.arange(len(expected.target)) % 3 == 1
+            assert_array_equal(actual.target[rows], expected.target[rows])
+            if layout == "dense":
+                assert_array_equal(numpy.nan_to_num(actual.data[rows]), numpy.nan_to_num(expected.data[rows]))
+            else:
+                assert_array_equal(actual.data[rows].toarray(), expected.data[rows].toarray())
+
+            actual = load_dataset_npy(os.path.join(directory, layout), mmap_mode=None)
+            assert_datasets_equal(actual, expected)
+            assert_equal(actual.target.dtype, object)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_append_events():
+    """
+    Test that appending new events batch by batch to a converted dataset gives the same dataset as converting all events
+    at once, also for batches that consist of a single event.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        csv_file = os.path.join(directory, "testdata.csv")
+        events = pandas.read_csv(data_file, parse_dates=["timestamp"])
+        with open(data_file) as f:
+            lines = f.readlines()
+        with open(csv_file, "w") as f:
+            f.writelines(lines[:301])
+
+        for layout in ["dense", "compact", "sparse"]:
+            data, state = load_dataset_with_state(csv_file, layout=layout)
+            for start, end in [(300, 301), (301, 420), (420, len(events))]:
+                data = append_events(data, state, events[start:end], [], [])
+
+            expected = load_dataset(data_file, layout=layout)
+            expected.name = data.name
+            assert_datasets_equal(data, expected)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_write_dataset_as_arff():
+    """
+    Test the arff export, with a block size that does not divide the number of rows.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path_to_arff = os.path.join(directory, "example.arff")
+        write_dataset_as_arff(events_to_dataset(example_events(), "example", [], []), path_to_arff, block_size=3)
+        with open(path_to_arff) as f:
+            lines = f.read().split("\n")
+    finally:
+        shutil.rmtree(directory)
+
+    assert_equal(lines[:3], ["@relation example", "@attribute sensor1 {on,off}", "@attribute sensor1_timedelta real"])
+    assert_equal(lines[8:10], ["@attribute action_timestamp date \"yyyy-MM-dd HH:mm:ss\"", ""])
+    assert_equal(lines[10:], ["@data",
+                              "on,4,?,?,?,?,sensor3=off,\"2012-05-01 00:00:04\"",
+                              "on,7,?,?,off,3,sensor1=off,\"2012-05-01 00:00:07\"",
+                              "off,2,?,?,off,5,sensor2=on,\"2012-05-01 00:00:09\"",
+                              "off,5,on,3,off,8,sensor3=on,\"2012-05-01 00:00:12\"",
+                              ""])
+
+
+def test_load_datasets():
+    """
+    Test that several houses can be loaded in parallel and that errors are reported for each house separately.
+    """
+    houses = [(data_file, None), ("test/does_not_exist.csv", None), (data_file, "test/does_not_exist.config"),
+              (data_file, None)]
+    datasets, errors = load_datasets(houses, layout="compact", processes=2)
+
+    expected = load_dataset(data_file, layout="compact")
+    assert_datasets_equal(datasets[0], expected)
+    assert_datasets_equal(datasets[3], expected)
+    assert_equal([data is None for data in datasets], [False, True, True, False])
+    assert_equal([error is None for error in errors], [True, False, False, True])
+    assert "does_not_exist.csv" in errors[1]
+    assert "does_not_exist.config" in errors[2]
+
+
+def test_vocabulary():
+    """
+    Test the integer ids for sensors, settings and targets.
+    """
+    features = [("door", "open"), ("door", "closed"), ("tv", "on"), "door_timedelta", "tv_timedelta"]
+    vocabulary = Vocabulary(features, ["tv=on", "door=open", "light=on"])
+
+    assert_array_equal(vocabulary.targets, ["door=open", "light=on", "tv=on"])
+    assert_array_equal(vocabulary.setting_sensor, [0, 0, 1])
+    assert_array_equal(vocabulary.setting_timedelta, [0, 0, 1])
+    assert_array_equal(vocabulary.target_setting, [0, -1, 2])
+    assert_array_equal(vocabulary.setting_target, [0, -1, 2])
+    assert_array_equal(vocabulary.target_ids(["tv=on", "door=closed"]), [2, -1])
+    assert_array_equal(vocabulary.possible_targets_mask(numpy.array([1, 2])), [1, 1, 0])
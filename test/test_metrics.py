@@ -212,5 +212,31 @@ def test_recall_multiple():
     assert_almost_equal(expected, rec["Recall"].values)
 
 
+"""
+Following two methods test the overall metrics and the confusion matrix
+"""
 
+def test_calculate():
+    targets = ["A", "B", "A"]
+    recommendations = [["A", "B"], ["A"], ["B", "A"]]
+    #precision for "A": [1/2, 2/3], for "B": [0, 0]; recall for "A": [1/2, 1], for "B": [0, 0]
+    #"A" occurs twice and "B" once -> weights 2/3 and 1/3
+    expected_precision = [1.0/3.0, 4.0/9.0]
+    expected_recall = [1.0/3.0, 2.0/3.0]
+    expected_f1 = [1.0/3.0, 1.6/3.0]
+    expected_number = [1.0, 5.0/3.0]
+
+    metrics = QualityMetricsCalculator(targets, recommendations).calculate()
+    assert_almost_equal(expected_precision, metrics["Precision"].values)
+    assert_almost_equal(expected_recall, metrics["Recall"].values)
+    assert_almost_equal(expected_f1, metrics["F1"].values)
+    assert_almost_equal(expected_number, metrics["# of recommendations"].values)
+
+
+def test_confusion_matrix():
+    targets = ["A", "B", "A"]
+    recommendations = [["A", "B"], ["A"], ["B", "A"]]
+    expected = [[1, 1], [1, 0]]
 
+    matrix = QualityMetricsCalculator(targets, recommendations).confusion_matrix()
+    assert_almost_equal(expected, matrix.loc[["A", "B"], ["A", "B"]].values)
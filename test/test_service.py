@@ -0,0 +1,197 @@
+"""
+This module tests the recommendation service (recsys/service.py) with the synthetically generated test dataset.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from numpy.testing import assert_array_equal, assert_equal, assert_almost_equal
+import numpy
+import pandas
+
+from recsys.dataset import load_dataset
+from recsys.classifiers.temporal import TemporalEvidencesClassifier
+from recsys.service import SituationTracker, UpdateScheduler, RecommendationService, ServiceThread, EventPublisher, \
+    parse_timestamp
+
+
+#synthetically generated event-list with 5 sensor, 3 nominal values per sensor and 500 events
+data_file = "test/testdata.csv"
+
+
+def train_classifier():
+    data = load_dataset(data_file)
+    cls = TemporalEvidencesClassifier(data.features, data.target_names)
+    return data, cls.fit(data.data, data.target)
+
+
+def test_situation_tracker():
+    """
+    Test that the tracker describes the situation before each event in the same way as the converted dataset, both as
+    data row and as active settings with their bins.
+    """
+    data, cls = train_classifier()
+    events = pandas.read_csv(data_file)
+    settings, timedeltas = cls.split_data(data.data)
+    tracker = SituationTracker(cls)
+    for i, (timestamp, sensor, value) in enumerate(zip(events["timestamp"], events["sensor"], events["value"])):
+        #the dataset contains no row for the very first user action
+        if i > 0:
+            assert_array_equal(tracker.as_row(parse_timestamp(timestamp))[0], data.data[i - 1])
+            active_settings = numpy.flatnonzero(settings[i - 1] == 1)
+            assert_array_equal(tracker.active_settings(), active_settings)
+            expected_bins = cls.digitize_timedeltas(timedeltas[i - 1, cls.vocabulary.setting_timedelta[active_settings]])
+            assert_array_equal(tracker.bins(parse_timestamp(timestamp)), expected_bins)
+        tracker.update(sensor, value, parse_timestamp(timestamp))
+
+
+def test_update_scheduler():
+    """
+    Test that the scheduler returns the same recommendations as calculating them from scratch at any point in time,
+    while recalculating them much less often, and that subscribers always know the current recommendations.
+    """
+    data, cls = train_classifier()
+    events = pandas.read_csv(data_file)[:30]
+    timestamps = map(parse_timestamp, events["timestamp"])
+    tracker = SituationTracker(cls)
+    scheduler = UpdateScheduler(cls, SituationTracker(cls))
+    subscribed = UpdateScheduler(cls, SituationTracker(cls))
+    updates = []
+    first = subscribed.subscribe(updates.append, timestamps[0])
+
+    num_requests = 0
+    for i, (timestamp, sensor, value) in enumerate(zip(timestamps, events["sensor"], events["value"])):
+        for scheduler_or_tracker in [tracker, scheduler, subscribed]:
+            scheduler_or_tracker.update(sensor, value, timestamp) if scheduler_or_tracker is tracker \
+                else scheduler_or_tracker.event(sensor, value, timestamp)
+
+        #request recommendations every 5 seconds until the next event
+        end = timestamps[i + 1] if i + 1 < len(timestamps) else timestamp + 400 * 10**9
+        for request in range(timestamp, min(end, timestamp + 400 * 10**9), 5 * 10**9):
+            expected = cls.predict(tracker.as_row(request), include_conflict_theta=True)[0]
+            assert_equal(scheduler.recommendations(request), expected)
+            subscribed.advance(request)
+            current = [update for update in updates if update["timestamp"] <= request / 1e9]
+            current = current[-1] if len(current) > 0 else first
+            assert_equal((current["recommendations"], current["conflict"], current["theta"]), expected)
+            num_requests += 1
+
+    assert scheduler.counters["recalculations"] < num_requests / 2
+    assert_equal(subscribed.counters["updates"], len(updates))
+
+
+def test_service():
+    """
+    Test that the service answers with the same recommendations as the classifier when the events of the test dataset
+    are replayed over a TCP socket, and that invalid messages are answered with errors.
+    """
+    data, cls = train_classifier()
+    expected_recommendations = cls.predict(data.data, include_conflict_theta=True)
+
+    service = ServiceThread(RecommendationService(cls))
+    publisher = EventPublisher(service.address)
+    try:
+        answers = publisher.publish(pandas.read_csv(data_file))
+        assert_equal(len(answers), len(expected_recommendations) + 1)
+        for answer, (recommendations, conflict, theta) in zip(answers[1:], expected_recommendations):
+            assert_equal(answer["type"], "recommendations")
+            assert_array_equal(answer["recommendations"], recommendations)
+            assert_almost_equal([answer["conflict"], answer["theta"]], [conflict, theta])
+
+        assert_equal(publisher.send({"type": "event", "sensor": "unknown", "value": "on", "id": 7})["type"], "error")
+        assert_equal(publisher.send({"type": "statistics", "id": 8})["id"], 8)
+        publisher.socket.sendall("not json\n")
+        assert_equal(json.loads(publisher.lines.readline())["type"], "error")
+
+        statistics = publisher.send({"type": "statistics"})
+        assert_equal([statistics["events"], statistics["recommendations"], statistics["errors"]],
+                     [len(answers), len(answers), 2])
+        assert statistics["latency_max"] >= statistics["latency_median"] > 0
+    finally:
+        publisher.close()
+        service.stop()
+
+
+def test_service_subscribe():
+    """
+    Test that subscribers receive the updates of the service, both when replaying an event-list and in real time.
+    """
+    data, cls = train_classifier()
+    service = ServiceThread(RecommendationService(cls), realtime=False)
+    publisher, subscriber = EventPublisher(service.address), EventPublisher(service.address)
+    try:
+        assert_equal(subscriber.subscribe()["type"], "subscribed")
+        events = pandas.read_csv(data_file)[:30]
+        publisher.publish(events, recommend=False)
+        num_updates = publisher.send({"type": "statistics"})["updates"]
+        updates = [subscriber.receive() for update in range(num_updates)]
+        assert_equal(set(update["type"] for update in updates), {"update"})
+        latest = publisher.send({"type": "recommend", "timestamp": events["timestamp"].values[-1]})
+        assert_equal(updates[-1]["recommendations"], latest["recommendations"])
+    finally:
+        publisher.close()
+        subscriber.close()
+        service.stop()
+
+    #in real time, the recommendations are recalculated when the timedelta of the sensor reaches the first border of
+    #the bins (10 seconds)
+    service = ServiceThread(RecommendationService(cls))
+    publisher, subscriber = EventPublisher(service.address), EventPublisher(service.address)
+    try:
+        subscriber.subscribe()
+        sensor, value = cls.settings_columns[0]
+        publisher.send({"type": "event", "sensor": sensor, "value": value, "timestamp": time.time() - 9.5})
+        assert_equal(publisher.send({"type": "statistics"})["recalculations"], 2)
+        time.sleep(1.5)
+        assert_equal(publisher.send({"type": "statistics"})["recalculations"], 3)
+    finally:
+        publisher.close()
+        subscriber.close()
+        service.stop()
+
+
+def test_service_late_subscriber():
+    """
+    Test that a subscriber that arrives long after the last event gets the recommendations for the current time, and
+    that the ticks since the last event are not pushed as outdated updates.
+    """
+    data, cls = train_classifier()
+    service = ServiceThread(RecommendationService(cls))
+    publisher, subscriber = EventPublisher(service.address), EventPublisher(service.address)
+    try:
+        start = time.time()
+        for sensor, value in cls.settings_columns[:3]:
+            publisher.send({"type": "event", "sensor": sensor, "value": value, "timestamp": start - 200})
+        subscribed = subscriber.subscribe()
+        assert subscribed["timestamp"] >= start
+        latest = publisher.send({"type": "recommend", "timestamp": subscribed["timestamp"]})
+        assert_equal(subscribed["recommendations"], latest["recommendations"])
+
+        time.sleep(0.5)
+        num_updates = publisher.send({"type": "statistics"})["updates"]
+        updates = [subscriber.receive() for update in range(num_updates)]
+        assert all(update["timestamp"] >= start for update in updates)
+    finally:
+        publisher.close()
+        subscriber.close()
+        service.stop()
+
+
+def test_service_unix_socket():
+    """
+    Test that the service can be reached over a Unix socket.
+    """
+    data, cls = train_classifier()
+    directory = tempfile.mkdtemp()
+    service = ServiceThread(RecommendationService(cls), unix_socket=os.path.join(directory, "service.sock"))
+    try:
+        publisher = EventPublisher(service.address)
+        answers = publisher.publish(pandas.read_csv(data_file)[:10])
+        publisher.close()
+        assert_equal([answer["type"] for answer in answers], ["recommendations"] * 10)
+    finally:
+        service.stop()
+        shutil.rmtree(directory)
@@ -3,13 +3,21 @@ This module tests the proposed classifier (classifiers/temporal.py) with a synth
 """
 
 import json
+import os
+import shutil
+import tempfile
 
-from numpy.testing import assert_array_equal, assert_equal, assert_almost_equal
-from numpy import array
+from numpy.testing import assert_array_equal, assert_equal, assert_almost_equal, assert_raises
+from numpy import array, nan
+import numpy
 import pandas
+from scipy import sparse
 
 from recsys.dataset import load_dataset
-from recsys.classifiers.temporal import TemporalEvidencesClassifier, Source
+from recsys.classifiers import temporal
+from recsys.classifiers.temporal import TemporalEvidencesClassifier, Source, load_classifier, update_csr
+from recsys.classifiers.DS import combine_dempsters_rule_batch
+from recsys.classifiers.base import times_in_seconds
 
 
 #synthetically generated event-list with 5 sensor, 3 nominal values per sensor and 500 events
@@ -38,6 +46,145 @@ def test_train():
         assert_source_equal(cls.sources[name], expected_sources[name])
 
 
+def test_train_model():
+    """
+    Test that the observations in the model of the classifier agree with the observations of the sources.
+    """
+    data = load_dataset(data_file)
+    cls = TemporalEvidencesClassifier(data.features, data.target_names)
+    cls = cls.fit(data.data, data.target)
+
+    sources = sources_from_json(sources_file)
+    assert_equal(cls.model.counts.shape, (len(sources), len(cls.bins) + 1, len(cls.target_names)))
+    assert_almost_equal(cls.model.max_total, max(source.total_counts.sum() for source in sources.values()))
+    assert_almost_equal(cls.model.max_temporal, max(source.max_temporal() for source in sources.values()))
+
+
+def test_partial_fit():
+    """
+    Test that training the classifier in several steps with `partial_fit` results in the same model as training it
+    once with all data.
+    """
+    data = load_dataset(data_file)
+    for layout in ["dense", "sparse"]:
+        expected = TemporalEvidencesClassifier(data.features, data.target_names, layout=layout)
+        expected = expected.fit(data.data, data.target)
+
+        cls = TemporalEvidencesClassifier(data.features, data.target_names, layout=layout)
+        for start, end in [(0, 200), (200, 201), (201, 450), (450, len(data.target))]:
+            cls = cls.partial_fit(data.data[start:end], data.target[start:end])
+
+        assert_equal(cls.model.max_total, expected.model.max_total)
+        assert_equal(cls.model.max_temporal, expected.model.max_temporal)
+        for name in expected.sources.keys():
+            assert_source_equal(cls.sources[name], expected.sources[name])
+        assert_almost_equal(cls.model.total_masses, expected.model.total_masses)
+        if layout == "sparse":
+            assert_almost_equal(cls.model.masses.toarray(), expected.model.masses.toarray())
+        else:
+            assert_almost_equal(cls.model.masses, expected.model.masses)
+
+
+def test_update_csr():
+    """
+    Test that entries of a sparse matrix are updated in place if they are stored already, and that new entries are
+    inserted otherwise.
+    """
+    expected = array([[0.0, 1.0, 0.0, 2.0], [0.0, 0.0, 0.0, 0.0], [3.0, 0.0, 4.0, 5.0]])
+    matrix = sparse.csr_matrix(expected)
+
+    #stored entries are changed in place, zeros for entries that are not stored are ignored
+    rows, columns = array([2, 0, 1]), array([2, 1, 3])
+    actual = update_csr(matrix, rows, columns, array([1.5, 7.0, 0.0]))
+    expected[rows, columns] = [1.5, 7.0, 0.0]
+    assert actual is matrix
+    assert_array_equal(actual.toarray(), expected)
+
+    #new entries are inserted, the indices stay sorted
+    rows, columns = array([2, 1, 0, 1, 0]), array([1, 3, 2, 0, 3])
+    actual = update_csr(matrix, rows, columns, array([1.0, 2.0, 3.0, 4.0, 5.0]), add=True)
+    expected[rows, columns] += [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert_array_equal(actual.toarray(), expected)
+    assert_equal(actual.nnz, 9)
+    for row in range(3):
+        row_indices = actual.indices[actual.indptr[row]:actual.indptr[row + 1]]
+        assert_array_equal(row_indices, numpy.sort(row_indices))
+
+
+def test_sliding_window():
+    """
+    Test that a classifier with a sliding window only counts the observations inside the window, also when it is
+    trained in several steps.
+    """
+    data = load_dataset(data_file)
+    seconds = times_in_seconds(data.times)
+    window = (seconds[-1] - seconds[0]) / 3.0
+    in_window = numpy.flatnonzero(seconds >= seconds[-1] - window)
+    expected = TemporalEvidencesClassifier(data.features, data.target_names)
+    expected = expected.fit(data.data[in_window], data.target[in_window])
+
+    cls = TemporalEvidencesClassifier(data.features, data.target_names, window=window)
+    for start, end in [(0, 200), (200, 201), (201, 450), (450, len(data.target))]:
+        cls = cls.partial_fit(data.data[start:end], data.target[start:end], data.times[start:end])
+
+    assert_array_equal(cls.model.counts, expected.model.counts)
+    for name in expected.sources.keys():
+        assert_source_equal(cls.sources[name], expected.sources[name])
+
+
+def test_half_life():
+    """
+    Test that a classifier with exponential decay counts recent observations more, and that training it in several
+    steps results in the same model as training it once with all data.
+    """
+    data = load_dataset(data_file)
+    seconds = times_in_seconds(data.times)
+    half_life = (seconds[-1] - seconds[0]) / 10.0
+    expected = TemporalEvidencesClassifier(data.features, data.target_names, half_life=half_life)
+    expected = expected.fit(data.data, data.target, data.times)
+
+    cls = TemporalEvidencesClassifier(data.features, data.target_names, half_life=half_life)
+    for start, end in [(0, 200), (200, 201), (201, 450), (450, len(data.target))]:
+        cls = cls.partial_fit(data.data[start:end], data.target[start:end], data.times[start:end])
+
+    assert_almost_equal(cls.model.masses, expected.model.masses)
+    #the latest observation has weight 1, the first observation has weight 2^-10
+    assert_almost_equal(cls.history.scale() * numpy.exp(numpy.log(2) / half_life *
+                                                        (seconds[[0, -1]] - cls.history.reference_time)),
+                        [2 ** -10.0, 1.0])
+
+
+def test_digitize_timedeltas():
+    """
+    Test that timedeltas are mapped to the same bins with and without lookup table, and in the same way as with
+    `numpy.digitize`.
+    """
+    data = load_dataset(data_file)
+    cls = TemporalEvidencesClassifier(data.features, data.target_names)
+    timedeltas = array([[0.0, 9.99, 10.0, 59.5], [60.0, 299.9, 300.0, nan], [-1.0, 1e9, 150.2, 89.0]])
+    expected_bins = array([[0, 0, 1, 5], [6, 13, -1, -1], [0, -1, 9, 6]])
+
+    assert_array_equal(cls.digitize_timedeltas(timedeltas), expected_bins)
+    cls.bins_lookup_table = None
+    assert_array_equal(cls.digitize_timedeltas(timedeltas), expected_bins)
+
+
+def test_calculate_masses_zero_counts():
+    """
+    Test that a source without any observations attributes zero masses to all targets, also if the maximum numbers of
+    observations are zero.
+    """
+    targets = ["a", "b", "c"]
+    total = pandas.Series([0, 0, 0], index=targets)
+    temporal = pandas.DataFrame([[0, 0], [0, 0], [0, 0]], index=targets, columns=[0, 1])
+    source = Source("sensor", "value", total, temporal)
+    mask = array([1.0, 0.0, 1.0])
+
+    for max_total, max_temporal in [(0, 0), (0.0, 0.0), (5, 3)]:
+        for bin in [0, 1, -1]:
+            assert_array_equal(source.calculate_masses(bin, mask, max_total, max_temporal), [0.0, 0.0, 0.0])
+
+
 def test_recommend():
     """
     Test that the classifier generates the correct recommendations for the test dataset.
@@ -58,6 +205,206 @@ def test_recommend():
         assert_recommendations_equal(actual, expected)
 
 
+def test_recommend_sparse_layout():
+    """
+    Test that the classifier generates the same recommendations for the sparse layout of the test dataset as for the
+    dense layout.
+    """
+    dense = load_dataset(data_file)
+    cls = TemporalEvidencesClassifier(dense.features, dense.target_names)
+    expected_recommendations = cls.fit(dense.data, dense.target).predict(dense.data, include_conflict_theta=True)
+
+    data = load_dataset(data_file, layout="sparse")
+    cls = TemporalEvidencesClassifier(data.features, data.target_names)
+    actual_recommendations = cls.fit(data.data, data.target).predict(data.data, include_conflict_theta=True)
+
+    assert_equal(len(actual_recommendations), len(expected_recommendations))
+    for actual, expected in zip(actual_recommendations, expected_recommendations):
+        assert_array_equal(actual[0], expected[0])
+        assert_almost_equal(actual[1:], expected[1:])
+
+
+def test_recommend_sparse_model():
+    """
+    Test that the classifier generates the same recommendations when storing its observations in the sparse layout.
+    """
+    data = load_dataset(data_file)
+    cls = TemporalEvidencesClassifier(data.features, data.target_names)
+    expected_recommendations = cls.fit(data.data, data.target).predict(data.data, include_conflict_theta=True)
+
+    cls = TemporalEvidencesClassifier(data.features, data.target_names, layout="sparse")
+    actual_recommendations = cls.fit(data.data, data.target).predict(data.data, include_conflict_theta=True)
+
+    assert_equal(cls.model.layout, "sparse")
+    assert_equal(len(actual_recommendations), len(expected_recommendations))
+    for actual, expected in zip(actual_recommendations, expected_recommendations):
+        assert_array_equal(actual[0], expected[0])
+        assert_almost_equal(actual[1:], expected[1:])
+
+
+def test_recommend_batches():
+    """
+    Test that the classifier generates the same recommendations independent of how many instances are combined at once,
+    and that the masses combined at once stay within the limit of the classifier.
+    """
+    data = load_dataset(data_file)
+    cls = TemporalEvidencesClassifier(data.features, data.target_names)
+    cls = cls.fit(data.data, data.target)
+    expected_recommendations = cls.predict(data.data, include_conflict_theta=True)
+
+    #record the masses that are combined at once, these should stay within the limit of the classifier
+    combined_shapes = []
+    def combine_recorded(masses):
+        combined_shapes.append(masses.shape)
+        return combine_dempsters_rule_batch(masses)
+
+    for batch_elements in [1, 2000, 10 ** 9]:
+        cls.batch_elements = batch_elements
+        del combined_shapes[:]
+        temporal.combine_dempsters_rule_batch = combine_recorded
+        try:
+            actual_recommendations = cls.predict(data.data, include_conflict_theta=True)
+        finally:
+            temporal.combine_dempsters_rule_batch = combine_dempsters_rule_batch
+
+        assert_equal(len(actual_recommendations), len(expected_recommendations))
+        for actual, expected in zip(actual_recommendations, expected_recommendations):
+            assert_array_equal(actual[0], expected[0])
+            assert_almost_equal(actual[1:], expected[1:])
+        for num_instances, num_settings, num_targets in combined_shapes:
+            assert num_instances == 1 or num_instances * num_settings * num_targets <= batch_elements
+
+    #without a limit all instances are combined at once
+    assert_equal(len(combined_shapes), 1)
+
+
+def test_recommend_situation():
+    """
+    Test that the classifier generates the same recommendations for situations given by active settings and bins as
+    for the rows of the test dataset.
+    """
+    data = load_dataset(data_file)
+    for cache_size in [None, 100]:
+        cls = TemporalEvidencesClassifier(data.features, data.target_names, cache_size=cache_size)
+        cls = cls.fit(data.data, data.target)
+        expected_recommendations = cls.predict(data.data, include_conflict_theta=True)
+
+        settings, timedeltas = cls.split_data(data.data)
+        for instance in range(0, len(data.target), 7):
+            active_settings = numpy.flatnonzero(settings[instance] == 1)
+            bins = cls.digitize_timedeltas(timedeltas[instance, cls.vocabulary.setting_timedelta[active_settings]])
+            actual = cls.predict_situation(active_settings, bins, include_conflict_theta=True)
+            assert_equal(actual, expected_recommendations[instance])
+            assert_equal(cls.predict_situation(active_settings, bins), expected_recommendations[instance][0])
+
+
+def test_recommend_parallel():
+    """
+    Test that the classifier generates the same recommendations in several processes as in the current process, for
+    both layouts of the dataset.
+    """
+    for layout in ["dense", "sparse"]:
+        data = load_dataset(data_file, layout=layout)
+        cls = TemporalEvidencesClassifier(data.features, data.target_names)
+        cls = cls.fit(data.data, data.target)
+        expected_recommendations = cls.predict(data.data, include_conflict_theta=True)
+
+        actual_recommendations = cls.predict(data.data, include_conflict_theta=True, n_jobs=3)
+        assert_equal(actual_recommendations, expected_recommendations)
+
+
+def test_recommend_duplicates():
+    """
+    Test that the classifier generates independent and correct recommendations for instances that are in the same
+    situation.
+    """
+    data = load_dataset(data_file)
+    cls = TemporalEvidencesClassifier(data.features, data.target_names)
+    cls = cls.fit(data.data, data.target)
+    expected_recommendations = cls.predict(data.data, include_conflict_theta=True)
+
+    instances = numpy.r_[numpy.arange(len(data.target)), numpy.arange(0, len(data.target), 3)]
+    actual_recommendations = cls.predict(data.data[instances], include_conflict_theta=True)
+
+    assert_equal(len(actual_recommendations), len(instances))
+    for instance, actual in zip(instances, actual_recommendations):
+        assert_array_equal(actual[0], expected_recommendations[instance][0])
+        assert_equal(actual[1:], expected_recommendations[instance][1:])
+    assert actual_recommendations[0][0] is not actual_recommendations[len(data.target)][0]
+
+
+def test_recommend_cached():
+    """
+    Test that the classifier generates the same recommendations with a cache, and that the cache is cleared when the
+    classifier is trained again.
+    """
+    data = load_dataset(data_file)
+    cls = TemporalEvidencesClassifier(data.features, data.target_names)
+    expected_recommendations = cls.fit(data.data, data.target).predict(data.data, include_conflict_theta=True)
+
+    cls = TemporalEvidencesClassifier(data.features, data.target_names, cache_size=50)
+    cls = cls.fit(data.data, data.target)
+    for include_conflict_theta in [True, False, True]:
+        actual_recommendations = cls.predict(data.data, include_conflict_theta=include_conflict_theta)
+        assert_equal(len(actual_recommendations), len(expected_recommendations))
+        for actual, expected in zip(actual_recommendations, expected_recommendations):
+            if include_conflict_theta:
+                assert_array_equal(actual[0], expected[0])
+                assert_almost_equal(actual[1:], expected[1:])
+            else:
+                assert_array_equal(actual, expected[0])
+
+    #the cache is looked up once for each distinct situation in the test data
+    num_situations = len(set((tuple(recommendations), conflict, theta)
+                             for recommendations, conflict, theta in expected_recommendations))
+    assert_equal(len(cls.cache), 50)
+    assert_equal(cls.cache.hits + cls.cache.misses, 3 * num_situations)
+    assert cls.cache.hits > 0
+
+    cls = cls.partial_fit(data.data[:10], data.target[:10])
+    assert_equal(len(cls.cache), 0)
+
+
+def test_save_load():
+    """
+    Test that a stored classifier generates the same recommendations as the original classifier and can be trained
+    further in the same way, both memory-mapped and in memory.
+    """
+    data = load_dataset(data_file)
+    seconds = times_in_seconds(data.times)
+    window = (seconds[-1] - seconds[0]) / 3.0
+    directory = tempfile.mkdtemp()
+    try:
+        for layout in ["dense", "sparse"]:
+            expected = TemporalEvidencesClassifier(data.features, data.target_names, layout=layout, window=window)
+            expected = expected.fit(data.data[:400], data.target[:400], data.times[:400])
+            expected.save(os.path.join(directory, layout))
+            expected_recommendations = expected.predict(data.data, include_conflict_theta=True)
+            expected = expected.partial_fit(data.data[400:], data.target[400:], data.times[400:])
+
+            for mmap_mode in ["c", None]:
+                actual = load_classifier(os.path.join(directory, layout), mmap_mode=mmap_mode)
+                assert_equal(actual.model.layout, layout)
+                actual_recommendations = actual.predict(data.data, include_conflict_theta=True)
+                assert_equal(actual_recommendations, expected_recommendations)
+
+                actual = actual.partial_fit(data.data[400:], data.target[400:], data.times[400:])
+                assert_equal(actual.model.max_total, expected.model.max_total)
+                for name in expected.sources.keys():
+                    assert_source_equal(actual.sources[name], expected.sources[name])
+
+        #stored classifiers in other versions of the format can not be loaded
+        metadata_file = os.path.join(directory, "dense", "metadata.json")
+        with open(metadata_file) as f:
+            metadata = json.load(f)
+        metadata["version"] = 0
+        with open(metadata_file, "w") as f:
+            json.dump(metadata, f)
+        assert_raises(ValueError, load_classifier, os.path.join(directory, "dense"))
+    finally:
+        shutil.rmtree(directory)
+
+
 """
 Below here are only utility functions.
 """